@@ -4,12 +4,21 @@ Base gate class for specific databases.
 """
 
 import os
+import re
 import sys
+import uuid
+import io
+import select
 import textwrap
 import abc
 import typing
-from subprocess import Popen, PIPE, STDOUT
+import threading
+import collections
+import functools
+from subprocess import Popen, PIPE, STDOUT, TimeoutExpired
 from smdba.utils import eprint
+from smdba.filesystem import get_usage
+from smdba.output import Output
 
 # pylint: disable=W0622
 
@@ -20,6 +29,328 @@ class GateException(Exception):
     """
 
 
+class SessionException(GateException):
+    """
+    Session exception.
+    """
+
+    def __init__(self, message: str, output: str = "", started: bool = False,
+                 returncode: typing.Optional[int] = None) -> None:
+        GateException.__init__(self, message)
+        self.output = output
+        self.started = started
+        self.returncode = returncode
+
+
+class ScenarioTemplate:
+    """
+    Scenario, split into text and "@name" placeholders once.
+
+    Values of placeholders within SQL string literals are quoted. Values of other
+    placeholders must be identifiers or unsigned numbers, optionally with a size
+    unit, so they cannot change the statement. Comments are not scanned.
+    """
+
+    IN_TEXT = re.compile(r"'|--[^\n]*|/\*.*?(?:\*/|$)|@([A-Za-z_][A-Za-z0-9_]*)", re.S)
+    IN_LITERAL = re.compile(r"'|@([A-Za-z_][A-Za-z0-9_]*)")
+    PLAIN_VALUE = re.compile(r"^(?:[A-Za-z_][A-Za-z0-9_]*|[0-9]+(?:\.[0-9]+)?[A-Za-z]?)$")
+    LITERAL_VALUE = re.compile(r"^[^\x00-\x1f]*$")
+
+    def __init__(self, name: str, text: str) -> None:
+        self.name = name
+        self.text = text
+        self.tokens: typing.List[typing.Tuple[str, bool]] = []  # Text or placeholder name, quoted placeholder flag
+        self.placeholders: typing.Set[str] = set()
+
+        offset = start = 0
+        quoted = False
+        while True:
+            match = (self.IN_LITERAL if quoted else self.IN_TEXT).search(text, offset)
+            if match is None:
+                break
+            offset = match.end()
+            if match.group() == "'":
+                quoted = not quoted
+            elif match.group(1):
+                self.tokens.append((text[start:match.start()], False))
+                self.tokens.append(("@" + match.group(1), quoted))
+                self.placeholders.add(match.group(1))
+                start = offset
+        self.tokens.append((text[start:], False))
+
+    def bind(self, name: str, value: typing.Union[str, int, float], quoted: bool) -> str:
+        """
+        Convert value of the placeholder to the scenario text.
+
+        :raises GateException: if value is not safe outside of a string literal.
+        """
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            # Negative number after a minus would start a comment
+            return str(value) if value >= 0 else "({})".format(value)
+        value = str(value)
+        if quoted and self.LITERAL_VALUE.match(value):
+            return value.replace("'", "''")
+        if not self.PLAIN_VALUE.match(value):
+            raise GateException("Value \"{}\" of \"{}\" is not allowed in scenario \"{}\"".format(value, name, self.name))
+
+        return value
+
+    def render(self, **variables: typing.Union[str, int, float]) -> str:
+        """
+        Render scenario with the variables.
+
+        :raises GateException: if some placeholder is not bound.
+        """
+        missing = self.placeholders - set(variables)
+        if missing:
+            raise GateException("Scenario \"{}\" requires {}".format(self.name, ", ".join(sorted(missing))))
+
+        out = []
+        for idx, (token, quoted) in enumerate(self.tokens):
+            out.append(self.bind(token[1:], variables[token[1:]], quoted) if idx % 2 else token)
+
+        return "".join(out)
+
+
+class ScenarioRegistry:
+    """
+    All scenarios of the package, read and split once on the first use.
+    Rendered scenarios are cached.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._scenarios: typing.Optional[typing.Dict[str, ScenarioTemplate]] = None
+
+    def get(self, name: str) -> ScenarioTemplate:
+        """
+        Get scenario by name.
+
+        :raises IOError: if scenario does not exist.
+        """
+        if self._scenarios is None:
+            scenarios = {}
+            for fname in os.listdir(self.path) if os.path.isdir(self.path) else []:
+                if fname.endswith(".scn"):
+                    with open(os.path.join(self.path, fname)) as scn:
+                        scenarios[fname[:-4]] = ScenarioTemplate(fname[:-4], scn.read())
+            self._scenarios = scenarios
+
+        if name not in self._scenarios:
+            raise IOError("Scenario '{}' is not accessible.".format(os.path.join(self.path, name + ".scn")))
+
+        return self._scenarios[name]
+
+    @functools.lru_cache(maxsize=0x100)
+    def _render(self, name: str, variables: typing.Tuple[typing.Tuple[str, typing.Any], ...]) -> str:
+        """
+        Render scenario, cached by its name and variables.
+        """
+        return self.get(name).render(**dict(variables))
+
+    def render(self, name: str, **variables: typing.Union[str, int, float]) -> str:
+        """
+        Render scenario with the variables.
+        """
+        return self._render(name, tuple(sorted(variables.items())))
+
+
+SCENARIOS = ScenarioRegistry(os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios"))
+
+
+class ScenarioSession:
+    """
+    Long-lived client (psql, sqlplus or rman) to run many scenarios.
+
+    Each scenario is framed by two sentinel lines, echoed by the client itself,
+    so the output in between belongs to exactly one scenario. Everything outside
+    of the frame (banners, prompts, command acknowledgements) is discarded.
+    """
+
+    HANDSHAKE_TIMEOUT = 30
+
+    # Longest silence of a running scenario, before the client is considered stalled
+    TIMEOUT = 4 * 3600
+
+    # SQL*Plus commands, which are complete without a terminator
+    SQLPLUS_COMMAND = re.compile(r"^(@|(SET|PROMPT|COL|COLUMN|CLEAR|SPOOL|HOST|STORE|TTITLE|BTITLE|BREAK|COMPUTE|"
+                                 r"SHOW|DEFINE|UNDEFINE|WHENEVER|EXEC|EXECUTE|CONNECT)\b)", re.IGNORECASE)
+    PLSQL_BLOCK = re.compile(r"^\s*(BEGIN|DECLARE|CREATE\s+(OR\s+REPLACE\s+)?(PROCEDURE|FUNCTION|PACKAGE|TRIGGER|TYPE))\b",
+                             re.IGNORECASE | re.MULTILINE)
+
+    def __init__(self, target: str, command: typing.List[str], prologue: str = "") -> None:
+        """
+        Start the client and wait until it answers the first frame.
+
+        :param target: client type: psql, sqlplus or rman.
+        :param command: command line, which starts the client reading STDIN.
+        :param prologue: statements, sent once after the client started (login etc).
+        :raises SessionException: if client did not start.
+        """
+        self.target = target
+        self._buff = b""
+        self._restore: typing.Optional[str] = None
+        self._proc = Popen(command, stdout=PIPE, stdin=PIPE, stderr=STDOUT, env=os.environ)
+
+        if target == 'sqlplus':
+            # SQL*Plus keeps SET options per session, which would leak between scenarios
+            self._restore = "/tmp/smdba-session-{}.sql".format(uuid.uuid4().hex)
+            prologue = '\n'.join(filter(None, [prologue, "STORE SET {} REPLACE".format(self._restore)]))
+
+        try:
+            self.execute(prologue, timeout=self.HANDSHAKE_TIMEOUT)
+        except SessionException:
+            self.close()
+            raise
+
+    def _marker(self, tag: str) -> str:
+        """
+        Get client statement, printing the tag on a separate line.
+
+        :param tag: sentinel tag
+        :returns: client statement
+        """
+        if self.target == 'psql':
+            marker = "\\echo " + tag
+        elif self.target == 'sqlplus':
+            marker = "PROMPT " + tag
+        elif self.target == 'rman':
+            marker = "HOST 'echo {}';".format(tag)
+        else:
+            raise GateException("Unknown session target: %s" % self.target)
+
+        return marker
+
+    def _terminate(self, scenario: str) -> str:
+        """
+        End the last statement of the scenario, so the client does not take the closing frame into it.
+
+        :param scenario: scenario text
+        :returns: scenario, ending with a complete statement
+        """
+        lines = [line.strip() for line in scenario.split("\n") if line.strip() and not line.strip().startswith("--")]
+        if not lines:
+            return scenario
+
+        last = lines[-1]
+        if self.target == 'psql':
+            ended = last.endswith(";") or last.startswith("\\")
+        elif self.target == 'sqlplus':
+            # PL/SQL block is only entered, until "/" runs it
+            if self.PLSQL_BLOCK.search(scenario) and re.match(r"^END(\s+\w+)?;$", last, re.IGNORECASE):
+                return scenario + "\n/"
+            ended = last.endswith(";") or last == "/" or self.SQLPLUS_COMMAND.match(last) is not None
+        else:
+            # RUN block is complete with its closing brace
+            ended = last.endswith(";") or last.endswith("}")
+
+        return scenario if ended else scenario + "\n;"
+
+    def _readline(self, timeout: typing.Optional[float] = None) -> typing.Optional[bytes]:
+        """
+        Read one line from the client.
+
+        :param timeout: seconds to wait for the data or None for no limit.
+        :returns: line or None on EOF.
+        :raises SessionException: if client does not respond in time.
+        """
+        assert self._proc.stdout is not None
+        fdsc = self._proc.stdout.fileno()
+        while b"\n" not in self._buff:
+            if timeout is not None and not select.select([fdsc], [], [], timeout)[0]:
+                raise SessionException("Session to %s does not respond." % self.target)
+            chunk = os.read(fdsc, 0x10000)
+            if not chunk:
+                return None
+            self._buff += chunk
+        line, self._buff = self._buff.split(b"\n", 1)
+
+        return line
+
+    def is_alive(self) -> bool:
+        """
+        Check if client is still running.
+        """
+        return self._proc.poll() is None
+
+    def execute(self, scenario: str, timeout: typing.Optional[float] = None) -> str:
+        """
+        Run scenario in the current session.
+
+        :param scenario: scenario text
+        :param timeout: seconds to wait for each line of the output.
+        :returns: output of the scenario
+        :raises SessionException: if client died or does not respond.
+        """
+        out: typing.List[str] = []
+        try:
+            for line in self.stream(scenario, timeout=timeout):
+                out.append(line)
+        except SessionException as ex:
+            ex.output = '\n'.join(out)
+            raise
+
+        return '\n'.join(out)
+
+    def stream(self, scenario: str, timeout: typing.Optional[float] = None) -> typing.Iterator[str]:
+        """
+        Run scenario in the current session and yield output lines as they arrive.
+
+        :param scenario: scenario text
+        :param timeout: seconds to wait for each line of the output.
+        :returns: iterator of the output lines
+        :raises SessionException: if client died or does not respond.
+        """
+        tag = uuid.uuid4().hex
+        begin, end = "--smdba-begin-" + tag, "--smdba-end-" + tag
+        script = []
+        if self._restore is not None:
+            script += ["CLEAR COLUMNS", "@" + self._restore]
+        script += [self._marker(begin), self._terminate(scenario), self._marker(end), ""]
+
+        assert self._proc.stdin is not None
+        try:
+            self._proc.stdin.write(BaseGate.to_bytes('\n'.join(script)))
+            self._proc.stdin.flush()
+        except (OSError, ValueError) as ex:
+            raise SessionException("Session to %s is broken: %s" % (self.target, ex))
+
+        started = False
+        while True:
+            try:
+                line = self._readline(timeout=timeout)
+            except SessionException as ex:
+                # Stalled client cannot be reused and the scenario might be still running
+                self._proc.kill()
+                raise SessionException(str(ex), started=True, returncode=self._proc.wait())
+            if line is None:
+                raise SessionException("Session to %s has been terminated." % self.target,
+                                       started=started, returncode=self._proc.wait())
+            text = BaseGate.to_str(line).rstrip("\r")
+            if text.strip() == begin:
+                started = True
+            elif text.strip() == end:
+                break
+            elif started:
+                yield text
+
+    def close(self) -> None:
+        """
+        Terminate the client.
+        """
+        script = []
+        if self._restore is not None:
+            script.append("HOST rm -f " + self._restore)
+        script.append("\\q" if self.target == 'psql' else "EXIT;")
+        try:
+            self._proc.communicate(input=BaseGate.to_bytes('\n'.join(script) + '\n'), timeout=self.HANDSHAKE_TIMEOUT)
+        except (OSError, ValueError):
+            pass
+        except TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+
 class BaseGate(metaclass=abc.ABCMeta):
     """
     Gate of tools for all supported databases.
@@ -30,6 +361,8 @@ class BaseGate(metaclass=abc.ABCMeta):
     def __init__(self) -> None:
         self.config: typing.Dict[str, typing.Any] = {}
         self._gate_commands: typing.Dict[str, typing.Any] = {}
+        self._sessions: typing.Optional[typing.Dict[typing.Tuple[str, str], typing.Optional[ScenarioSession]]] = None
+        self.output = Output()
 
     @staticmethod
     def is_sm_running() -> bool:
@@ -55,53 +388,90 @@ class BaseGate(metaclass=abc.ABCMeta):
         """
         Get scenario by name.
         """
-        scenario = os.path.sep.join((os.path.abspath(__file__).split(os.path.sep)[:-1] + ['scenarios', name + ".scn"]))
-        if not os.path.exists(scenario):
-            raise IOError("Scenario '{}' is not accessible.".format(scenario))
-
-        return open(scenario, 'r')
+        return io.StringIO(SCENARIOS.get(name).text)
 
-    def get_scenario_template(self, target: str = 'sqlplus', login: typing.Optional[str] = None) -> str:
+    @staticmethod
+    def _get_client_environment(target: str) -> typing.List[str]:
         """
-        Generate a template for the Oracle SQL*Plus scenario.
+        Get environment exports, required by the client.
 
-        :returns: bytes
+        :returns: list of shell statements
         """
         env = os.environ.get
-        scenario = []
-        login = login if login else '/nolog'
+        exports = []
+        if target in ['sqlplus', 'rman']:
+            if env('PATH') and env('ORACLE_BASE') and env('ORACLE_SID') and env('ORACLE_HOME'):
+                exports.append("export ORACLE_BASE=" + env('ORACLE_BASE', ''))
+                exports.append("export ORACLE_SID=" + env('ORACLE_SID', ''))
+                exports.append("export ORACLE_HOME=" + env('ORACLE_HOME', ''))
+                exports.append("export PATH=" + env('PATH', ''))
+            else:
+                raise Exception("Underlying error: environment for Oracle Database cannot be constructed.")
+
+        return exports
 
+    def _get_client_command(self, target: str, login: typing.Optional[str] = None) -> str:
+        """
+        Get command line of the client.
+
+        :returns: command line
+        """
+        login = login if login else '/nolog'
         if target == 'sqlplus':
-            executable = "/bin/%s -S %s" % (target, login)
+            executable = os.environ.get('ORACLE_HOME', '') + "/bin/%s -S %s" % (target, login)
         elif target == 'rman':
-            executable = "/bin/" + target
+            executable = os.environ.get('ORACLE_HOME', '') + "/bin/" + target
         elif target == 'psql':
-            executable = "/usr/bin/" + target
+            executable = ("/usr/bin/" + target + " -t --pset footer=off " + self.config.get('db_name', '')).strip()
         else:
             raise Exception("Unknown scenario target: %s" % target)
 
+        return executable
+
+    @staticmethod
+    def _get_client_login(target: str, login: typing.Optional[str] = None) -> typing.List[str]:
+        """
+        Get login statements of the client.
+
+        :returns: list of statements
+        """
+        login = login if login else '/nolog'
+        statements = []
+        if target == 'sqlplus' and login.lower() == '/nolog':
+            statements.append("CONNECT / AS SYSDBA;")
+        elif target == 'rman':
+            statements.append("CONNECT TARGET /")
+
+        return statements
+
+    @staticmethod
+    def _get_client_user(target: str) -> str:
+        """
+        Get system user to run the client.
+        """
         if target in ['sqlplus', 'rman']:
-            if env('PATH') and env('ORACLE_BASE') and env('ORACLE_SID') and env('ORACLE_HOME'):
-                scenario.append("export ORACLE_BASE=" + env('ORACLE_BASE', ''))
-                scenario.append("export ORACLE_SID=" + env('ORACLE_SID', ''))
-                scenario.append("export ORACLE_HOME=" + env('ORACLE_HOME', ''))
-                scenario.append("export PATH=" + env('PATH', ''))
-            else:
-                raise Exception("Underlying error: environment for Oracle Database cannot be constructed.")
+            user = 'oracle'
+        elif target in ['psql']:
+            user = 'postgres'
+        else:
+            raise GateException("Unknown target: %s" % target)
+
+        return user
 
-            scenario.append("cat - << EOF | " + env('ORACLE_HOME', '') + executable)
-            if target == 'sqlplus' and login.lower() == '/nolog':
-                scenario.append("CONNECT / AS SYSDBA;")
-            elif target == 'rman':
-                scenario.append("CONNECT TARGET /")
+    def get_scenario_template(self, target: str = 'sqlplus', login: typing.Optional[str] = None) -> str:
+        """
+        Generate a template for the Oracle SQL*Plus scenario.
 
-            scenario.append("@scenario")
+        :returns: bytes
+        """
+        executable = self._get_client_command(target, login=login)
+        scenario = self._get_client_environment(target)
+        scenario.append("cat - << EOF | " + executable)
+        scenario += self._get_client_login(target, login=login)
+        scenario.append("@scenario")
+        if target in ['sqlplus', 'rman']:
             scenario.append("EXIT;")
-            scenario.append("EOF")
-        elif target in ['psql']:
-            scenario.append(("cat - << EOF | " + executable + " -t --pset footer=off " + self.config.get('db_name', '')).strip())
-            scenario.append("@scenario")
-            scenario.append("EOF")
+        scenario.append("EOF")
 
         if self.debug:
             print("\n" + ("-" * 40) + "8<" + ("-" * 40))
@@ -110,26 +480,153 @@ class BaseGate(metaclass=abc.ABCMeta):
 
         return '\n'.join(scenario)
 
-    def call_scenario(self, scenario: str, target: str = 'sqlplus',
-                      login: typing.Optional[str] = None, **variables: str) -> typing.Tuple[str, str]:
+    def open_sessions(self) -> None:
         """
-        Call scenario in SQL*Plus.
+        Keep one running client per target until the sessions are closed,
+        instead of starting a new client for every scenario.
+        """
+        if self._sessions is None:
+            self._sessions = {}
+
+    def close_sessions(self, reopen: bool = True) -> None:
+        """
+        Terminate all running clients.
+        Should be called every time the database is restarted.
+
+        :param reopen: start new clients on demand afterwards.
+        """
+        for session in (self._sessions or {}).values():
+            if session is not None:
+                session.close()
+        self._sessions = {} if reopen and self._sessions is not None else None
+
+    def _get_session(self, target: str, login: typing.Optional[str] = None) -> typing.Optional[ScenarioSession]:
+        """
+        Get running client for the target.
+
+        :returns: session or None, if sessions are not used or not available.
+        """
+        if self._sessions is None:
+            return None
+
+        key = (target, login or '')
+        session = self._sessions.get(key)
+        if key not in self._sessions or (session is not None and not session.is_alive()):
+            executable = self._get_client_command(target, login=login)
+            if os.path.exists("/usr/bin/stdbuf"):
+                executable = "/usr/bin/stdbuf -oL " + executable
+            command = '; '.join(self._get_client_environment(target) + ["exec " + executable])
+            try:
+                session = ScenarioSession(target, ["sudo", "-u", self._get_client_user(target), "/bin/bash", "-c", command],
+                                          prologue='\n'.join(self._get_client_login(target, login=login)))
+            except SessionException as ex:
+                if self.debug:
+                    eprint("Session to {} is not available: {}".format(target, ex))
+                session = None  # Fall back to one-shot calls for this target
+            self._sessions[key] = session
+
+        return session
+
+    @staticmethod
+    def _is_exclusive(scenario: str) -> bool:
+        """
+        Scenario restarts the instance, so it cannot share a session.
+        """
+        return re.search(r"^\s*(startup|shutdown)\b", scenario, re.IGNORECASE | re.MULTILINE) is not None
+
+    @staticmethod
+    def _is_exiting(scenario: str) -> bool:
+        """
+        Scenario exits the client, so it would terminate a shared session.
+        """
+        return re.search(r"^\s*(exit|quit)\b|^\s*\\q\b", scenario, re.IGNORECASE | re.MULTILINE) is not None
+
+    def call_script(self, scenario: str, target: str = 'sqlplus',
+                    login: typing.Optional[str] = None) -> typing.Tuple[str, str]:
+        """
+        Call scenario text in the client.
+        Uses running session, if any. Otherwise starts a new client.
         Returns stdout and stderr.
         """
+        user = self._get_client_user(target)
+        session = None
+        if self._is_exclusive(scenario):
+            self.close_sessions()
+        elif not self._is_exiting(scenario):
+            session = self._get_session(target, login=login)
+
+        if session is not None:
+            try:
+                stdout = session.execute(scenario, timeout=ScenarioSession.TIMEOUT)
+                return stdout.strip(), self.extract_errors(stdout).strip()
+            except SessionException as ex:
+                if self._sessions is not None:
+                    self._sessions.pop((target, login or ''), None)
+                if ex.started:
+                    # Scenario was already sent, it must not run twice
+                    if ex.returncode:
+                        raise GateException("Non zero exit code (%d) returned while calling %s\n" % (ex.returncode, target) +
+                                            "STDIN:\n%s\n" % scenario + "STDOUT: %s\n" % ex.output)
+                    return ex.output.strip(), self.extract_errors(ex.output).strip()
+
         template = self.get_scenario_template(target=target, login=login).replace(
-            '@scenario', self.get_scn(scenario).read().replace('$', r'\$'))
-        if variables:
-            for k_var, v_var in variables.items():
-                template = template.replace('@' + k_var, v_var)
+            '@scenario', scenario.replace('$', r'\$'))
 
-        if target in ['sqlplus', 'rman']:
-            user = 'oracle'
-        elif target in ['psql']:
-            user = 'postgres'
-        else:
-            raise GateException("Unknown target: %s" % target)
         return self.syscall("sudo", "-u", user, "/bin/bash", input=template)
 
+    def _stream_script(self, scenario: str, target: str = 'sqlplus',
+                       login: typing.Optional[str] = None) -> typing.Iterator[str]:
+        """
+        Call scenario text in the client and yield output lines as they arrive.
+        """
+        user = self._get_client_user(target)
+        session = None
+        if self._is_exclusive(scenario):
+            self.close_sessions()
+        elif not self._is_exiting(scenario):
+            session = self._get_session(target, login=login)
+
+        if session is not None:
+            try:
+                yield from session.stream(scenario, timeout=ScenarioSession.TIMEOUT)
+                return
+            except SessionException as ex:
+                if self._sessions is not None:
+                    self._sessions.pop((target, login or ''), None)
+                if ex.started:
+                    # Scenario was already sent, it must not run twice
+                    if ex.returncode:
+                        raise GateException("Non zero exit code (%d) returned while calling %s\n" % (ex.returncode, target) +
+                                            "STDIN:\n%s\n" % scenario)
+                    return
+
+        template = self.get_scenario_template(target=target, login=login).replace(
+            '@scenario', scenario.replace('$', r'\$'))
+        yield from self.syscall_stream("sudo", "-u", user, "/bin/bash", input=template)
+
+    @staticmethod
+    def _render_scenario(scenario: str, **variables: typing.Union[str, int, float]) -> str:
+        """
+        Get scenario with its placeholders bound to the variables.
+        """
+        return SCENARIOS.render(scenario, **variables)
+
+    def call_scenario(self, scenario: str, target: str = 'sqlplus',
+                      login: typing.Optional[str] = None, **variables: typing.Union[str, int, float]) -> typing.Tuple[str, str]:
+        """
+        Call scenario in SQL*Plus.
+        Returns stdout and stderr.
+        """
+        return self.call_script(self._render_scenario(scenario, **variables), target=target, login=login)
+
+    def stream_scenario(self, scenario: str, target: str = 'sqlplus',
+                        login: typing.Optional[str] = None, **variables: typing.Union[str, int, float]) -> "ScenarioStream":
+        """
+        Call scenario and consume its output line by line.
+        Errors are collected while iterating and available as "stderr" afterwards.
+        """
+        return ScenarioStream(self._stream_script(self._render_scenario(scenario, **variables), target=target, login=login))
+
     @staticmethod
     def to_bytes(value: str) -> bytes:
         """
@@ -181,6 +678,49 @@ class BaseGate(metaclass=abc.ABCMeta):
 
         return stdout and stdout.strip() or '', stderr and stderr.strip() or ''
 
+    def syscall_stream(self, command: str, *params: str, input: typing.Optional[str] = None) -> typing.Iterator[str]:
+        """
+        Call an external system command and yield decoded lines of its STDOUT/STDERR as they arrive.
+        Only a short tail of the output is kept for the error report.
+
+        :param command: a command to run from a system.
+        :param input: input device.
+        :param *params: tertiary parameters
+        :returns: iterator of the output lines
+        """
+        proc = Popen([command] + list(params), stdout=PIPE, stdin=PIPE, stderr=STDOUT, env=os.environ)
+
+        def feed() -> None:
+            assert proc.stdin is not None
+            try:
+                proc.stdin.write(self.to_bytes(input or ""))
+            except OSError:
+                pass
+            finally:
+                proc.stdin.close()
+
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+
+        tail: typing.Deque[str] = collections.deque(maxlen=0x20)
+        assert proc.stdout is not None
+        try:
+            for raw in proc.stdout:
+                line = self.to_str(raw).rstrip("\r\n")
+                tail.append(line)
+                yield line
+        finally:
+            proc.stdout.close()
+            feeder.join()
+            proc.wait()
+
+        if proc.returncode != 0:
+            raise GateException("Non zero exit code (%d) returned while calling %s\n" %
+                                (proc.returncode, [command] + list(params)) +
+                                ("STDIN:\n%s\n" % (input) if input else "") +
+                                "STDOUT (last lines): %s\n" % '\n'.join(tail))
+
     def get_gate_commands(self) -> typing.Dict[str, typing.Dict[str, str]]:
         """
         Gate commands inspector.
@@ -250,12 +790,7 @@ class BaseGate(metaclass=abc.ABCMeta):
         Returned valus is a dictionary with keys 'total', 'used' and
         'free', which are the amount of total, used and free space, in bytes.
         """
-        stvf = os.statvfs(path)
-        free = stvf.f_bavail * stvf.f_frsize
-        total = stvf.f_blocks * stvf.f_frsize
-        used = (stvf.f_blocks - stvf.f_bfree) * stvf.f_frsize
-
-        return {'free': free, 'total': total, 'used': used}
+        return dict(get_usage(path))
 
     def check_sudo(self, uid: str) -> None:
         """
@@ -292,12 +827,24 @@ class BaseGate(metaclass=abc.ABCMeta):
 
         out: typing.List[str] = []
         for line in filter(None, str(stdout).replace("\\n", "\n").split("\n")):
-            if line.lower().startswith("ora-") or line.lower().startswith("rman-"):
-                if not line.find("===") > -1:
-                    out += textwrap.wrap(line.strip())
+            out += BaseGate.classify_error(line)
 
         return '\n'.join(out)
 
+    @staticmethod
+    def classify_error(line: str) -> typing.List[str]:
+        """
+        Get RMAN or SQLPlus error from one line of the output.
+
+        :returns: wrapped error lines or an empty list.
+        """
+        out: typing.List[str] = []
+        if line.lower().startswith("ora-") or line.lower().startswith("rman-"):
+            if not line.find("===") > -1:
+                out = textwrap.wrap(line.strip())
+
+        return out
+
     @staticmethod
     def to_stderr(stderr: str) -> typing.Optional[bool]:
         """
@@ -324,3 +871,26 @@ class BaseGate(metaclass=abc.ABCMeta):
         :returns int of mbs
         """
         return int(round(value / 0x400 / 0x400))
+
+
+class ScenarioStream:
+    """
+    Output lines of the scenario, classifying errors on the fly.
+    """
+
+    def __init__(self, lines: typing.Iterable[str]) -> None:
+        self._lines = lines
+        self.errors: typing.List[str] = []
+
+    def __iter__(self) -> typing.Iterator[str]:
+        for line in self._lines:
+            for chunk in line.replace("\\n", "\n").split("\n"):
+                self.errors += BaseGate.classify_error(chunk)
+            yield line
+
+    @property
+    def stderr(self) -> str:
+        """
+        Errors, found in the consumed output.
+        """
+        return '\n'.join(self.errors)
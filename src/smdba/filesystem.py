@@ -0,0 +1,247 @@
+# coding: utf-8
+"""
+Filesystem accounting without "df" and "du".
+
+Usage of the filesystems is taken from statvfs, mounts are read from
+the mountinfo of the process and sizes of the directory trees are
+summed up by the parallel walker.
+"""
+
+import os
+import re
+import json
+import fnmatch
+import typing
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+MOUNTINFO = "/proc/self/mountinfo"
+
+# Index of the directory sizes, kept by root
+SIZE_CACHE = "/var/cache/smdba/sizes.json"
+
+
+class Mount:
+    """
+    Mounted filesystem.
+    """
+
+    def __init__(self, device: str, mountpoint: str, fstype: str, source: str) -> None:
+        """
+        Mount.
+
+        :param device: "major:minor" of the device
+        :param mountpoint: mount point
+        :param fstype: filesystem type
+        :param source: mounted source, usually the device path
+        """
+        self.device = device
+        self.mountpoint = mountpoint
+        self.fstype = fstype
+        self.source = source
+
+
+def _unescape(value: str) -> str:
+    """
+    Unescape octal sequences of the mountinfo fields, like "\\040" for a space.
+    """
+    return re.sub(r"\\([0-7]{3})", lambda match: chr(int(match.group(1), 8)), value)
+
+
+def get_mounts(mountinfo: str = MOUNTINFO) -> typing.List[Mount]:
+    """
+    Get mounted filesystems in the order they were mounted.
+
+    :param mountinfo: path to the mountinfo
+    """
+    mounts = []
+    with open(mountinfo) as mfh:
+        for line in mfh:
+            fields = line.split()
+            if "-" not in fields:
+                continue
+            # Optional fields are terminated by a single hyphen
+            sep = fields.index("-")
+            if sep < 6 or len(fields) < sep + 3:
+                continue
+            mounts.append(Mount(fields[2], _unescape(fields[4]), fields[sep + 1], _unescape(fields[sep + 2])))
+
+    return mounts
+
+
+def get_mount(path: str, mountinfo: str = MOUNTINFO) -> typing.Optional[Mount]:
+    """
+    Get filesystem, where the path belongs to.
+
+    :param path: any path on the filesystem
+    :param mountinfo: path to the mountinfo
+    :returns: Mount or None, if the path is not mounted.
+    """
+    path = os.path.realpath(path)
+    found = None
+    for mount in get_mounts(mountinfo):
+        # Later mounts hide the earlier ones on the same mount point
+        if (mount.mountpoint == "/" or path == mount.mountpoint or path.startswith(mount.mountpoint + "/")) and \
+                (found is None or len(mount.mountpoint) >= len(found.mountpoint)):
+            found = mount
+
+    return found
+
+
+def get_usage(path: str) -> typing.Dict[str, int]:
+    """
+    Get usage of the filesystem, where the path belongs to.
+
+    :returns: dictionary with 'total', 'used' and 'free' bytes, where free is available to non-root users.
+    """
+    stvf = os.statvfs(path)
+
+    return {
+        'free': stvf.f_bavail * stvf.f_frsize,
+        'total': stvf.f_blocks * stvf.f_frsize,
+        'used': (stvf.f_blocks - stvf.f_bfree) * stvf.f_frsize,
+    }
+
+
+def get_used_percent(usage: typing.Dict[str, int]) -> int:
+    """
+    Get used space in percents of the space, available to non-root users, rounded up as "df" does.
+    """
+    available = usage['used'] + usage['free']
+    return -(-usage['used'] * 100 // available) if available else 0
+
+
+DirEntry = typing.Tuple[int, int, typing.List[typing.List[int]], typing.List[str], typing.List[str]]
+
+
+def _scan_directory(path: str, cache: typing.Dict[str, typing.Any], volatile: typing.Sequence[str] = ()
+                    ) -> typing.Tuple[str, int, typing.Optional[DirEntry]]:
+    """
+    Sum up sizes of the directory entries, not descending into subdirectories.
+    Directory is not read again, if it is not changed since it was cached.
+
+    :param volatile: name patterns of the files, growing in place, which are not summed up
+    :returns: path, size of the directory itself and its mtime, size of the files, hard linked files
+              as [device, inode, size], subdirectories and volatile files, or None, if the directory
+              is not readable anymore.
+    """
+    try:
+        stat_info = os.lstat(path)
+        mtime = stat_info.st_mtime_ns
+        own_size = stat_info.st_size
+        cached = cache.get(path)
+        if cached is not None and len(cached) == 5 and cached[0] == mtime:
+            return path, own_size, cached
+
+        size, links, dirs, fresh = 0, [], [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    stat_info = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue  # Removed meanwhile
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif [pattern for pattern in volatile if fnmatch.fnmatch(entry.name, pattern)]:
+                    fresh.append(entry.name)
+                elif stat_info.st_nlink > 1:
+                    links.append([stat_info.st_dev, stat_info.st_ino, stat_info.st_size])
+                else:
+                    size += stat_info.st_size
+    except OSError:
+        return path, 0, None
+
+    return path, own_size, (mtime, size, links, dirs, fresh)
+
+
+def _load_size_cache(root: str) -> typing.Dict[str, typing.Any]:
+    """
+    Load cached sizes of the directories under the root.
+    """
+    try:
+        with open(SIZE_CACHE) as cfh:
+            return json.load(cfh).get(root, {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def _save_size_cache(root: str, index: typing.Dict[str, typing.Any]) -> None:
+    """
+    Replace cached sizes of the directories under the root. Only root keeps the cache.
+    """
+    if os.geteuid() != 0:
+        return
+
+    try:
+        with open(SIZE_CACHE) as cfh:
+            cache = json.load(cfh)
+    except (OSError, ValueError):
+        cache = {}
+    if not isinstance(cache, dict):
+        cache = {}
+    cache[root] = index
+    try:
+        os.makedirs(os.path.dirname(SIZE_CACHE), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(SIZE_CACHE))
+        with os.fdopen(handle, "w") as cfh:
+            json.dump(cache, cfh)
+        os.chmod(temp_path, 0o600)
+        os.rename(temp_path, SIZE_CACHE)
+    except OSError:
+        pass  # Cache is optional
+
+
+def get_tree_size(path: str, threads: int = 8, cached: bool = False, volatile: typing.Sequence[str] = ()) -> int:
+    """
+    Get apparent size of the directory tree in bytes, as "du -bc" does.
+
+    Directories are read in parallel. Hard linked files are counted once,
+    symbolic links are not followed. Files, removed while walking, are skipped.
+
+    Cached index skips reading the directories, which are not changed since
+    the last walk. It is only correct for the directories with files, written
+    once and moved in place, like the backup directory, since files growing in
+    place do not change their directory. Such files are matched by the volatile
+    patterns and their size is taken on every walk.
+
+    :param path: root of the tree
+    :param threads: number of directories, read at once
+    :param cached: use and update the cached index of the directory sizes
+    :param volatile: name patterns of the files, growing in place
+    """
+    root = os.path.realpath(path)
+    cache = _load_size_cache(root) if cached else {}
+    index: typing.Dict[str, typing.Any] = {}
+    seen: typing.Set[typing.Tuple[int, int]] = set()
+    total = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        pending: typing.Set[Future] = {pool.submit(_scan_directory, root, cache, volatile)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dir_path, own_size, entry = future.result()
+                if entry is None:
+                    continue
+                index[dir_path] = entry
+                _, size, links, dirs, fresh = entry
+                total += own_size + size
+                # Volatile files are counted as hard links, their size is never cached
+                fresh_links = []
+                for name in fresh:
+                    try:
+                        stat_info = os.lstat(os.path.join(dir_path, name))
+                    except OSError:
+                        continue  # Removed meanwhile
+                    fresh_links.append([stat_info.st_dev, stat_info.st_ino, stat_info.st_size])
+                for device, inode, link_size in links + fresh_links:
+                    if (device, inode) not in seen:
+                        seen.add((device, inode))
+                        total += link_size
+                for name in dirs:
+                    pending.add(pool.submit(_scan_directory, os.path.join(dir_path, name), cache, volatile))
+
+    if cached:
+        _save_size_cache(root, index)
+
+    return total
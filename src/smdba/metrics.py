@@ -0,0 +1,170 @@
+# coding: utf-8
+"""
+Metrics of the database in Prometheus text format.
+"""
+
+import time
+import socket
+import typing
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class Metric:
+    """
+    Gauge with its samples.
+    """
+
+    def __init__(self, name: str, help: str, mtype: str = "gauge") -> None:  # pylint: disable=W0622
+        self.name = name
+        self.help = help
+        self.type = mtype
+        self.samples: typing.List[typing.Tuple[typing.Dict[str, str], float]] = []
+
+    def add(self, value: typing.Union[int, float, bool], **labels: str) -> "Metric":
+        """
+        Add sample of the metric.
+
+        :param value: sample value
+        :param labels: sample labels
+        :returns: the metric itself
+        """
+        self.samples.append((labels, float(value)))
+        return self
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        """
+        Escape label value.
+        """
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    def render(self) -> str:
+        """
+        Render metric in Prometheus text format.
+        """
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.type)]
+        for labels, value in self.samples:
+            label_text = ",".join('{}="{}"'.format(key, self._escape(val)) for key, val in sorted(labels.items()))
+            lines.append("{}{} {}".format(self.name, label_text and "{" + label_text + "}", repr(value)))
+
+        return "\n".join(lines)
+
+
+class Collector:
+    """
+    Source of metrics, called again only when its metrics are older than the TTL.
+    """
+
+    def __init__(self, name: str, ttl: float, collect: typing.Callable[[], typing.List[Metric]]) -> None:
+        """
+        Collector.
+
+        :param name: name of the collector
+        :param ttl: seconds, while collected metrics are served from the cache
+        :param collect: function, returning metrics
+        """
+        self.name = name
+        self.ttl = ttl
+        self._collect = collect
+        self._collected = 0.
+        self._metrics: typing.List[Metric] = []
+        self.success = False
+        self.duration = 0.
+
+    def get_metrics(self) -> typing.List[Metric]:
+        """
+        Get cached metrics or collect them again, if they are expired.
+        Failed collector returns no metrics until the TTL is expired.
+        """
+        now = time.time()
+        if not self._collected or now - self._collected >= self.ttl:
+            try:
+                self._metrics = self._collect()
+                self.success = True
+            except Exception:
+                self._metrics = []
+                self.success = False
+            self.duration = time.time() - now
+            self._collected = now
+
+        return self._metrics
+
+
+class MetricsRegistry:
+    """
+    All collectors of the gate. Collectors are never called concurrently.
+    """
+
+    def __init__(self, collectors: typing.List[Collector]) -> None:
+        self.collectors = collectors
+        self._lock = threading.Lock()
+
+    def render(self) -> str:
+        """
+        Collect and render all metrics, including success and duration of each collector.
+        """
+        with self._lock:
+            metrics = []
+            success = Metric("smdba_collector_success", "Whether the last collection succeeded.")
+            duration = Metric("smdba_collector_duration_seconds", "Duration of the last collection.")
+            for collector in self.collectors:
+                metrics += collector.get_metrics()
+                success.add(collector.success, collector=collector.name)
+                duration.add(round(collector.duration, 6), collector=collector.name)
+
+        return "\n".join(metric.render() for metric in metrics + [success, duration]) + "\n"
+
+    def serve(self, address: str, port: int) -> None:
+        """
+        Serve metrics over HTTP at "/metrics" until interrupted.
+
+        :param address: address to listen on
+        :param port: port to listen on
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Metrics request handler.
+            """
+
+            def do_GET(self) -> None:  # pylint: disable=C0103
+                """
+                Handle GET request.
+                """
+                if self.path.split("?")[0] not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: typing.Any) -> None:  # pylint: disable=W0622
+                """
+                Requests are not logged.
+                """
+
+        class Server(HTTPServer):
+            """
+            Metrics server on IPv4 or IPv6 address.
+            """
+            address_family = socket.AF_INET6 if ":" in address else socket.AF_INET
+
+        Server((address, port), Handler).serve_forever()
+
+
+def get_listen_address(value: str) -> typing.Tuple[str, int]:
+    """
+    Parse "[address:]port" to listen on. All addresses by default.
+
+    :raises ValueError: if the port is not a number.
+    """
+    address, _, port = value.rpartition(":")
+    if not port.isdigit():
+        raise ValueError("Port must be a number.")
+
+    return address.strip("[]"), int(port)
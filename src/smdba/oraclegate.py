@@ -7,12 +7,12 @@ Oracle administration gate.
 import os
 import sys
 import re
-import time
 import random
 
 from smdba.basegate import BaseGate, GateException
 from smdba.roller import Roller
 from smdba.utils import TablePrint, eprint
+from smdba.metrics import Metric, Collector, MetricsRegistry, get_listen_address
 
 
 class InfoNode:
@@ -118,59 +118,88 @@ class OracleGate(BaseGate):
         print("Getting available backups:\t", end="")
 
         infoset = []
-        stdout, stderr = self.call_scenario('rman-list-backups', target='rman')
-        self.to_stderr(stderr)
+        output = self.stream_scenario('rman-list-backups', target='rman')
+        chunk = None
+        for line in output:
+            if chunk is None:
+                # Backup sets are listed after the title underline
+                if line.startswith("="):
+                    chunk = []
+                continue
+            if 'BS Key' in line:
+                head, tail = line.split('BS Key', 1)
+                chunk.append(head)
+                self._add_backup_set(infoset, '\n'.join(chunk))
+                chunk = [tail]
+            else:
+                chunk.append(line)
+        if chunk:
+            self._add_backup_set(infoset, '\n'.join(chunk))
+        self.to_stderr(output.stderr)
 
         roller.stop("finished")
-        time.sleep(1)
 
-        if stdout:
-            for chunk in filter(None, [re.sub('=+', '', c).strip() for c in stdout.split("\n=")[-1].split('BS Key')]):
-                try:
-                    info = InfoNode()
-                    info.files = []
-                    piece_chnk, files_chnk = chunk.split('List of Datafiles')
-                    # Get backup place
-                    for line in [l.strip() for l in piece_chnk.split("\n")]:
-                        if line.lower().startswith('piece name'):
-                            info.backup = line.split(" ")[-1]
-                        if line.lower().find('status') > -1:
-                            status_line = list(filter(None, line.replace(':', '').split("Status")[-1].split(" ")))
-                            if len(list(status_line)) == 5:
-                                info.status = status_line[0]
-                                info.compression = status_line[2]
-                                info.tag = status_line[4]
-
-                    # Get the list of files
-                    for line in [l.strip() for l in files_chnk.split("\n")]:
-                        if line.startswith('-'):
-                            continue
-                        else:
-                            line = list(filter(None, line.split(" ")))
-                            if len(list(line)) > 4:
-                                if line[0] == 'File':
-                                    continue
-                                dbf = InfoNode()
-                                dbf.type = line[1]
-                                dbf.file = line[-1]
-                                dbf.date = line[-2]
-                                info.files.append(dbf)
-                    infoset.append(info)
-                except Exception:
-                    eprint("No backup snapshots available.")
-                    sys.exit(1)
-
-            # Display backup data
-            if infoset:
+        # Display backup data
+        def text(records):
+            records = list(records)
+            if records:
                 print("Backups available:\n")
-                for info in infoset:
-                    print("Name:\t", info.backup)
-                    print("Files:")
-                    for dbf in info.files:
-                        print("\tType:", dbf.type, end="")
-                        print(sys.stdout, "\tDate:", dbf.date, end="")
-                        print("\tFile:", dbf.file)
-                    print()
+            for backup, _, _, _, files in records:
+                print("Name:\t", backup)
+                print("Files:")
+                for dbf in files:
+                    print("\tType:", dbf["type"], end="")
+                    print(sys.stdout, "\tDate:", dbf["date"], end="")
+                    print("\tFile:", dbf["file"])
+                print()
+
+        self.output.report("backup-list", ["backup", "status", "compression", "tag", "files"],
+                           [(info.backup, getattr(info, "status", None), getattr(info, "compression", None),
+                             getattr(info, "tag", None),
+                             [{"type": dbf.type, "date": dbf.date, "file": dbf.file} for dbf in info.files])
+                            for info in infoset], text=text)
+
+    @staticmethod
+    def _add_backup_set(infoset, chunk):
+        """
+        Parse one backup set of the RMAN backup list and add it to the infoset.
+        """
+        chunk = re.sub('=+', '', chunk).strip()
+        if not chunk:
+            return
+        try:
+            info = InfoNode()
+            info.files = []
+            piece_chnk, files_chnk = chunk.split('List of Datafiles')
+            # Get backup place
+            for line in [l.strip() for l in piece_chnk.split("\n")]:
+                if line.lower().startswith('piece name'):
+                    info.backup = line.split(" ")[-1]
+                if line.lower().find('status') > -1:
+                    status_line = list(filter(None, line.replace(':', '').split("Status")[-1].split(" ")))
+                    if len(list(status_line)) == 5:
+                        info.status = status_line[0]
+                        info.compression = status_line[2]
+                        info.tag = status_line[4]
+
+            # Get the list of files
+            for line in [l.strip() for l in files_chnk.split("\n")]:
+                if line.startswith('-'):
+                    continue
+                else:
+                    line = list(filter(None, line.split(" ")))
+                    if len(list(line)) > 4:
+                        if line[0] == 'File':
+                            continue
+                        dbf = InfoNode()
+                        dbf.type = line[1]
+                        dbf.file = line[-1]
+                        dbf.date = line[-2]
+                        info.files.append(dbf)
+            infoset.append(info)
+        except Exception:
+            eprint("No backup snapshots available.")
+            sys.exit(1)
 
     def do_backup_purge(self, *args, **params):  # pylint: disable=W0613
         """
@@ -186,11 +215,9 @@ class OracleGate(BaseGate):
         info = self.get_backup_info()
         if not info:
             roller.stop("failed")
-            time.sleep(1)
             eprint("No backup snapshots available.")
             sys.exit(1)
         roller.stop("finished")
-        time.sleep(1)
 
         print("Removing %s backup%s:\t" % (len(info), len(info) > 1 and 's' or ''), end="")
 
@@ -199,11 +226,9 @@ class OracleGate(BaseGate):
         _, stderr = self.call_scenario('rman-backup-purge', target='rman')
         if stderr:
             roller.stop("failed")
-            time.sleep(1)
             self.to_stderr(stderr)
 
         roller.stop("finished")
-        time.sleep(1)
 
     def _backup_rotate(self):
         """
@@ -218,12 +243,10 @@ class OracleGate(BaseGate):
 
         if stderr:
             roller.stop("failed")
-            time.sleep(1)
             self.to_stderr(stderr)
 
         if stdout:
             roller.stop("finished")
-            time.sleep(1)
 
     def do_backup_hot(self, *args, **params):  # pylint: disable=W0613
         """
@@ -245,12 +268,10 @@ class OracleGate(BaseGate):
 
         if stderr:
             roller.stop("failed")
-            time.sleep(1)
             self.to_stderr(stderr)
 
         if stdout:
             roller.stop("finished")
-            time.sleep(1)
 
             files = []
             arclogs = []
@@ -397,15 +418,12 @@ class OracleGate(BaseGate):
         if dbstatus.ready:
             if 'force' in args:
                 roller.stop("running")
-                time.sleep(1)
                 self.do_db_stop()
             else:
                 roller.stop("failed")
-                time.sleep(1)
                 raise GateException("Database must be put offline. Or use options (run \"help\" for this procedure).")
         else:
             roller.stop("success")
-            time.sleep(1)
 
         print("Restoring from backup:\t", end="")
         roller = Roller()
@@ -415,12 +433,10 @@ class OracleGate(BaseGate):
 
         if stderr:
             roller.stop("failed")
-            time.sleep(1)
             self.to_stderr(stderr)
 
         if stdout:
             roller.stop("finished")
-            time.sleep(1)
 
         self.do_db_stop()
 
@@ -446,7 +462,6 @@ class OracleGate(BaseGate):
         else:
             roller.stop('failed')
 
-        time.sleep(1)
         self.to_stderr(stderr)
 
     def do_space_overview(self, *args, **params):  # pylint: disable=W0613
@@ -461,11 +476,15 @@ class OracleGate(BaseGate):
         if ora_error:
             raise GateException("Please visit http://%s.ora-code.com/ page to know more details." % ora_error.lower())
 
-        table = [("Tablespace", "Avail (Mb)", "Used (Mb)", "Size (Mb)", "Use %",), ]
-        for name, free, used, size in [" ".join(filter(None, line.replace("\t", " ").split(" "))).split(" ")
-                                       for line in stdout.strip().split("\n")[2:]]:
-            table.append((name, free, used, size, str(int(float(used) / float(size) * 100)),))
-        print('\n{0}\n'.format(TablePrint(table)))
+        def text(records):
+            table = [("Tablespace", "Avail (Mb)", "Used (Mb)", "Size (Mb)", "Use %",), ]
+            for name, free, used, size in records:
+                table.append((name, free, used, size, str(int(float(used) / float(size) * 100)),))
+            print('\n{0}\n'.format(TablePrint(table)))
+
+        self.output.report("space-overview", ["tablespace", "available_mb", "used_mb", "size_mb"],
+                           [" ".join(filter(None, line.replace("\t", " ").split(" "))).split(" ")
+                            for line in stdout.strip().split("\n")[2:]], text=text)
 
     def do_stats_overview(self, *args, **params):  # pylint: disable=W0613
         """
@@ -480,7 +499,6 @@ class OracleGate(BaseGate):
         stdout, stderr = self.call_scenario('stats', owner=self.config.get('db_user', '').upper())
 
         roller.stop('finished')
-        time.sleep(1)
 
         self.to_stderr(stderr)
 
@@ -505,21 +523,29 @@ class OracleGate(BaseGate):
                 else:
                     print("Ignoring", repr(line))
 
-        if stale:
-            print("\nList of stale objects:")
-            for obj in stale:
-                print("\t", obj)
-            print("\nFound %s stale objects\n" % len(stale))
-        else:
-            print("No stale objects found")
+        def text(records):
+            objects = {"stale": [], "empty": []}
+            for obj, state in records:
+                objects[state].append(obj)
 
-        if empty:
-            print("\nList of empty objects:")
-            for obj in empty:
-                print("\t", obj)
-            print("\nFound %s objects that currently have no statistics.\n" % len(stale))
-        else:
-            print("No empty objects found.")
+            if objects["stale"]:
+                print("\nList of stale objects:")
+                for obj in objects["stale"]:
+                    print("\t", obj)
+                print("\nFound %s stale objects\n" % len(objects["stale"]))
+            else:
+                print("No stale objects found")
+
+            if objects["empty"]:
+                print("\nList of empty objects:")
+                for obj in objects["empty"]:
+                    print("\t", obj)
+                print("\nFound %s objects that currently have no statistics.\n" % len(objects["empty"]))
+            else:
+                print("No empty objects found.")
+
+        self.output.report("stats-overview", ["object", "statistics"],
+                           [(obj, "stale") for obj in stale] + [(obj, "empty") for obj in empty], text=text)
 
         if stderr:
             eprint("Error dump:")
@@ -540,11 +566,9 @@ class OracleGate(BaseGate):
 
         if stderr:
             roller.stop('failed')
-            time.sleep(1)
             self.to_stderr(stderr)
         else:
             roller.stop('done')
-            time.sleep(1)
 
         print("Gathering recommendations...\t", end="")
 
@@ -556,15 +580,12 @@ class OracleGate(BaseGate):
 
         if stdout:
             roller.stop("done")
-            time.sleep(1)
         elif stderr:
             roller.stop("failed")
-            time.sleep(1)
             eprint("Error dump:")
             eprint(stderr)
         else:
             roller.stop("finished")
-            time.sleep(1)
             print("\nNo space reclamation possible at this time.\n")
             return
 
@@ -619,10 +640,7 @@ class OracleGate(BaseGate):
                         for segment, size in tree[tsn][obj]['AUTO']:
                             print("\t", segment + "...\t", end="")
                             sys.stdout.flush()
-                            stdout, stderr = self.syscall("sudo", "-u", "oracle", "/bin/bash",
-                                                          input=self.get_scenario_template().replace(
-                                                              '@scenario', self.__get_reclaim_space_statement(
-                                                                  segment, obj)))
+                            stdout, stderr = self.call_script(self.__get_reclaim_space_statement(segment, obj))
                             if stderr:
                                 print("failed")
                                 eprint(stderr)
@@ -757,30 +775,26 @@ class OracleGate(BaseGate):
         dbstatus = self.get_status()
         if dbstatus.ready:
             roller.stop('failed')
-            time.sleep(1)
             raise GateException("Error: listener is already running")
         self.do_listener_start('quiet')
 
         roller.stop('done')
-        time.sleep(1)
 
         print("Starting core...\t", end="")
         sys.stdout.flush()
         roller = Roller()
         roller.start()
 
+        self.close_sessions()
         stdout, stderr = self.syscall("sudo", "-u", "oracle", self.ora_home + "/bin/dbstart")
         roller.stop('done')
-        time.sleep(1)
 
         self.to_stderr(stderr)
 
         if stdout and stdout.find("Database opened") > -1 and stdout.find("Database mounted") > -1:
             roller.stop('done')
-            time.sleep(1)
         else:
             roller.stop('failed')
-            time.sleep(1)
             eprint("Output dump:")
             eprint(stdout)
 
@@ -805,10 +819,8 @@ class OracleGate(BaseGate):
         if dbstatus.ready:
             self.do_listener_stop(*['quiet'])
             roller.stop("done")
-            time.sleep(1)
         else:
             roller.stop("not running")
-            time.sleep(1)
 
         print("Stopping core:\t\t", end="")
 
@@ -819,16 +831,14 @@ class OracleGate(BaseGate):
         dbstatus = self.get_db_status()
         if not dbstatus.ready:
             roller.stop("failed")
-            time.sleep(1)
             raise GateException("Error: database core is already offline.")
 
+        self.close_sessions()
         _, stderr = self.syscall("sudo", "-u", "oracle", self.ora_home + "/bin/dbshut")
         if stderr:
             roller.stop("failed")
-            time.sleep(1)
         else:
             roller.stop("done")
-            time.sleep(1)
 
         self.to_stderr(stderr)
 
@@ -840,10 +850,8 @@ class OracleGate(BaseGate):
         sys.stdout.flush()
 
         dbstatus = self.get_db_status()
-        if dbstatus.ready:
-            print("online")
-        else:
-            print("offline")
+        self.output.report("db-status", ["online"], [(dbstatus.ready,)],
+                           text=lambda records: print(next(iter(records))[0] and "online" or "offline"))
 
     def do_space_tables(self, *args, **params):  # pylint: disable=W0613
         """
@@ -853,28 +861,110 @@ class OracleGate(BaseGate):
         if not dbstatus.ready:
             raise GateException("Database is not running!")
 
-        table = [('Table', 'Size',)]
-        total = 0
         stdout, stderr = self.call_scenario('tablesizes', user=self.config.get('db_user', '').upper())
         self.to_stderr(stderr)
         ora_error = self.has_ora_error(stdout)
         if ora_error:
             raise GateException("Please visit http://%s.ora-code.com/ page to know more details." % ora_error.lower())
 
-        for tname, tsize in filter(None, [filter(None, line.replace("\t", " ").split(" ")) for line in stdout.split("\n")]):
-            table.append((tname, ('%.2fK' % round(float(tsize) / 1024.)),))
-            total += float(tsize)
-        table.append(('', '',))
-        table.append(('Total', ('%.2fM' % round(total / 1024. / 1024.))))
+        def text(records):
+            table = [('Table', 'Size',)]
+            total = 0
+            for tname, tsize in records:
+                table.append((tname, ('%.2fK' % round(tsize / 1024.)),))
+                total += tsize
+            table.append(('', '',))
+            table.append(('Total', ('%.2fM' % round(total / 1024. / 1024.))))
 
-        if table:
-            print('\n{0}\n'.format(TablePrint(table)))
+            if table:
+                print('\n{0}\n'.format(TablePrint(table)))
+
+        self.output.report("space-tables", ["table", "size"],
+                           ((row[0], float(row[1])) for row in
+                            [list(filter(None, line.replace("\t", " ").split(" "))) for line in stdout.split("\n")]
+                            if len(row) == 2), text=text)
 
         if stderr:
             eprint("Error dump:")
             eprint(stderr)
             raise Exception("Unhandled underlying error.")
 
+    def _collect_status_metrics(self):
+        """
+        Collect status of the database.
+        """
+        return [Metric("smdba_database_up", "Whether the database is running.").add(self.get_db_status().ready)]
+
+    def _collect_tablespace_metrics(self):
+        """
+        Collect usage of the tablespaces.
+        """
+        size = Metric("smdba_tablespace_size_bytes", "Size of the tablespace.")
+        used = Metric("smdba_tablespace_used_bytes", "Used space of the tablespace.")
+        if self.get_db_status().ready:
+            stdout, _ = self.call_scenario('report')
+            if self.has_ora_error(stdout):
+                raise GateException("Unable to get tablespace report.")
+            for name, _, t_used, t_size in [" ".join(filter(None, line.replace("\t", " ").split(" "))).split(" ")
+                                            for line in stdout.strip().split("\n")[2:]]:
+                size.add(float(t_size) * 0x100000, tablespace=name)
+                used.add(float(t_used) * 0x100000, tablespace=name)
+
+        return [size, used]
+
+    def _collect_rman_metrics(self):
+        """
+        Collect health of the RMAN backups.
+        """
+        if not self.get_db_status().ready:
+            return []
+
+        healthy_backups, failed_backups, healthy_archivelogs, failed_archivelogs = self.check_backup_info()
+        pieces = Metric("smdba_rman_backup_pieces", "Number of crosschecked backup pieces.")
+        pieces.add(len(healthy_backups), status="available").add(len(failed_backups), status="unavailable")
+        archivelogs = Metric("smdba_rman_archivelogs", "Number of validated archive logs.")
+        archivelogs.add(len(healthy_archivelogs), status="available").add(len(failed_archivelogs), status="unavailable")
+
+        return [pieces, archivelogs]
+
+    def _collect_filesystem_metrics(self):
+        """
+        Collect usage of the flash recovery area.
+        """
+        size = Metric("smdba_filesystem_size_bytes", "Size of the filesystem.")
+        avail = Metric("smdba_filesystem_avail_bytes", "Space on the filesystem, available to the database.")
+        if self.get_db_status().ready:
+            path = self.get_current_fra_dir()
+            usage = self.media_usage(path)
+            size.add(usage['total'], role="fra", path=path)
+            avail.add(usage['free'], role="fra", path=path)
+
+        return [size, avail]
+
+    def do_metrics(self, *args, **params):  # pylint: disable=W0613
+        """
+        Show database metrics in Prometheus text format.
+        @help
+        --serve=<[address:]port>\tServe metrics over HTTP at /metrics until interrupted.
+        """
+        registry = MetricsRegistry([
+            Collector("status", 5, self._collect_status_metrics),
+            Collector("tablespaces", 300, self._collect_tablespace_metrics),
+            Collector("rman", 900, self._collect_rman_metrics),
+            Collector("filesystem", 60, self._collect_filesystem_metrics),
+        ])
+        if not params.get('serve'):
+            sys.stdout.write(registry.render())
+            return
+
+        try:
+            address, port = get_listen_address(str(params['serve']))
+        except ValueError as ex:
+            raise GateException(str(ex))
+        print("Serving metrics at http://{}:{}/metrics".format(address or "0.0.0.0", port))
+        sys.stdout.flush()
+        registry.serve(address, port)
+
     def do_db_check(self, *args, **params):  # pylint: disable=W0613
         """
         Check full connection to the database.
@@ -887,7 +977,6 @@ class OracleGate(BaseGate):
                               self.config.get('db_password'),
                               self.config.get('db_name'))
         roller.stop(self.get_db_status(login=login).ready and "ready" or "not available")
-        time.sleep(1)
 
     #
     # Helpers below
@@ -923,9 +1012,7 @@ class OracleGate(BaseGate):
         status = DBStatus()
         mnum = 'm' + str(random.randint(0xff, 0xfff))
         scenario = "select '%s' as MAGICPING from dual;" % mnum # :-)
-        status.stdout, status.stderr = self.syscall("sudo", "-u", "oracle", "/bin/bash",
-                                                    input=self.get_scenario_template(login=login).replace(
-                                                        '@scenario', scenario))
+        status.stdout, status.stderr = self.call_script(scenario, login=login)
         status.ready = False
         for line in [line.strip() for line in status.stdout.lower().split("\n")]:
             if line == mnum:
@@ -966,8 +1053,7 @@ class OracleGate(BaseGate):
             scenario = []
             for fname in stdout.strip().split("\n"):
                 scenario.append("alter database datafile '{}' autoextend on;".format(fname))
-            self.syscall("sudo", "-u", "oracle", "/bin/bash",
-                         input=self.get_scenario_template().replace('@scenario', '\n'.join(scenario)))
+            self.call_script('\n'.join(scenario))
             print("%s table%s has been autoextended" % (len(scenario), len(scenario) > 1 and 's' or ''))
         else:
             print("Autoextensible:\tYes")
@@ -1017,7 +1103,6 @@ class OracleGate(BaseGate):
         else:
             roller.stop(failed)
 
-        time.sleep(1)
 
     def get_archivelog_mode(self):
         """
@@ -1120,72 +1205,55 @@ class OracleGate(BaseGate):
         healthy_backups = []
         failed_archivelogs = []
         healthy_archivelogs = []
-        bkpsout = None
-        arlgout = None
 
-        # Get database backups
-        stdout, stderr = self.call_scenario('rman-backup-check-db', target='rman')
-        if stderr:
+        # Check failed backups
+        output = self.stream_scenario('rman-backup-check-db', target='rman')
+        status = None
+        for line in output:
+            line = line.strip()
+            if line.startswith("crosschecked backup piece"):
+                status = line.split(" ")[-1].replace("'", '').lower()
+            elif status is not None:
+                data = dict(filter(None, map(lambda elm: "=" in elm and tuple(elm.split("=", 1)) or None,
+                                             filter(None, line.split(" ")))))
+                if not all(key in data for key in ('handle', 'RECID', 'STAMP')):
+                    continue  # Wrapped or unrelated line, the piece follows
+                hinfo = HandleInfo(status, handle=data['handle'], recid=data['RECID'], stamp=data['STAMP'])
+                if hinfo.availability == 'available':
+                    healthy_backups.append(hinfo)
+                else:
+                    failed_backups.append(hinfo)
+                status = None
+        if output.stderr:
             eprint("Backup information check failure:")
-            eprint(stderr)
+            eprint(output.stderr)
             raise GateException("Unable to check the backups.")
 
-        for chunk in stdout.split("RMAN>"):
-            chunk = chunk.strip()
-            if not chunk:
-                continue
-            if chunk.find("crosschecked backup piece") > -1:
-                bkpsout = chunk
-                break
-
-        # Get database archive logs check
-        stdout, stderr = self.call_scenario('rman-backup-check-al', target='rman')
-        if stderr:
+        # Check failed archive logs
+        output = self.stream_scenario('rman-backup-check-al', target='rman')
+        status = None
+        for line in output:
+            line = line.strip()
+            if line.startswith("validation"):
+                status = line.split(" ")[1]
+            elif status is not None:
+                data = dict(filter(None, map(lambda elm: '=' in elm and tuple(elm.split('=', 1)) or None,
+                                             line.split(" "))))
+                if not all(key in data for key in ('name', 'RECID', 'STAMP')):
+                    continue  # Wrapped or unrelated line, the log follows
+                # Ask RMAN devs why this time it is called "name"
+                hinfo = HandleInfo(status == 'succeeded' and 'available' or 'unavailable', recid=data['RECID'],
+                                   stamp=data['STAMP'], handle=data['name'])
+                if hinfo.availability == 'available':
+                    healthy_archivelogs.append(hinfo)
+                else:
+                    failed_archivelogs.append(hinfo)
+                status = None
+        if output.stderr:
             eprint("Archive log information check failure:")
-            eprint(stderr)
+            eprint(output.stderr)
             raise GateException("Unable to check the archive logs backup.")
 
-        for chunk in stdout.split("RMAN>"):
-            chunk = chunk.strip()
-            if not chunk:
-                continue
-            if chunk.find("archived log file name") > -1:
-                arlgout = chunk
-                break
-
-        # Check failed backups
-        if bkpsout:
-            for line in map(lambda elm: elm.strip(), bkpsout.split("crosschecked")):
-                if not line.startswith("backup piece"):
-                    continue
-                obj_raw = line.split("\n")[:2]
-                if len(obj_raw) == 2:
-                    status = obj_raw[0].strip().split(" ")[-1].replace("'", '').lower()
-                    data = dict(filter(None, map(lambda elm: "=" in elm and tuple(elm.split("=", 1)) or None,
-                                                 filter(None, obj_raw[-1].split(" ")))))
-                    hinfo = HandleInfo(status, handle=data['handle'], recid=data['RECID'], stamp=data['STAMP'])
-                    if hinfo.availability == 'available':
-                        healthy_backups.append(hinfo)
-                    else:
-                        failed_backups.append(hinfo)
-
-        # Check failed archive logs
-        if arlgout:
-            for archline in map(lambda elm: elm.strip(),
-                                arlgout.split("validation", 1)[-1].split("Crosschecked")[0].split("validation")):
-                obj_raw = archline.split("\n")
-                if len(obj_raw) == 2:
-                    status = obj_raw[0].split(" ")[0]
-                    data = dict(filter(None, map(lambda elm: '=' in elm and tuple(elm.split('=', 1)) or None,
-                                                 obj_raw[1].split(" "))))
-                    # Ask RMAN devs why this time it is called "name"
-                    hinfo = HandleInfo(status == 'succeeded' and 'available' or 'unavailable', recid=data['RECID'],
-                                       stamp=data['STAMP'], handle=data['name'])
-                    if hinfo.availability == 'available':
-                        healthy_archivelogs.append(hinfo)
-                    else:
-                        failed_archivelogs.append(hinfo)
-
         return healthy_backups, failed_backups, healthy_archivelogs, failed_archivelogs
 
     def get_backup_info(self):
@@ -1227,10 +1295,8 @@ class OracleGate(BaseGate):
         dbstatus = self.get_db_status()
         if dbstatus.ready:
             roller.stop("running")
-            time.sleep(1)
         else:
             roller.stop("failed")
-            time.sleep(1)
             raise GateException(message)
 
     def get_current_rfds(self):
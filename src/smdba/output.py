@@ -0,0 +1,117 @@
+# coding: utf-8
+"""
+Output of the gate commands: human readable text or JSON records.
+"""
+
+import sys
+import json
+import typing
+
+
+class Output:
+    """
+    Human readable output. Reports are rendered as text by the commands themselves.
+    """
+
+    FORMAT = "text"
+
+    def __init__(self, stream: typing.Optional[typing.TextIO] = None) -> None:
+        self.stream = stream or sys.stdout
+
+    @staticmethod
+    def get_record(fields: typing.Sequence[str], record: typing.Sequence[typing.Any]) -> typing.Dict[str, typing.Any]:
+        """
+        Get record with named fields.
+        """
+        return dict(zip(fields, record))
+
+    def report(self, name: str, fields: typing.Sequence[str], records: typing.Iterable[typing.Sequence[typing.Any]],
+               text: typing.Optional[typing.Callable[[typing.Iterable[typing.Sequence[typing.Any]]], None]] = None) -> None:
+        """
+        Output records of the report.
+
+        :param name: name of the report
+        :param fields: names of the record fields
+        :param records: records, consumed only once
+        :param text: function, printing the records as text
+        """
+        if text is not None:
+            text(records)
+
+    def finish(self, command: str, messages: typing.Optional[typing.List[str]] = None,
+               error: typing.Optional[str] = None) -> None:
+        """
+        Finish output of the command.
+
+        :param command: command name
+        :param messages: other lines, printed by the command
+        :param error: error, if the command failed
+        """
+
+    def _write(self, data: typing.Dict[str, typing.Any]) -> None:
+        """
+        Write one JSON document on its own line.
+        """
+        self.stream.write(json.dumps(data, default=str) + "\n")
+
+
+class JsonOutput(Output):
+    """
+    One JSON document with all reports, written when the command is finished.
+    """
+
+    FORMAT = "json"
+
+    def __init__(self, stream: typing.Optional[typing.TextIO] = None) -> None:
+        Output.__init__(self, stream)
+        self.reports: typing.Dict[str, typing.List[typing.Dict[str, typing.Any]]] = {}
+
+    def report(self, name: str, fields: typing.Sequence[str], records: typing.Iterable[typing.Sequence[typing.Any]],
+               text: typing.Optional[typing.Callable[[typing.Iterable[typing.Sequence[typing.Any]]], None]] = None) -> None:
+        self.reports.setdefault(name, []).extend(self.get_record(fields, record) for record in records)
+
+    def finish(self, command: str, messages: typing.Optional[typing.List[str]] = None,
+               error: typing.Optional[str] = None) -> None:
+        self._write({"command": command, "status": "error" if error else "ok", "error": error,
+                     "reports": self.reports, "messages": messages or []})
+        self.stream.flush()
+        self.reports = {}
+
+
+class NdjsonOutput(Output):
+    """
+    Every record is written as a separate JSON document as soon as it is available,
+    followed by the status document of the command.
+    """
+
+    FORMAT = "ndjson"
+
+    def report(self, name: str, fields: typing.Sequence[str], records: typing.Iterable[typing.Sequence[typing.Any]],
+               text: typing.Optional[typing.Callable[[typing.Iterable[typing.Sequence[typing.Any]]], None]] = None) -> None:
+        for record in records:
+            data = {"report": name}
+            data.update(self.get_record(fields, record))
+            self._write(data)
+        self.stream.flush()
+
+    def finish(self, command: str, messages: typing.Optional[typing.List[str]] = None,
+               error: typing.Optional[str] = None) -> None:
+        self._write({"command": command, "status": "error" if error else "ok", "error": error,
+                     "messages": messages or []})
+        self.stream.flush()
+
+
+FORMATS = {output.FORMAT: output for output in [Output, JsonOutput, NdjsonOutput]}
+
+
+def get_output(fmt: str, stream: typing.Optional[typing.TextIO] = None) -> Output:
+    """
+    Get output of the format.
+
+    :param fmt: text, json or ndjson
+    :raises ValueError: if format is unknown.
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown output format \"{}\". Use one of: {}".format(fmt, ", ".join(sorted(FORMATS))))
+
+    return FORMATS[fmt](stream)
@@ -0,0 +1,789 @@
+# coding: utf-8
+"""
+PostgreSQL WAL archiver.
+
+Used as "archive_command". Segments are handed off to the running
+archiver daemon over a local socket, or copied in place if there is none.
+In the streaming mode segments are received continuously by the
+supervised pg_receivewal instead.
+"""
+
+import os
+import re
+import sys
+import time
+import fcntl
+import signal
+import subprocess
+import json
+import socket
+import shutil
+import zlib
+import struct
+import hashlib
+import threading
+import socketserver
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from smdba.utils import eprint
+from smdba.pgcatalog import BackupCatalog, CatalogException
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+
+class ArchiveException(Exception):
+    """
+    Archive exception.
+    """
+
+
+# Header of the compressed segment: magic, format version, codec, original size, SHA1 of the original
+HEADER = struct.Struct(">8sBBxxQ20s")
+MAGIC = b"SMDBAWAL"
+VERSION = 1
+CODECS = {"gzip": 1, "zstd": 2}
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+
+
+def _get_compressor(compression: str, level: typing.Optional[int] = None) -> typing.Any:
+    """
+    Get streaming compressor for the codec.
+
+    :raises ArchiveException: if codec is unknown or not available.
+    """
+    if compression not in CODECS:
+        raise ArchiveException("Unknown compression: {}".format(compression))
+    level = DEFAULT_LEVELS[compression] if level is None else level
+    if compression == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    if zstandard is None:
+        raise ArchiveException("Compression zstd requires python3-zstandard package.")
+
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+def _get_decompressor(codec: int) -> typing.Any:
+    """
+    Get streaming decompressor for the codec ID.
+
+    :raises ArchiveException: if codec is unknown or not available.
+    """
+    if codec == CODECS["gzip"]:
+        return zlib.decompressobj(31)
+    if codec == CODECS["zstd"]:
+        if zstandard is None:
+            raise ArchiveException("Segment is compressed with zstd, which requires python3-zstandard package.")
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    raise ArchiveException("Unknown compression codec: {}".format(codec))
+
+
+def read_header(path: str) -> typing.Optional[typing.Tuple[int, int, str]]:
+    """
+    Read header of the compressed segment.
+
+    :returns: codec, original size and SHA1 of the original or None, if segment is not compressed.
+    """
+    with open(path, "rb") as src:
+        data = src.read(HEADER.size)
+    if len(data) < HEADER.size or not data.startswith(MAGIC):
+        return None
+    _, version, codec, size, digest = HEADER.unpack(data)
+    if version != VERSION:
+        raise ArchiveException("Unsupported archive format version {} of {}".format(version, path))
+
+    return codec, size, digest.hex()
+
+
+def file_checksum(path: str, bufsize: int = 0x100000) -> str:
+    """
+    Get SHA1 checksum of the file.
+    For a compressed segment, the checksum of the original is taken from its header.
+    """
+    header = read_header(path)
+    if header is not None:
+        return header[2]
+
+    checksum = hashlib.sha1()
+    with open(path, "rb") as src:
+        while True:
+            chunk = src.read(bufsize)
+            if not chunk:
+                break
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
+
+
+def _sync_dir(path: str) -> None:
+    """
+    Sync directory entries to the disk.
+    """
+    dirfd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(dirfd)
+    finally:
+        os.close(dirfd)
+
+
+def archive_segment(source: str, destination: str, bufsize: int = 0x100000, accept_identical: bool = False,
+                    compression: typing.Optional[str] = None, level: typing.Optional[int] = None) -> str:
+    """
+    Copy WAL segment to the archive in a single read pass.
+
+    Checksum is computed while copying. The copy is written to a temporary file,
+    synced to the disk and then linked to the destination, so an existing file is
+    never overwritten and a half-written segment never appears in the archive.
+
+    :param source: path to the WAL segment
+    :param destination: path to the archived file
+    :param bufsize: size of the copy buffer
+    :param accept_identical: succeed if destination already exists with the same content.
+    :param compression: store segment compressed with "gzip" or "zstd", with a header.
+    :param level: compression level
+    :raises ArchiveException: if segment cannot be archived.
+    :returns: SHA1 checksum of the segment
+    """
+    if not os.path.isfile(source):
+        raise ArchiveException("No such file: {}".format(source))
+
+    destdir = os.path.dirname(destination) or "."
+    if not os.path.isdir(destdir):
+        raise ArchiveException("Destination directory does not exist: {}".format(destdir))
+
+    if os.path.exists(destination):
+        if accept_identical:
+            checksum = file_checksum(source, bufsize=bufsize)
+            if checksum == file_checksum(destination, bufsize=bufsize):
+                return checksum
+        raise ArchiveException("File already exists: {}".format(destination))
+
+    compressor = _get_compressor(compression, level) if compression else None
+    temp = os.path.join(destdir, ".{}.{}.tmp".format(os.path.basename(destination), os.getpid()))
+    checksum = hashlib.sha1()
+    size = 0
+    try:
+        with open(source, "rb") as src, open(temp, "wb") as dst:
+            if compressor is not None:
+                dst.write(b"\0" * HEADER.size)  # Placeholder, checksum is known at the end
+            while True:
+                chunk = src.read(bufsize)
+                if not chunk:
+                    break
+                checksum.update(chunk)
+                size += len(chunk)
+                dst.write(compressor.compress(chunk) if compressor is not None else chunk)
+            if compressor is not None:
+                assert compression is not None
+                dst.write(compressor.flush())
+                dst.seek(0)
+                dst.write(HEADER.pack(MAGIC, VERSION, CODECS[compression], size, checksum.digest()))
+            dst.flush()
+            shutil.copystat(source, temp)
+            if os.geteuid() == 0:
+                stat_info = os.stat(source)
+                os.chown(temp, stat_info.st_uid, stat_info.st_gid)
+            os.fsync(dst.fileno())
+        os.link(temp, destination)
+    except FileExistsError:
+        raise ArchiveException("File already exists: {}".format(destination))
+    except OSError as ex:
+        raise ArchiveException("Copy command failed: {}".format(ex))
+    finally:
+        if os.path.exists(temp):
+            os.unlink(temp)
+    _sync_dir(destdir)
+
+    return checksum.hexdigest()
+
+
+def _read_segment(source: str, checksum: typing.Any, bufsize: int = 0x100000) -> typing.Iterator[bytes]:
+    """
+    Read archived segment, decompressing it if needed.
+
+    :param checksum: SHA1 hash object, updated with the original content
+    :raises ArchiveException: after the last chunk, if compressed segment does not match its header.
+    """
+    header = read_header(source)
+    decompressor = _get_decompressor(header[0]) if header is not None else None
+    size = 0
+    with open(source, "rb") as src:
+        if header is not None:
+            src.seek(HEADER.size)
+        while True:
+            chunk = src.read(bufsize)
+            if not chunk:
+                break
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            checksum.update(chunk)
+            size += len(chunk)
+            yield chunk
+        if decompressor is not None and hasattr(decompressor, "flush"):
+            chunk = decompressor.flush()
+            checksum.update(chunk)
+            size += len(chunk)
+            yield chunk
+
+    if header is not None and (header[1] != size or header[2] != checksum.hexdigest()):
+        raise ArchiveException("Checksum error {}: archived segment is damaged".format(source))
+
+
+def verify_segment(source: str, sha1: typing.Optional[str] = None, size: typing.Optional[int] = None,
+                   bufsize: int = 0x100000) -> str:
+    """
+    Verify archived segment without restoring it.
+
+    :param source: path to the archived file
+    :param sha1: expected SHA1 checksum of the original, if known
+    :param size: expected size of the original, if known
+    :raises ArchiveException: if segment is damaged.
+    :returns: SHA1 checksum of the segment
+    """
+    checksum = hashlib.sha1()
+    total = 0
+    try:
+        for chunk in _read_segment(source, checksum, bufsize=bufsize):
+            total += len(chunk)
+    except (OSError, zlib.error) as ex:
+        raise ArchiveException("Unable to read {}: {}".format(source, ex))
+    if size is not None and total != size:
+        raise ArchiveException("Size error {}: {} bytes instead of {}".format(source, total, size))
+    if sha1 is not None and checksum.hexdigest() != sha1:
+        raise ArchiveException("Checksum error {}: archived segment is damaged".format(source))
+
+    return checksum.hexdigest()
+
+
+def restore_segment(source: str, destination: str, bufsize: int = 0x100000) -> str:
+    """
+    Restore archived segment, decompressing it if needed.
+    Used as "restore_command".
+
+    :param source: path to the archived file
+    :param destination: path, where PostgreSQL expects the segment
+    :raises ArchiveException: if segment is missing or damaged.
+    :returns: SHA1 checksum of the segment
+    """
+    if not os.path.isfile(source) and os.path.isfile(source + ".partial"):
+        # The latest segment, still being streamed
+        source += ".partial"
+    if not os.path.isfile(source):
+        raise ArchiveException("No such file: {}".format(source))
+
+    destdir = os.path.dirname(destination) or "."
+    temp = os.path.join(destdir, ".{}.{}.tmp".format(os.path.basename(destination), os.getpid()))
+    checksum = hashlib.sha1()
+    try:
+        with open(temp, "wb") as dst:
+            for chunk in _read_segment(source, checksum, bufsize=bufsize):
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.rename(temp, destination)
+    except (OSError, zlib.error) as ex:
+        raise ArchiveException("Restore failed: {}".format(ex))
+    finally:
+        if os.path.exists(temp):
+            os.unlink(temp)
+
+    return checksum.hexdigest()
+
+
+def record_archived(source: str, destination: str, sha1: typing.Optional[str] = None,
+                    compression: typing.Optional[str] = None) -> None:
+    """
+    Record archived file in the backup catalog.
+    Catalog is only an index: failure to update it does not fail the archiving.
+    """
+    try:
+        catalog = BackupCatalog(os.path.dirname(os.path.abspath(destination)))
+        try:
+            catalog.add_file(os.path.basename(destination), size=os.path.getsize(source),
+                             stored=os.path.getsize(destination) if os.path.exists(destination) else None,
+                             sha1=sha1, compression=compression)
+        finally:
+            catalog.close()
+    except (CatalogException, OSError) as ex:
+        eprint("Warning: {}".format(ex))
+
+
+def restore_staged(name: str, staging: str, destination: str) -> bool:
+    """
+    Restore segment, prefetched into the staging directory.
+
+    :param name: name of the segment
+    :param staging: directory with prefetched segments
+    :param destination: path, where PostgreSQL expects the segment
+    :returns: False, if the segment was not prefetched
+    """
+    staged = os.path.join(staging, name)
+    if not os.path.isfile(staged):
+        return False
+    try:
+        shutil.move(staged, destination)
+    except OSError as ex:
+        raise ArchiveException("Restore failed: {}".format(ex))
+
+    return True
+
+
+def get_next_segments(name: str, count: int, segment_size: int = 0x1000000) -> typing.List[str]:
+    """
+    Get names of the next WAL segments on the same timeline.
+
+    :param name: name of the current segment
+    :param count: number of the next segments
+    :param segment_size: WAL segment size
+    """
+    names: typing.List[str] = []
+    if not STREAMED.match(name) or name.endswith(".history"):
+        return names
+
+    timeline, log_id, segment = int(name[:8], 16), int(name[8:16], 16), int(name[16:24], 16)
+    per_log = 0x100000000 // segment_size
+    for _ in range(count):
+        segment += 1
+        if segment >= per_log:
+            log_id, segment = log_id + 1, 0
+        names.append("%08X%08X%08X" % (timeline, log_id, segment))
+
+    return names
+
+
+def prefetch_segments(archive: str, staging: str, names: typing.List[str]) -> int:
+    """
+    Restore archived segments into the staging directory on several threads.
+    Only one prefetcher runs on the staging directory at a time.
+
+    :param archive: directory of the WAL archive
+    :param staging: local directory for prefetched segments
+    :param names: names of the segments
+    :returns: number of prefetched segments
+    """
+    with open(os.path.join(staging, ".prefetch.lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return 0  # Another prefetcher is still running
+
+        names = [name for name in names if not os.path.exists(os.path.join(staging, name))
+                 and os.path.isfile(os.path.join(archive, name))]
+        if not names:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(len(names), os.cpu_count() or 1)) as pool:
+            jobs = [pool.submit(restore_segment, os.path.join(archive, name), os.path.join(staging, name))
+                    for name in names]
+
+        # Failed segments are restored from the archive on request
+        return len([job for job in jobs if job.exception() is None])
+
+
+def spawn_prefetch(archive: str, staging: str, name: str, count: int) -> None:
+    """
+    Prefetch segments, following the requested one, in a detached process,
+    so restoring the requested segment is not delayed.
+    """
+    catalog = BackupCatalog.open(archive)
+    segment_size = 0x1000000
+    if catalog is not None:
+        segment_size = catalog.get_segment_size()
+        catalog.close()
+    names = get_next_segments(name, count, segment_size=segment_size)
+    if not names or os.fork():
+        return
+
+    # Detached child: PostgreSQL waits only for the restore command itself
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fdesc in range(3):
+            os.dup2(devnull, fdesc)
+        prefetch_segments(archive, staging, names)
+    finally:
+        os._exit(0)  # pylint: disable=W0212
+
+
+class ArchiveHandler(socketserver.StreamRequestHandler):
+    """
+    Archive request handler.
+
+    Request and response are single JSON lines:
+        {"source": <path>, "destination": <path>, "compression": <codec or null>, "level": <int or null>}
+        {"status": "ok", "sha1": <checksum>} or {"status": "error", "message": <text>}
+    """
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+                server = typing.cast(PgArchiver, self.server)
+                response = {"status": "ok", "sha1": server.archive(request["source"], request["destination"],
+                                                                   compression=request.get("compression"),
+                                                                   level=request.get("level"))}
+            except Exception as ex:  # pylint: disable=W0703
+                # Archive command falls back to archiving by itself
+                response = {"status": "error", "message": str(ex) or ex.__class__.__name__}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class PgArchiver(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Archiver daemon, listening on the local socket.
+
+    With more than one worker, segments that PostgreSQL already marked as ready
+    in "archive_status" are copied ahead on a worker pool. A request is still
+    acknowledged only after its own segment is synced to the disk.
+    """
+
+    SOCKET = "/var/run/postgresql/.s.smdba-pgarchive"
+    JOB_WINDOW = 600  # Seconds to keep the segment, copied ahead, but never requested
+    daemon_threads = True
+
+    def __init__(self, path: typing.Optional[str] = None, workers: int = 1) -> None:
+        self.workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        self._jobs: typing.Dict[str, typing.Tuple[float, "Future[str]"]] = {}
+        self._lock = threading.Lock()
+        self.path = path or PgArchiver.SOCKET
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise ArchiveException("Archiver is already running on {}".format(self.path))
+            except OSError:
+                os.unlink(self.path)  # Stale socket
+            finally:
+                probe.close()
+        socketserver.UnixStreamServer.__init__(self, self.path, ArchiveHandler)
+        os.chmod(self.path, 0o600)
+        with open(self.path + ".pid", "w") as pidfile:
+            pidfile.write(str(os.getpid()))
+
+    def _submit(self, source: str, destination: str, **options: typing.Any) -> "Future[str]":
+        """
+        Schedule archiving of the segment, unless it is already scheduled.
+        Finished jobs, not claimed within the window, are dropped.
+        """
+        assert self._pool is not None
+        now = time.monotonic()
+        with self._lock:
+            for name, (submitted, job) in list(self._jobs.items()):
+                if job.done() and now - submitted > self.JOB_WINDOW:
+                    del self._jobs[name]
+            job = self._jobs.get(destination, (now, None))[1]
+            if job is None or (job.done() and job.exception() is not None):
+                # Segment could be copied ahead before the daemon restarted
+                job = self._pool.submit(archive_segment, source, destination, accept_identical=True, **options)
+                self._jobs[destination] = (now, job)
+
+        return job
+
+    def _read_ahead(self, source: str, destination: str, **options: typing.Any) -> None:
+        """
+        Schedule archiving of the next ready segments.
+        """
+        wal_dir, current = os.path.split(source)
+        try:
+            ready = sorted(fname[:-len(".ready")] for fname in os.listdir(os.path.join(wal_dir, "archive_status"))
+                           if fname.endswith(".ready"))
+        except OSError:
+            return
+
+        for name in [name for name in ready if name > current][:self.workers * 2]:
+            self._submit(os.path.join(wal_dir, name), os.path.join(os.path.dirname(destination), name), **options)
+
+    def archive(self, source: str, destination: str, compression: typing.Optional[str] = None,
+                level: typing.Optional[int] = None) -> str:
+        """
+        Archive the segment and return after it is durable.
+
+        :raises ArchiveException: if segment cannot be archived.
+        :returns: SHA1 checksum of the segment
+        """
+        if self._pool is None:
+            checksum = archive_segment(source, destination, compression=compression, level=level)
+        else:
+            job = self._submit(source, destination, compression=compression, level=level)
+            self._read_ahead(source, destination, compression=compression, level=level)
+            try:
+                checksum = job.result()
+            finally:
+                with self._lock:
+                    self._jobs.pop(destination, None)
+        record_archived(source, destination, sha1=checksum, compression=compression)
+
+        return checksum
+
+    def server_close(self) -> None:
+        socketserver.UnixStreamServer.server_close(self)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        for path in [self.path, self.path + ".pid"]:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def get_archiver_pid(path: typing.Optional[str] = None) -> typing.Optional[int]:
+    """
+    Get PID of the running archiver daemon.
+
+    :param path: socket of the daemon
+    :returns: PID or None, if daemon is not running
+    """
+    try:
+        with open((path or PgArchiver.SOCKET) + ".pid") as pidfile:
+            pid = int(pidfile.read().strip())
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return None
+
+    return pid
+
+
+def request_archive(source: str, destination: str, path: typing.Optional[str] = None,
+                    compression: typing.Optional[str] = None, level: typing.Optional[int] = None) -> typing.Optional[str]:
+    """
+    Hand off the segment to the archiver daemon.
+
+    :raises ArchiveException: if daemon failed to archive the segment.
+    :returns: SHA1 checksum or None, if daemon is not running.
+    """
+    path = path or PgArchiver.SOCKET
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except OSError:
+        conn.close()
+        return None
+
+    with conn, conn.makefile("rwb") as stream:
+        stream.write(json.dumps({"source": os.path.abspath(source), "destination": os.path.abspath(destination),
+                                 "compression": compression, "level": level}).encode("utf-8") + b"\n")
+        stream.flush()
+        line = stream.readline()
+
+    if not line:
+        raise ArchiveException("Archiver daemon closed the connection.")
+    response = json.loads(line.decode("utf-8"))
+    if response.get("status") != "ok":
+        raise ArchiveException(response.get("message", "Unknown archiver error"))
+
+    return typing.cast(str, response["sha1"])
+
+
+# Files, which pg_receivewal receives by itself: WAL segments and timeline history
+STREAMED = re.compile(r"^([0-9A-F]{24}|[0-9A-F]{8}\.history)$")
+
+
+class WalReceiver:
+    """
+    Supervisor of pg_receivewal, restarting it with a backoff.
+    """
+    RECEIVEWAL = "/usr/bin/pg_receivewal"
+    SLOT = "smdba"
+    PIDFILE = ".smdba-receivewal.pid"
+    BACKOFF = 30
+
+    def __init__(self, directory: str, slot: typing.Optional[str] = None) -> None:
+        self.directory = directory
+        self.slot = slot or WalReceiver.SLOT
+        self._process: typing.Optional[subprocess.Popen] = None
+        self._stopped = threading.Event()
+
+    def get_command(self) -> typing.List[str]:
+        """
+        Get pg_receivewal command, flushing WAL as soon as it is received.
+        """
+        return [WalReceiver.RECEIVEWAL, "-D", self.directory, "-S", self.slot, "--synchronous", "--no-loop"]
+
+    def stop(self, *args: typing.Any) -> None:  # pylint: disable=W0613
+        """
+        Stop receiving.
+        """
+        self._stopped.set()
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+
+    def run(self) -> int:
+        """
+        Receive WAL until stopped.
+        """
+        if get_receiver_pid(self.directory) is not None:
+            eprint("WAL receiver is already running")
+            return 1
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        pidfile = os.path.join(self.directory, WalReceiver.PIDFILE)
+        with open(pidfile, "w") as pid:
+            pid.write(str(os.getpid()))
+
+        backoff = 1
+        try:
+            while not self._stopped.is_set():
+                started = time.time()
+                self._process = subprocess.Popen(self.get_command())
+                ret = self._process.wait()
+                if self._stopped.is_set():
+                    break
+
+                # Reset backoff, if the stream was up for a while
+                if time.time() - started > WalReceiver.BACKOFF * 2:
+                    backoff = 1
+                eprint("pg_receivewal exited with code {}, restarting in {}s".format(ret, backoff))
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, WalReceiver.BACKOFF)
+        finally:
+            os.unlink(pidfile)
+
+        return 0
+
+
+def get_receiver_pid(directory: str) -> typing.Optional[int]:
+    """
+    Get PID of the running WAL receiver, streaming into the directory.
+
+    :returns: PID or None, if receiver is not running
+    """
+    try:
+        with open(os.path.join(directory, WalReceiver.PIDFILE)) as pidfile:
+            pid = int(pidfile.read().strip())
+    except (OSError, ValueError):
+        return None
+
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return None  # Receiver of another user is not ours, even if the PID is alive
+
+    return pid
+
+
+def get_streamed_checksum(source: str, destination: str) -> typing.Optional[str]:
+    """
+    Get checksum of the file, if the receiver has already completed it in the archive.
+    pg_receivewal writes ".partial" file and renames it, once the segment is complete and flushed.
+
+    :returns: SHA1 checksum or None, if the archived file is missing or differs from the source.
+    """
+    try:
+        if not os.path.isfile(destination) or os.path.getsize(destination) != os.path.getsize(source):
+            return None
+        checksum = file_checksum(destination)
+        return checksum if checksum == file_checksum(source) else None
+    except (OSError, ArchiveException):
+        return None
+
+
+def get_opts(args: typing.List[str]) -> typing.Dict[str, typing.Union[str, bool]]:
+    """
+    Parse "--key value" and "--key=value" options.
+    """
+    opts: typing.Dict[str, typing.Union[str, bool]] = {}
+    key = None
+    for arg in args:
+        if arg.startswith("--"):
+            key = arg[2:]
+            if "=" in key:
+                key, value = key.split("=", 1)
+                opts[key] = value
+                key = None
+            else:
+                opts[key] = True
+        elif key is not None:
+            opts[key] = arg
+            key = None
+        else:
+            eprint("Parameter without option. Skip")
+
+    return opts
+
+
+def main(args: typing.Optional[typing.List[str]] = None) -> int:
+    """
+    Archiver entry point.
+
+    Usage:
+        smdba-pgarchive [--compress <gzip|zstd>] [--level <number>] --source <path> --destination <path>
+                        [--socket <path>]
+        smdba-pgarchive --restore --source <path> --destination <path> [--staging <path> [--prefetch <number>]]
+        smdba-pgarchive --daemon [--socket <path>] [--workers <number>]
+        smdba-pgarchive --receive --destination <path> [--slot <name>]
+        smdba-pgarchive --stream --source <path> --destination <path>
+    """
+    opts = get_opts(sys.argv[1:] if args is None else args)
+    sock = opts.get("socket") if isinstance(opts.get("socket"), str) else None
+
+    if opts.get("receive"):
+        if not isinstance(opts.get("destination"), str):
+            eprint("Invalid parameters")
+            return 1
+        return WalReceiver(str(opts["destination"]), slot=typing.cast(typing.Optional[str], opts.get("slot"))).run()
+
+    if opts.get("daemon"):
+        try:
+            workers = int(str(opts.get("workers", 1)))
+        except ValueError:
+            eprint("Invalid number of workers")
+            return 1
+        try:
+            server = PgArchiver(typing.cast(typing.Optional[str], sock), workers=workers)
+        except ArchiveException as ex:
+            eprint(ex)
+            return 1
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    source, destination = opts.get("source"), opts.get("destination")
+    if not isinstance(source, str) or not isinstance(destination, str):
+        eprint("Invalid parameters")
+        return 1
+
+    compression = opts.get("compress") if isinstance(opts.get("compress"), str) else None
+    try:
+        level = int(str(opts["level"])) if "level" in opts else None
+    except ValueError:
+        eprint("Invalid compression level")
+        return 1
+    if not str(opts.get("prefetch", "0")).isdigit():
+        eprint("Invalid number of segments to prefetch")
+        return 1
+
+    # Segments are being streamed, unless the receiver is down or has not completed the segment yet
+    if opts.get("stream") and STREAMED.match(os.path.basename(source)) \
+            and get_receiver_pid(os.path.dirname(os.path.abspath(destination))) is not None:
+        checksum = get_streamed_checksum(source, destination)
+        if checksum is not None:
+            record_archived(source, destination, sha1=checksum)
+            return 0
+
+    try:
+        if opts.get("restore"):
+            staging = opts.get("staging")
+            if isinstance(staging, str) and "prefetch" in opts:
+                spawn_prefetch(os.path.dirname(os.path.abspath(source)), staging, os.path.basename(source),
+                               int(str(opts["prefetch"])))
+            if not isinstance(staging, str) or not restore_staged(os.path.basename(source), staging, destination):
+                restore_segment(source, destination)
+        elif request_archive(source, destination, path=typing.cast(typing.Optional[str], sock),
+                             compression=typing.cast(typing.Optional[str], compression), level=level) is None:
+            codec = typing.cast(typing.Optional[str], compression)
+            checksum = archive_segment(source, destination, compression=codec, level=level)
+            record_archived(source, destination, sha1=checksum, compression=codec)
+    except ArchiveException as ex:
+        eprint(ex)
+        return 1
+
+    return 0
@@ -0,0 +1,393 @@
+# coding: utf-8
+"""
+Catalog of the PostgreSQL backup.
+
+Index of archived WAL files and base backups, kept in the backup
+directory. It is maintained by the archiver and by the base backups,
+so status, cleanup and restore do not rescan the archive directory.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import typing
+import contextlib
+
+from smdba.utils import eprint
+
+
+class CatalogException(Exception):
+    """
+    Catalog exception.
+    """
+
+
+class CatalogFile:
+    """
+    Archived file, recognised by its name.
+    """
+    PATTERNS = [
+        ("wal", re.compile(r"^([0-9A-F]{8})([0-9A-F]{16})$")),
+        ("partial", re.compile(r"^([0-9A-F]{8})([0-9A-F]{16})\.partial$")),
+        ("backup", re.compile(r"^([0-9A-F]{8})([0-9A-F]{16})\.[0-9A-F]{8}\.backup$")),
+        ("history", re.compile(r"^([0-9A-F]{8})\.history$")),
+    ]
+
+    def __init__(self, name: str, kind: str, timeline: int, position: typing.Optional[str]) -> None:
+        self.name = name
+        self.kind = kind
+        self.timeline = timeline
+        self.position = position
+
+    @staticmethod
+    def parse(name: str) -> typing.Optional["CatalogFile"]:
+        """
+        Parse the file name.
+
+        :returns: CatalogFile or None, if the file does not belong to the WAL archive.
+        """
+        for kind, pattern in CatalogFile.PATTERNS:
+            match = pattern.match(name)
+            if match:
+                groups = match.groups()
+                return CatalogFile(name, kind, int(groups[0], 16), groups[1] if len(groups) > 1 else None)
+
+        return None
+
+
+# Base backup archive of the current (no suffix) or a previous generation
+BASE_ARCHIVE = re.compile(r"^base(?:-(.+?))?\.tar(?:\.gz|\.zst)?$")
+
+
+def get_manifest_name(archive: str) -> str:
+    """
+    Get name of the backup manifest, belonging to the base backup archive of any generation.
+    """
+    match = BASE_ARCHIVE.match(os.path.basename(archive))
+    suffix = match.group(1) if match else None
+    name = "backup_manifest" if suffix is None else (
+        "backup_manifest.old" if suffix == "old" else "backup_manifest-" + suffix)
+
+    return os.path.join(os.path.dirname(archive), name)
+
+
+def get_incremental_name(archive: str) -> str:
+    """
+    Get directory of incremental backups, belonging to the base backup archive of any generation.
+    """
+    match = BASE_ARCHIVE.match(os.path.basename(archive))
+    suffix = match.group(1) if match else None
+    name = "incremental" if suffix is None else (
+        "incremental.old" if suffix == "old" else "incremental-" + suffix)
+
+    return os.path.join(os.path.dirname(archive), name)
+
+
+def read_wal_range(manifest: str) -> typing.Tuple[typing.Optional[int], typing.Optional[str], typing.Optional[str]]:
+    """
+    Read WAL range, required by the base backup, from its manifest.
+
+    :returns: timeline, start LSN and end LSN or Nones, if unknown.
+    """
+    try:
+        with open(manifest) as mfh:
+            ranges = json.load(mfh).get("WAL-Ranges", [])
+        if ranges:
+            return ranges[0]["Timeline"], ranges[0]["Start-LSN"], ranges[-1]["End-LSN"]
+    except (OSError, ValueError, KeyError):
+        pass  # Backup without a readable manifest is still restorable
+
+    return None, None, None
+
+
+class BackupCatalog:
+    """
+    SQLite catalog in the backup directory.
+    """
+    FILENAME = ".smdba-catalog.db"
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, kind TEXT NOT NULL, timeline INTEGER,
+                                          position TEXT, size INTEGER, stored INTEGER, sha1 TEXT,
+                                          compression TEXT, archived REAL);
+        CREATE INDEX IF NOT EXISTS files_position ON files (kind, position);
+        CREATE INDEX IF NOT EXISTS files_archived ON files (archived);
+        CREATE TABLE IF NOT EXISTS base_backups (name TEXT PRIMARY KEY, kind TEXT NOT NULL, timeline INTEGER,
+                                                 start_lsn TEXT, end_lsn TEXT, size INTEGER, created REAL);
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.path = os.path.join(directory, BackupCatalog.FILENAME)
+        created = not os.path.exists(self.path)
+        try:
+            self._conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._conn.executescript(BackupCatalog.SCHEMA)
+        except sqlite3.Error as ex:
+            raise CatalogException("Unable to open backup catalog {}: {}".format(self.path, ex))
+
+        # Catalog belongs to the archiver, even if created by root
+        if created and os.geteuid() == 0:
+            stat_info = os.stat(directory)
+            os.chown(self.path, stat_info.st_uid, stat_info.st_gid)
+
+        if self._get_meta("complete") is None:
+            self.rebuild()
+
+    @staticmethod
+    def open(directory: str) -> typing.Optional["BackupCatalog"]:
+        """
+        Open existing catalog of the backup directory.
+
+        :returns: BackupCatalog or None, if there is no usable catalog, so the directory should be scanned.
+        """
+        if not os.path.exists(os.path.join(directory, BackupCatalog.FILENAME)):
+            return None
+
+        try:
+            return BackupCatalog(directory)
+        except CatalogException as ex:
+            eprint("Warning: {}".format(ex))
+            return None
+
+    def close(self) -> None:
+        """
+        Close the catalog.
+        """
+        self._conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self) -> typing.Iterator[sqlite3.Connection]:
+        """
+        Write transaction, serialised with other writers.
+        """
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as ex:
+            raise CatalogException("Backup catalog {} error: {}".format(self.path, ex))
+
+    def _get_meta(self, key: str) -> typing.Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def get_setting(self, key: str) -> typing.Optional[str]:
+        """
+        Get setting of the backup, stored in the catalog.
+        """
+        return self._get_meta("setting." + key)
+
+    def set_setting(self, key: str, value: typing.Optional[str]) -> None:
+        """
+        Store setting of the backup in the catalog. None removes the setting.
+        """
+        with self._transaction() as conn:
+            if value is None:
+                conn.execute("DELETE FROM meta WHERE key = ?", ("setting." + key,))
+            else:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", ("setting." + key, value))
+
+    def rebuild(self) -> None:
+        """
+        Index files, which are already in the backup directory.
+        This is the only full scan, done once when the catalog is created.
+        """
+        with self._transaction() as conn:
+            if self._get_meta("complete") is not None:
+                return  # Another process did it meanwhile
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if BASE_ARCHIVE.match(entry.name) and entry.is_file():
+                        stat_info = entry.stat()
+                        conn.execute("INSERT OR IGNORE INTO base_backups (name, kind, timeline, start_lsn, end_lsn, "
+                                     "size, created) VALUES (?, 'full', ?, ?, ?, ?, ?)",
+                                     (entry.name,) + read_wal_range(get_manifest_name(entry.path)) +
+                                     (stat_info.st_size, stat_info.st_mtime))
+                        continue
+                    cfile = CatalogFile.parse(entry.name)
+                    if cfile is None or not entry.is_file():
+                        continue
+                    stat_info = entry.stat()
+                    conn.execute("INSERT OR IGNORE INTO files (name, kind, timeline, position, stored, archived) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)",
+                                 (cfile.name, cfile.kind, cfile.timeline, cfile.position, stat_info.st_size,
+                                  stat_info.st_mtime))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('complete', ?)", (str(time.time()),))
+
+    def add_file(self, name: str, size: typing.Optional[int] = None, stored: typing.Optional[int] = None,
+                 sha1: typing.Optional[str] = None, compression: typing.Optional[str] = None) -> None:
+        """
+        Record archived file.
+
+        :param name: file name in the backup directory
+        :param size: original size
+        :param stored: size in the backup directory
+        :param sha1: SHA1 checksum of the original
+        :param compression: codec of the stored file
+        """
+        cfile = CatalogFile.parse(name)
+        if cfile is None:
+            return
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO files (name, kind, timeline, position, size, stored, sha1, "
+                         "compression, archived) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (cfile.name, cfile.kind, cfile.timeline, cfile.position, size, stored, sha1,
+                          compression, time.time()))
+
+    def remove_files(self, names: typing.Iterable[str]) -> None:
+        """
+        Forget removed files.
+        """
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM files WHERE name = ?", [(name,) for name in names])
+
+    def get_files(self, kind: str, before: typing.Optional[str] = None) -> typing.List[str]:
+        """
+        Get names of the archived files of the kind, in WAL order.
+
+        :param kind: wal, partial, backup or history
+        :param before: only files preceding this WAL file name, regardless of the timeline
+        """
+        if before is None:
+            rows = self._conn.execute("SELECT name FROM files WHERE kind = ? ORDER BY position, name", (kind,))
+        else:
+            rows = self._conn.execute("SELECT name FROM files WHERE kind = ? AND position < ? ORDER BY position, name",
+                                      (kind, before[8:24]))
+
+        return [row[0] for row in rows]
+
+    def get_files_between(self, kind: str, first: str, last: str) -> typing.List[str]:
+        """
+        Get names of the archived files of the kind between two WAL file names inclusive,
+        regardless of the timeline, in WAL order.
+        """
+        return [row[0] for row in self._conn.execute(
+            "SELECT name FROM files WHERE kind = ? AND position BETWEEN ? AND ? ORDER BY position, name",
+            (kind, first[8:24], last[8:24]))]
+
+    def get_segment_size(self) -> int:
+        """
+        Get WAL segment size from the latest archived segment, 16MB by default.
+        """
+        row = self._conn.execute("SELECT size FROM files WHERE kind = 'wal' AND size IS NOT NULL "
+                                 "ORDER BY archived DESC LIMIT 1").fetchone()
+
+        return int(row[0]) if row else 0x1000000
+
+    def get_archived_after(self, timestamp: float) -> typing.Optional[str]:
+        """
+        Get the first WAL segment, archived at or after the time.
+        It contains the WAL written at that time or earlier.
+        """
+        row = self._conn.execute("SELECT name FROM files WHERE kind = 'wal' AND archived >= ? "
+                                 "ORDER BY archived LIMIT 1", (timestamp,)).fetchone()
+
+        return row[0] if row else None
+
+    def get_archived_since(self, timestamp: float) -> typing.Tuple[int, int, int]:
+        """
+        Get number, original and stored size of the WAL segments, archived at or after the time.
+        Original size is assumed to be the segment size, if it is unknown.
+        """
+        segment_size = self.get_segment_size()
+        count, size, stored = self._conn.execute(
+            "SELECT COUNT(*), SUM(COALESCE(size, ?)), SUM(COALESCE(stored, size, ?)) FROM files "
+            "WHERE kind = 'wal' AND archived >= ?", (segment_size, segment_size, timestamp)).fetchone()
+
+        return int(count), int(size or 0), int(stored or 0)
+
+    def get_last_wal(self) -> typing.Optional[str]:
+        """
+        Get the archived WAL segment with the highest position on the latest timeline.
+        """
+        row = self._conn.execute("SELECT name FROM files WHERE kind = 'wal' "
+                                 "ORDER BY timeline DESC, position DESC LIMIT 1").fetchone()
+
+        return row[0] if row else None
+
+    def get_checksums(self, kind: str) -> typing.Dict[str, typing.Tuple[typing.Optional[str], typing.Optional[int]]]:
+        """
+        Get recorded SHA1 checksums and original sizes of the archived files of the kind.
+        """
+        return {name: (sha1, size) for name, sha1, size in self._conn.execute(
+            "SELECT name, sha1, size FROM files WHERE kind = ?", (kind,))}
+
+    def get_file(self, name: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        """
+        Get record of the archived file.
+        """
+        cursor = self._conn.execute("SELECT * FROM files WHERE name = ?", (name,))
+        row = cursor.fetchone()
+
+        return dict(zip([col[0] for col in cursor.description], row)) if row else None
+
+    def get_last_archived(self) -> float:
+        """
+        Get time of the latest change in the backup.
+        """
+        last = self._conn.execute("SELECT MAX(archived) FROM files").fetchone()[0] or 0.
+        base = self._conn.execute("SELECT MAX(created) FROM base_backups").fetchone()[0] or 0.
+
+        return float(max(last, base))
+
+    def add_base_backup(self, name: str, kind: str, size: int, manifest: typing.Optional[str] = None) -> None:
+        """
+        Record base backup with its WAL range from the backup manifest.
+
+        :param name: path of the archive, relative to the backup directory
+        :param kind: full or incremental
+        :param size: size of the archive
+        :param manifest: path to the backup manifest
+        """
+        timeline, start_lsn, end_lsn = read_wal_range(manifest) if manifest is not None else (None, None, None)
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO base_backups (name, kind, timeline, start_lsn, end_lsn, size, created) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", (name, kind, timeline, start_lsn, end_lsn, size, time.time()))
+
+    def rotate_base_backups(self, suffix: str) -> None:
+        """
+        Current base backup and its incremental backups become a previous generation.
+
+        :param suffix: suffix of the previous generation
+        """
+        with self._transaction() as conn:
+            for (name,) in conn.execute("SELECT name FROM base_backups").fetchall():
+                if name.startswith("base."):
+                    new_name = "base-{}.{}".format(suffix, name[len("base."):])
+                elif name.startswith("incremental/"):
+                    new_name = "incremental-{}/{}".format(suffix, name[len("incremental/"):])
+                else:
+                    continue
+                conn.execute("UPDATE base_backups SET name = ? WHERE name = ?", (new_name, name))
+
+    def remove_generation(self, name: str) -> None:
+        """
+        Forget removed full backup with its incremental backups.
+
+        :param name: name of the full backup archive
+        """
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM base_backups WHERE name = ? OR name LIKE ?",
+                         (name, get_incremental_name(name) + "/%"))
+
+    def get_base_backups(self, generations: bool = False) -> typing.List[typing.Dict[str, typing.Any]]:
+        """
+        Get base backups, oldest first.
+
+        :param generations: get full backups of all generations instead of the current chain
+        """
+        if generations:
+            cursor = self._conn.execute("SELECT * FROM base_backups WHERE kind = 'full' ORDER BY created")
+        else:
+            cursor = self._conn.execute("SELECT * FROM base_backups WHERE name LIKE 'base.%' "
+                                        "OR name LIKE 'incremental/%' ORDER BY created")
+        columns = [col[0] for col in cursor.description]
+
+        return [dict(zip(columns, row)) for row in cursor]
@@ -14,11 +14,44 @@ import time
 import shutil
 import tempfile
 import stat
+import uuid
+import signal
+import subprocess
+import datetime
+import json
+import struct
+import hashlib
+import tarfile
+import threading
+import itertools
+import heapq
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import typing
 
 from smdba.basegate import BaseGate, GateException
 from smdba.roller import Roller
-from smdba.utils import TablePrint, get_path_owner, eprint
+from smdba.utils import TablePrint, get_path_owner, get_binary_version, eprint
+from smdba.filesystem import get_mount, get_usage, get_used_percent, get_tree_size
+from smdba.metrics import Metric, Collector, MetricsRegistry, get_listen_address
+from smdba.pgcatalog import BackupCatalog, CatalogFile, get_manifest_name, get_incremental_name
+from smdba.pgarchive import archive_segment, restore_segment, verify_segment, ArchiveException, CODECS, zstandard, WalReceiver, get_receiver_pid
+from smdba.pgarchive import PgArchiver, get_archiver_pid
+
+try:
+    import crc32c  # type: ignore
+except ImportError:
+    crc32c = None
+
+try:
+    import psycopg2  # type: ignore
+except ImportError:
+    psycopg2 = None
+
+try:
+    import zoneinfo
+except ImportError:
+    zoneinfo = None  # type: ignore
 
 
 class PgBackup:
@@ -31,6 +64,30 @@ class PgBackup:
 
     DEFAULT_PG_DATA = "/var/lib/pgsql/data/"
     PG_ARCHIVE_CLEANUP = "/usr/bin/pg_archivecleanup"
+    PIGZ = "/usr/bin/pigz"
+    ZSTD = "/usr/bin/zstd"
+
+    PG_COMBINEBACKUP = "/usr/bin/pg_combinebackup"
+
+    # Base backup archive names by compression
+    BASE_ARCHIVES = {
+        'gzip': 'base.tar.gz',
+        'zstd': 'base.tar.zst',
+        'none': 'base.tar',
+    }
+
+    # Directory of incremental backups on top of the base backup
+    INCREMENTAL_DIR = "incremental"
+
+    # Number of files, removed from the WAL archive at once
+    PRUNE_BATCH = 0x400
+
+    # Size of tar members, hashed at the same time
+    VERIFY_INFLIGHT = 0x10000000
+
+    # Larger tar members are hashed by chunks, queued to the hashing thread
+    VERIFY_CHUNK = 0x100000
+    VERIFY_QUEUE = 0x10
 
     def __init__(self, target_path: str, pg_data: typing.Optional[str] = None):
         if not os.path.exists(PgBackup.PG_ARCHIVE_CLEANUP):
@@ -48,13 +105,19 @@ class PgBackup:
         history = []
         restart_filename = None
 
-        for fname in os.listdir(path):
-            if not stat.S_ISREG(os.stat(os.path.join(path, fname)).st_mode):
-                continue
-            if fname.endswith(".backup"):
-                checkpoints.append(fname)
-            if fname.endswith(".history"):
-                history.append(fname)
+        catalog = BackupCatalog.open(path)
+        if catalog is not None:
+            checkpoints = catalog.get_files("backup")
+            history = catalog.get_files("history")
+            catalog.close()
+        else:
+            for fname in os.listdir(path):
+                if not stat.S_ISREG(os.stat(os.path.join(path, fname)).st_mode):
+                    continue
+                if fname.endswith(".backup"):
+                    checkpoints.append(fname)
+                if fname.endswith(".history"):
+                    history.append(fname)
 
         checkpoints = sorted(checkpoints)
         history = sorted(history)
@@ -66,18 +129,387 @@ class PgBackup:
 
         return checkpoints, history, restart_filename
 
-    def cleanup_backup(self) -> None:
+    @staticmethod
+    def get_base_archive(path: str, prefix: str = "base") -> typing.Optional[str]:
+        """
+        Find base backup archive of any compression in the directory.
+
+        :returns: full path to the archive or None
+        """
+        for name in PgBackup.BASE_ARCHIVES.values():
+            name = prefix + name[len("base"):]
+            if os.path.exists(os.path.join(path, name)):
+                return os.path.join(path, name)
+
+        return None
+
+    @staticmethod
+    def get_incremental_chain(path: str) -> typing.List[str]:
+        """
+        Find incremental backups on top of the base backup, oldest first.
+
+        :returns: list of incremental backup directories
+        """
+        chain: typing.List[str] = []
+        incr_path = os.path.join(path, PgBackup.INCREMENTAL_DIR)
+        if PgBackup.get_base_archive(path) is None or not os.path.isdir(incr_path):
+            return chain
+
+        for fname in sorted(os.listdir(incr_path)):
+            fname = os.path.join(incr_path, fname)
+            if PgBackup.get_base_archive(fname) is not None and os.path.exists(os.path.join(fname, "backup_manifest")):
+                chain.append(fname)
+
+        return chain
+
+    @staticmethod
+    def get_chain_manifest(path: str) -> typing.Optional[str]:
+        """
+        Find manifest of the latest backup, full or incremental, for the next incremental backup.
+
+        :returns: full path to the manifest or None if there is no base backup
+        """
+        chain = PgBackup.get_incremental_chain(path)
+        if chain:
+            return os.path.join(chain[-1], "backup_manifest")
+        if PgBackup.get_base_archive(path) is not None and os.path.exists(os.path.join(path, "backup_manifest")):
+            return os.path.join(path, "backup_manifest")
+
+        return None
+
+    @staticmethod
+    def get_untar_command(archive: str, target: str, *members: str, from_stdin: bool = False) -> str:
+        """
+        Get command to extract base backup archive, decompressing with threads where possible.
+
+        :param members: extract only these members of the archive
+        :param from_stdin: read the archive from STDIN instead of the file
+        """
+        if archive.endswith(".zst"):
+            decompress = "-I '{} -d -T0'".format(PgBackup.ZSTD)
+        elif archive.endswith(".gz"):
+            decompress = "-I {}".format(PgBackup.PIGZ) if os.path.exists(PgBackup.PIGZ) else "-z"
+        else:
+            decompress = ""
+
+        return ' '.join(filter(None, ['/bin/tar', decompress, '-xf', from_stdin and '-' or archive,
+                                      '--directory=%s' % target] + list(members)))
+
+    @staticmethod
+    def get_wal_name(timeline: int, lsn: str, segment_size: int = 0x1000000) -> str:
+        """
+        Get name of the WAL segment, containing the LSN.
+        """
+        log_id, offset = lsn.split("/")
+        segment = ((int(log_id, 16) << 32) + int(offset, 16)) // segment_size
+        per_log = 0x100000000 // segment_size
+
+        return "%08X%08X%08X" % (timeline, segment // per_log, segment % per_log)
+
+    @staticmethod
+    def get_decompress_command(archive: str) -> typing.List[str]:
+        """
+        Get command, writing decompressed base backup archive to STDOUT, with threads where possible.
+        """
+        if archive.endswith(".zst"):
+            return [PgBackup.ZSTD, "-dcq", "-T0", archive]
+        if archive.endswith(".gz"):
+            return [PgBackup.PIGZ if os.path.exists(PgBackup.PIGZ) else "/usr/bin/gzip", "-dc", archive]
+
+        return ["/bin/cat", archive]
+
+    @staticmethod
+    def _get_manifest_checksum(algorithm: str, chunks: typing.Iterable[bytes]) -> typing.Optional[str]:
+        """
+        Get checksum of the file, as written in the backup manifest.
+
+        :param chunks: content of the file
+        :returns: hex checksum or None, if algorithm is not available.
+        """
+        if algorithm == "CRC32C" and crc32c is not None:
+            crc = 0
+            for chunk in chunks:
+                crc = crc32c.crc32c(chunk, crc)
+            # PostgreSQL writes CRC32C in the native byte order
+            return struct.pack("=I", crc).hex()
+        if algorithm.startswith("SHA"):
+            digest = hashlib.new(algorithm.lower())
+            for chunk in chunks:
+                digest.update(chunk)
+            return digest.hexdigest()
+
+        return None
+
+    @staticmethod
+    def _get_queued_checksum(algorithm: str, chunks: "queue.Queue[typing.Optional[bytes]]") -> typing.Optional[str]:
+        """
+        Get checksum of the file, which content is queued by chunks until None.
+        """
+        stream = iter(chunks.get, None)
+        try:
+            return PgBackup._get_manifest_checksum(algorithm, stream)
+        finally:
+            for _ in stream:
+                pass  # Reader must not block on the full queue
+
+    @staticmethod
+    def verify_base_backup(archive: str, manifest: str, threads: int = 0,
+                           progress: typing.Optional[typing.Callable[..., None]] = None) -> typing.Tuple[int, int, typing.List[str]]:
+        """
+        Verify base backup archive against its manifest, streaming the archive without extracting it.
+        Files are hashed on several threads, while the archive is decompressed by another process.
+
+        :param archive: base backup archive
+        :param manifest: backup manifest
+        :param threads: number of hashing threads, all CPU cores by default
+        :param progress: called with the total and then with the verified bytes, as Roller.update
+        :returns: number of verified files, number of files with unavailable checksum algorithm and list of errors
+        """
+        errors: typing.List[str] = []
+        try:
+            with open(manifest, "rb") as mfh:
+                raw = mfh.read()
+            content = json.loads(raw.decode("utf-8"))
+        except (OSError, ValueError) as ex:
+            return 0, 0, ["Unable to read manifest {}: {}".format(manifest, ex)]
+
+        # Manifest checksum covers everything before its own line
+        line_start = raw.rfind(b"\n", 0, max(raw.rfind(b'"Manifest-Checksum"'), 0)) + 1
+        if hashlib.sha256(raw[:line_start]).hexdigest() != content.get("Manifest-Checksum"):
+            errors.append("Manifest {} is damaged".format(manifest))
+
+        files = {entry["Path"]: entry for entry in content.get("Files", [])}
+        if progress is not None:
+            progress(total=sum(entry["Size"] for entry in files.values()))
+        unchecked = 0
+        verified = 0
+        pending: typing.List[typing.Tuple[str, str, int, int, typing.Any]] = []
+        inflight = 0
+
+        def collect(pending: typing.List[typing.Tuple[str, str, int, int, typing.Any]]) -> int:
+            nonlocal unchecked
+            path, expected, size, held, job = pending.pop(0)
+            checksum = job.result()
+            if progress is not None:
+                progress(size)
+            if checksum is None:
+                unchecked += 1
+            elif checksum != expected:
+                errors.append("Checksum mismatch: {}".format(path))
+            return held
+
+        proc = subprocess.Popen(PgBackup.get_decompress_command(archive), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            with ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1) as pool, \
+                    tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+                for member in tar:
+                    path = member.name[2:] if member.name.startswith("./") else member.name
+                    entry = files.pop(path, None)
+                    if entry is None or not member.isfile():
+                        continue  # WAL and the manifest itself are not listed
+                    verified += 1
+                    if member.size != entry["Size"]:
+                        errors.append("Size mismatch: {} has {} bytes instead of {}".format(path, member.size, entry["Size"]))
+                        continue
+                    if entry.get("Checksum-Algorithm", "NONE") == "NONE":
+                        continue
+                    # Larger members hold only the queued chunks
+                    held = min(member.size, PgBackup.VERIFY_CHUNK * PgBackup.VERIFY_QUEUE)
+                    while pending and inflight + held > PgBackup.VERIFY_INFLIGHT:
+                        inflight -= collect(pending)
+                    member_fh = typing.cast(typing.IO[bytes], tar.extractfile(member))
+                    if member.size <= PgBackup.VERIFY_CHUNK:
+                        job = pool.submit(PgBackup._get_manifest_checksum, entry["Checksum-Algorithm"], [member_fh.read()])
+                    else:
+                        chunks: "queue.Queue[typing.Optional[bytes]]" = queue.Queue(PgBackup.VERIFY_QUEUE)
+                        job = pool.submit(PgBackup._get_queued_checksum, entry["Checksum-Algorithm"], chunks)
+                        try:
+                            for chunk in iter(lambda: member_fh.read(PgBackup.VERIFY_CHUNK), b""):
+                                chunks.put(chunk)
+                        finally:
+                            chunks.put(None)
+                    pending.append((path, entry["Checksum"], member.size, held, job))
+                    inflight += held
+                while pending:
+                    collect(pending)
+        except (tarfile.TarError, OSError) as ex:
+            errors.append("Unable to read {}: {}".format(archive, ex))
+        finally:
+            proc.stdout.close()  # type: ignore
+            if proc.wait():
+                errors.append("Unable to decompress {}".format(archive))
+
+        for path in files:
+            # Other tablespaces are in separate archives
+            if not path.startswith("pg_tblspc/"):
+                errors.append("Missing file: {}".format(path))
+
+        return verified, unchecked, errors
+
+    @staticmethod
+    def _verify_archived_segment(path: str, sha1: typing.Optional[str], size: typing.Optional[int]) -> typing.Optional[str]:
+        """
+        Verify archived segment in a worker process.
+
+        :returns: error or None
+        """
+        try:
+            verify_segment(path, sha1=sha1, size=size)
+        except ArchiveException as ex:
+            return str(ex)
+
+        return None
+
+    def verify_wal_chain(self, segment_size: int = 0x1000000, workers: int = 0,
+                         progress: typing.Optional[typing.Callable[..., None]] = None) -> typing.Tuple[int, typing.List[str]]:
+        """
+        Verify WAL archive for continuity and re-checksum every segment on a process pool.
+
+        :param segment_size: WAL segment size of the server
+        :param workers: number of processes, all CPU cores by default
+        :param progress: called with the total and then with each verified segment, as Roller.update
+        :returns: number of verified segments and list of errors
+        """
+        catalog = BackupCatalog.open(self.target_path)
+        if catalog is not None:
+            checksums = catalog.get_checksums("wal")
+            catalog.close()
+        else:
+            checksums = {fname: (None, None) for fname in os.listdir(self.target_path)
+                         if re.match(r"^[0-9A-F]{24}$", fname)}
+
+        errors: typing.List[str] = []
+        per_log = 0x100000000 // segment_size
+        positions = sorted({int(name[8:16], 16) * per_log + int(name[16:24], 16): name for name in checksums}.items())
+        for (prev, prev_name), (pos, _) in zip(positions, positions[1:]):
+            if pos != prev + 1:
+                errors.append("Gap in WAL archive: {} segments missing after {}".format(pos - prev - 1, prev_name))
+
+        names = sorted(checksums)
+        if progress is not None:
+            progress(total=len(names))
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            for error in pool.map(PgBackup._verify_archived_segment, [os.path.join(self.target_path, name) for name in names],
+                                  [checksums[name][0] for name in names],
+                                  [checksums[name][1] or segment_size for name in names], chunksize=0x10):
+                if progress is not None:
+                    progress(1)
+                if error is not None:
+                    errors.append(error)
+
+        return len(names), errors
+
+    @staticmethod
+    def _get_retained_backups(backups: typing.List[typing.Dict[str, typing.Any]], keep_backups: typing.Optional[int],
+                              keep_days: typing.Optional[int]) -> typing.List[typing.Dict[str, typing.Any]]:
+        """
+        Get full backups, retained by the policy. The latest backup is always retained.
+
+        :param backups: full backups, oldest first
+        :param keep_backups: number of full backups to keep
+        :param keep_days: keep backups, needed to restore any point in time of the last days
+        :returns: retained backups, oldest first
+        """
+        retained: typing.List[typing.Dict[str, typing.Any]] = []
+        cutoff = time.time() - (keep_days or 0) * 86400
+        covered = False
+        for idx, backup in enumerate(reversed(backups)):
+            keep = not idx or (keep_backups is not None and idx < keep_backups)
+            if keep_days is not None and not covered:
+                # The newest backup before the period is also needed
+                keep = True
+                covered = backup["created"] <= cutoff
+            if keep:
+                retained.insert(0, backup)
+
+        return retained
+
+    def _remove_generation(self, catalog: BackupCatalog, name: str) -> None:
+        """
+        Remove full backup with its manifest and incremental backups.
+        """
+        print("INFO: Removing expired backup \"%s\"" % name)
+        archive = os.path.join(self.target_path, name)
+        for fname in [archive, get_manifest_name(archive)]:
+            if os.path.exists(fname):
+                os.unlink(fname)
+        if os.path.exists(get_incremental_name(archive)):
+            shutil.rmtree(get_incremental_name(archive))
+        catalog.remove_generation(name)
+
+    def _prune(self, catalog: BackupCatalog, obsolete: typing.List[str]) -> None:
+        """
+        Remove obsolete files from the WAL archive in batches,
+        so the archiver is never blocked on the catalog for long.
+        """
+        total = len(obsolete)
+        roller = None
+        if total > PgBackup.PRUNE_BATCH:
+            print("Pruning WAL archive:\t ", end="")
+            sys.stdout.flush()
+            roller = Roller(total=total, unit="files")
+            roller.start()
+        for idx in range(0, total, PgBackup.PRUNE_BATCH):
+            batch = obsolete[idx:idx + PgBackup.PRUNE_BATCH]
+            for fname in batch:
+                try:
+                    os.unlink(os.path.join(self.target_path, fname))
+                except FileNotFoundError:
+                    pass
+            catalog.remove_files(batch)
+            if roller is not None:
+                roller.update(len(batch))
+        if roller is not None:
+            roller.stop("%s files removed" % total)
+
+    def cleanup_backup(self, keep_backups: typing.Optional[int] = None, keep_days: typing.Optional[int] = None,
+                       segment_size: int = 0x1000000) -> None:
         """
         Cleans up the whole backup.
-        This method depends on pg_archivecleanup external utility which removes
-        older WAL files from PostgreSQL archives.
+
+        Without the catalog this method depends on pg_archivecleanup external utility which removes
+        older WAL files from PostgreSQL archives. With the catalog expired full backups are removed
+        and WAL is kept from the start of the oldest retained backup. Without retention policy
+        the latest and the previous full backup are kept and WAL is kept from the latest backup.
+
+        :param keep_backups: number of full backups to keep
+        :param keep_days: keep backups, needed to restore any point in time of the last days
+        :param segment_size: WAL segment size of the server
         """
         checkpoints, _, restart_filename = self._get_latest_restart_filename(self.target_path)
-        for obsolete_bkp_chkpnt in checkpoints:
-            os.unlink(os.path.join(self.target_path, obsolete_bkp_chkpnt))
+        catalog = BackupCatalog.open(self.target_path)
+        if catalog is None:
+            for obsolete_bkp_chkpnt in checkpoints:
+                os.unlink(os.path.join(self.target_path, obsolete_bkp_chkpnt))
+            if restart_filename:
+                os.system("%s %s %s" % (PgBackup.PG_ARCHIVE_CLEANUP, self.target_path, restart_filename))
+            return
 
-        if restart_filename:
-            os.system("%s %s %s" % (PgBackup.PG_ARCHIVE_CLEANUP, self.target_path, restart_filename))
+        try:
+            backups = catalog.get_base_backups(generations=True)
+            if keep_backups is None and keep_days is None:
+                retained = self._get_retained_backups(backups, 2, None)
+                obsolete = checkpoints
+            else:
+                retained = self._get_retained_backups(backups, keep_backups, keep_days)
+                restart_filename = None
+                if retained and retained[0]["start_lsn"] is not None:
+                    restart_filename = self.get_wal_name(retained[0]["timeline"], retained[0]["start_lsn"], segment_size)
+                else:
+                    print("INFO: Start of the oldest retained backup is unknown, WAL archive is not pruned.")
+                obsolete = catalog.get_files("backup", before=restart_filename) if restart_filename else []
+
+            for backup in backups:
+                if backup not in retained:
+                    self._remove_generation(catalog, backup["name"])
+
+            # Same as pg_archivecleanup, but without reading the whole archive directory
+            if restart_filename:
+                obsolete += catalog.get_files("wal", before=restart_filename) + \
+                            catalog.get_files("partial", before=restart_filename)
+            self._prune(catalog, obsolete)
+        finally:
+            catalog.close()
 
 
 class PgTune:
@@ -158,7 +590,7 @@ class PgTune:
         # No more than 1GB
         self.config['maintenance_work_mem'] = self.to_mb(self.bin_rnd(mbt if (mem / 0x10) > mbt else mem / 0x10))
 
-        pg_version = [int(v_el) for v_el in os.popen(r"psql --version | sed -e 's/.*\s//g'").read().split('.')]
+        pg_version = get_binary_version("/usr/bin/psql")
         if pg_version < [9, 6, 0]:
             self.config['checkpoint_segments'] = 8
         else:
@@ -184,12 +616,64 @@ class PgTune:
         return self
 
 
+class PgConfig(dict):
+    """
+    Gate configuration, completed by the loader on the first access
+    to a missing key with the given prefix. The loader is called again,
+    until it adds some keys, e.g. after the database is started.
+    """
+
+    def __init__(self, data: typing.Dict[str, typing.Any], prefix: str, loader: typing.Callable[[], typing.Any]) -> None:
+        dict.__init__(self, data)
+        self._prefix = prefix
+        self._loader: typing.Optional[typing.Callable[[], typing.Any]] = loader
+
+    def _load(self, key: typing.Any) -> None:
+        """
+        Call the loader, if the key is missing and nothing is loaded yet.
+        """
+        if self._loader is not None and isinstance(key, str) and key.startswith(self._prefix) \
+                and not dict.__contains__(self, key):
+            loader, self._loader = self._loader, None
+            loaded = len(self)
+            try:
+                loader()
+            finally:
+                if len(self) == loaded:
+                    self._loader = loader
+
+    def __getitem__(self, key: typing.Any) -> typing.Any:
+        self._load(key)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key: typing.Any) -> bool:
+        self._load(key)
+        return dict.__contains__(self, key)
+
+    def get(self, key: typing.Any, default: typing.Any = None) -> typing.Any:
+        self._load(key)
+        return dict.get(self, key, default)
+
+
 class PgSQLGate(BaseGate):
     """
     Gate for PostgreSQL database tools.
     """
     NAME = "postgresql"
 
+    # Options of the point-in-time recovery and their settings
+    RECOVERY_TARGETS = {
+        'target-time': 'recovery_target_time',
+        'target-lsn': 'recovery_target_lsn',
+        'target-xid': 'recovery_target_xid',
+    }
+
+    # Driver connections are made one at a time
+    _connect_lock = threading.Lock()
+
+    # Error of the psql client, also prefixed with the script location
+    PSQL_ERROR = re.compile(r"(?:ERROR|FATAL):\s+(.*)$")
+
     def __init__(self, config: typing.Dict[str, typing.Any]) -> None:
         self.config_file = '/etc/sysconfig/postgresql'
         if not os.path.exists(self.config_file):
@@ -207,9 +691,10 @@ class PgSQLGate(BaseGate):
             self._pid_file = os.path.join(self.config.get('pcnf_pg_data', ''), 'postgres.pid')
 
         self._with_systemd = os.path.exists('/usr/bin/systemctl')
+        self._connection: typing.Any = None
 
-        if self._get_db_status():
-            self._get_pg_config()
+        # Running configuration is queried only, if some command needs it
+        self.config = PgConfig(self.config, "pcnf_", lambda: self._get_db_status() and self._get_pg_config())
 
     # Utils
     def check(self) -> bool:
@@ -218,11 +703,6 @@ class PgSQLGate(BaseGate):
         """
         msg = None
         minversion = [9, 6]
-        pg_version = os.popen('/usr/bin/postgres --version').read().strip().split(' ')[-1].split('.')
-
-        if int(pg_version[0]) < minversion[0] or (int(pg_version[0]) == minversion[0] and int(pg_version[1]) < minversion[1]):
-            raise GateException("Core component is too old version.")
-
         if not os.path.exists("/usr/bin/psql"):
             msg = 'operations'
         elif not os.path.exists("/usr/bin/postgres"):
@@ -233,6 +713,8 @@ class PgSQLGate(BaseGate):
             msg = 'backup'
         if msg:
             raise GateException("Cannot find required %s component." % msg)
+        if self._get_pg_version()[:2] < minversion:
+            raise GateException("Core component is too old version.")
 
         # Prevent running this tool within the PostgreSQL data directory
         # See bsc#1024058 for details
@@ -285,18 +767,254 @@ class PgSQLGate(BaseGate):
         """
         Get entire PostgreSQL configuration.
         """
-        stdout, stderr = self.syscall("sudo", "-u", "postgres", "/bin/bash",
-                                      input=self.get_scenario_template(target='psql').replace('@scenario', 'show all'))
-        if stdout:
-            for line in stdout.strip().split("\n")[2:]:
-                try:
-                    key, val = map(lambda line: line.strip(), line.split('|')[:2])
-                    self.config['pcnf_' + key] = val
-                except Exception:
-                    print("Cannot parse line:", line)
-        else:
-            eprint(stderr)
+        pg_config = {}
+        try:
+            for key, val in self.query("SELECT name, current_setting(name) FROM pg_settings", types=(str, str)):
+                pg_config['pcnf_' + key] = val
+        except GateException as ex:
+            eprint(ex)
+
+        if not pg_config:
             raise Exception("Underlying error: unable get backend configuration.")
+        self.config.update(pg_config)
+
+    def _connect(self, database: str) -> typing.Any:
+        """
+        Connect to the database with the driver as "postgres" user.
+        Peer authentication takes effective UID, so root impersonates "postgres" while connecting.
+        Effective UID belongs to the whole process, so connect before starting threads.
+
+        :param database: database name
+        :returns: connection
+        """
+        with PgSQLGate._connect_lock:
+            euid, egid = os.geteuid(), os.getegid()
+            if euid == 0:
+                pg_user = pwd.getpwnam('postgres')
+                os.setegid(pg_user.pw_gid)
+                os.seteuid(pg_user.pw_uid)
+            try:
+                return psycopg2.connect(dbname=database, user='postgres')
+            finally:
+                if euid == 0:
+                    os.seteuid(euid)
+                    os.setegid(egid)
+
+    def _get_connection(self) -> typing.Any:
+        """
+        Get driver connection to the database as "postgres" user.
+
+        :returns: connection or None, if the driver is not available.
+        """
+        if self._connection is None and psycopg2 is not None:
+            try:
+                self._connection = self._connect(self.config.get('db_name') or 'postgres')
+            except Exception as ex:
+                if self.debug:
+                    eprint("Database driver is not available:", ex)
+                self._connection = False  # Do not try again, use psql
+
+        return self._connection or None
+
+    @staticmethod
+    def _quote(value: typing.Any) -> str:
+        """
+        Quote value as SQL literal for the psql calls.
+        Escape string syntax is used, because standard_conforming_strings is off.
+        """
+        if value is None:
+            out = "NULL"
+        elif isinstance(value, bool):
+            out = value and "TRUE" or "FALSE"
+        elif isinstance(value, (int, float)):
+            out = repr(value)
+        else:
+            out = "E'{}'".format(str(value).replace("\\", "\\\\").replace("'", "''"))
+
+        return out
+
+    @staticmethod
+    def _decode_copy_line(line: str) -> typing.List[typing.Optional[str]]:
+        """
+        Decode a row of the COPY text format.
+        """
+        escapes = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '\\': '\\'}
+        row: typing.List[typing.Optional[str]] = []
+        for field in line.split("\t"):
+            if field == "\\N":
+                row.append(None)
+                continue
+            out = []
+            idx = 0
+            while idx < len(field):
+                if field[idx] == "\\" and idx + 1 < len(field):
+                    idx += 1
+                    out.append(escapes.get(field[idx], field[idx]))
+                else:
+                    out.append(field[idx])
+                idx += 1
+            row.append(''.join(out))
+
+        return row
+
+    def query(self, sql: str, params: typing.Optional[typing.Sequence[typing.Any]] = None,
+              types: typing.Optional[typing.Sequence[typing.Callable[[typing.Any], typing.Any]]] = None
+              ) -> typing.Iterator[typing.Tuple[typing.Any, ...]]:
+        """
+        Run SELECT query and iterate over its rows.
+
+        Database driver (psycopg2) is used with server-side cursor, if available.
+        Otherwise rows are fetched via psql as COPY text format.
+
+        :param sql: query, "%s" are placeholders for the parameters.
+        :param params: query parameters
+        :param types: converters for the columns. None values are left as is.
+        :returns: iterator of rows
+        """
+        sql = sql.strip().rstrip(';')
+        connection = self._get_connection()
+        if connection is not None:
+            yield from self._fetch(connection, sql, params, types)
+        else:
+            if params:
+                sql = sql % tuple(self._quote(param) for param in params)
+            # COPY data is framed, diagnostics are suppressed and the first error stops the client
+            tag = "smdba-copy-" + uuid.uuid4().hex
+            try:
+                stdout, _ = self.call_script("\n".join([
+                    "\\set ON_ERROR_STOP on", "\\set SMDBA_QUIET :QUIET", "\\set QUIET on",
+                    "SET client_min_messages TO error;", "\\echo " + tag,
+                    "COPY ({}) TO STDOUT;".format(sql),
+                    "\\echo " + tag, "RESET client_min_messages;", "\\set QUIET :SMDBA_QUIET", "\\set ON_ERROR_STOP off"]),
+                    target='psql')
+            except GateException as ex:
+                stdout = str(ex)
+            lines = stdout.split("\n")
+            if lines.count(tag) != 2:
+                errors = [match.group(1) for match in map(self.PSQL_ERROR.search, lines) if match]
+                raise GateException("Query failed: {}".format(errors[0] if errors else stdout.strip()))
+            start = lines.index(tag) + 1
+            for line in filter(None, lines[start:lines.index(tag, start)]):
+                yield self._convert_row(self._decode_copy_line(line), types)
+
+    def _fetch(self, connection: typing.Any, sql: str, params: typing.Optional[typing.Sequence[typing.Any]] = None,
+               types: typing.Optional[typing.Sequence[typing.Callable[[typing.Any], typing.Any]]] = None
+               ) -> typing.Iterator[typing.Tuple[typing.Any, ...]]:
+        """
+        Run SELECT query over the driver connection with server-side cursor and iterate over its rows.
+        """
+        try:
+            cursor = connection.cursor(name="smdba_" + uuid.uuid4().hex)
+            cursor.itersize = 0x800
+            cursor.execute(sql, params)
+        except psycopg2.Error as ex:
+            connection.rollback()
+            raise GateException("Query failed: {}".format(str(ex).strip()))
+        try:
+            for row in cursor:
+                yield self._convert_row(row, types)
+        finally:
+            cursor.close()
+            connection.rollback()  # Nothing to commit, only close the transaction
+
+    def _connect_database(self, database: str) -> typing.Any:
+        """
+        Connect to the database, so its queries can run in parallel.
+        Without the driver, only the default database is available over the shared session.
+
+        :param database: database name
+        :raises GateException: if the database is not available.
+        :returns: connection or None for the shared session.
+        """
+        if self._get_connection() is None:
+            if database != (self.config.get('db_name') or 'postgres'):
+                raise GateException("Database driver is required to query database \"{}\".".format(database))
+            return None
+
+        try:
+            return self._connect(database)
+        except psycopg2.Error as ex:
+            raise GateException("Cannot connect to database \"{}\": {}".format(database, str(ex).strip()))
+
+    def _query_database(self, connection: typing.Any, sql: str, params: typing.Optional[typing.Sequence[typing.Any]] = None,
+                        types: typing.Optional[typing.Sequence[typing.Callable[[typing.Any], typing.Any]]] = None
+                        ) -> typing.List[typing.Tuple[typing.Any, ...]]:
+        """
+        Run SELECT query over the connection of the database.
+
+        :param connection: connection from _connect_database
+        """
+        if connection is None:
+            return list(self.query(sql, params, types))
+
+        return list(self._fetch(connection, sql.strip().rstrip(';'), params, types))
+
+    def _iter_table_sizes(self, database: str, scenario: str, schemas: typing.List[str], min_size: int,
+                          top: int, jobs: int) -> typing.Iterator[typing.Tuple[str, str, int, str]]:
+        """
+        Query table sizes of the database on parallel connections.
+        Each schema is split further by relations, if there are less schemas than connections.
+
+        :returns: table, pretty size, size and database, as each query completes.
+        """
+        connections: "queue.Queue[typing.Any]" = queue.Queue()
+        opened = [self._connect_database(database)]
+        connections.put(opened[0])
+
+        def run(sql: str, types: typing.Sequence[typing.Callable[[typing.Any], typing.Any]]
+                ) -> typing.List[typing.Tuple[typing.Any, ...]]:
+            connection = connections.get()
+            try:
+                return self._query_database(connection, sql, types=types)
+            finally:
+                connections.put(connection)
+
+        try:
+            namespaces = [ns_oid for ns_oid, ns_name in run(
+                "SELECT oid, nspname FROM pg_namespace WHERE nspname NOT IN ('pg_catalog', 'information_schema') "
+                "AND nspname !~ '^pg_toast'", (int, str)) if not schemas or ns_name in schemas]
+            parts = -(-jobs // len(namespaces)) if namespaces else 1
+            queries = [self._render_scenario(scenario, namespace=ns_oid, min_size=min_size, top=top, parts=parts, part=part)
+                       for ns_oid in namespaces for part in range(parts)]
+
+            # Threads only share the connections, opened here
+            if opened[0] is not None:
+                for _ in range(min(jobs, len(queries)) - 1):
+                    opened.append(self._connect_database(database))
+                    connections.put(opened[-1])
+
+            with ThreadPoolExecutor(max_workers=len(opened)) as pool:
+                for future in as_completed([pool.submit(run, sql, (str, str, int)) for sql in queries]):
+                    for name, size_pretty, t_size in future.result():
+                        yield name, size_pretty, t_size, database
+        finally:
+            for connection in opened:
+                if connection is not None:
+                    connection.close()
+
+    @staticmethod
+    def _convert_row(row: typing.Sequence[typing.Any],
+                     types: typing.Optional[typing.Sequence[typing.Callable[[typing.Any], typing.Any]]]
+                     ) -> typing.Tuple[typing.Any, ...]:
+        """
+        Convert row values to the given types.
+        """
+        if not types:
+            return tuple(row)
+
+        return tuple(value if value is None or idx >= len(types) else types[idx](value) for idx, value in enumerate(row))
+
+    def close_sessions(self, reopen: bool = True) -> None:
+        """
+        Terminate all running clients and the driver connection.
+        """
+        if self._connection:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+        self._connection = None
+        BaseGate.close_sessions(self, reopen=reopen)
 
     def _cleanup_pids(self) -> None:
         """
@@ -370,11 +1088,11 @@ class PgSQLGate(BaseGate):
 
         if self._get_db_status():
             print("failed")
-            time.sleep(1)
             return
 
         # Cleanup first
         self._cleanup_pids()
+        self.close_sessions()
 
         # Start the db
         cwd = os.getcwd()
@@ -387,7 +1105,13 @@ class PgSQLGate(BaseGate):
                                % (self.config['pcnf_pg_data'], self.config.get('sysconfig_POSTGRES_OPTIONS', '""')))
         print(result and "failed" or "done")
         os.chdir(cwd)
-        time.sleep(1)
+
+        # Resume archiving daemon and WAL streaming
+        backup_dst, backup_on = self.do_backup_status('--silent')
+        if not result and backup_on:
+            self._start_archiver(backup_dst)
+            if '--stream' in self._get_conf(self.config['pcnf_pg_data'] + "/postgresql.conf").get('archive_command', ''):
+                self._start_wal_receiver(backup_dst)
 
     def do_db_stop(self, **args: str) -> None:  # pylint: disable=W0613
         """
@@ -398,12 +1122,12 @@ class PgSQLGate(BaseGate):
 
         if not self._get_db_status():
             print("failed")
-            time.sleep(1)
             return
 
         # Stop the db
         if not self.config.get('pcnf_data_directory'):
             raise GateException("Cannot find data directory.")
+        self.close_sessions()
         cwd = os.getcwd()
         os.chdir(self.config.get('pcnf_data_directory', '/var/lib/pgsql'))
         if self._with_systemd:
@@ -422,48 +1146,85 @@ class PgSQLGate(BaseGate):
         """
         Show database status
         """
-        print('Database is', self._get_db_status() and 'online' or 'offline')
+        self.output.report("db-status", ["online"], [(self._get_db_status(),)],
+                           text=lambda records: print('Database is', next(iter(records))[0] and 'online' or 'offline'))
 
-    def do_space_tables(self, **args: str) -> None:  # pylint: disable=W0613
+    @staticmethod
+    def _parse_size(value: str) -> int:
         """
-        Show space report for each table
+        Parse size in bytes or with K, M, G, T suffix.
+
+        :raises GateException: if size is not recognised.
         """
-        stdout, stderr = self.call_scenario('pg-tablesizes', target='psql')
+        match = re.match(r"^(\d+)\s*([KMGT]?)B?$", str(value).strip(), re.IGNORECASE)
+        if not match:
+            raise GateException("Size \"{}\" is not recognised.".format(value))
 
-        if stderr:
-            eprint(stderr)
-            raise GateException("Unhandled underlying error occurred, see above.")
+        return int(match.group(1)) << (10 * " KMGT".index(match.group(2).upper() or " "))
 
-        if stdout:
-            t_index = []
-            t_ref = {}
+    def do_space_tables(self, **args: str) -> None:  # pylint: disable=W0613
+        """
+        Show space report for each table
+        @help
+        --top=<num>\tShow only the largest tables, largest first. Otherwise tables are shown as they are measured.
+        --schema=<name>[,<name>...]\tShow only tables of the schemas.
+        --min-size=<size>\tShow only tables of at least the size in bytes or with K, M, G suffix.
+        --database=<name>[,<name>...]\tReport the databases or "all" instead of the default one.
+        --jobs=<num>\tNumber of parallel connections (default: 4).
+        --estimate\tFast approximate sizes from the planner statistics.
+        """
+        top = args.get('top')
+        if top is not None and (not str(top).isdigit() or not int(top)):
+            raise GateException("Number of the largest tables must be a positive number.")
+        if not str(args.get('jobs', '4')).isdigit() or not int(args.get('jobs', '4')):
+            raise GateException("Number of parallel connections must be a positive number.")
+        for key in ['schema', 'database', 'min-size']:
+            if args.get(key) is True:
+                raise GateException("Option --{} requires a value.".format(key))
+        min_size = self._parse_size(args.get('min-size', '0'))
+        schemas = [name for name in str(args.get('schema', '')).split(',') if name]
+        scenario = 'pg-tablesizes-estimate' if args.get('estimate') else 'pg-tablesizes'
+
+        # Without the driver, queries share one psql session
+        jobs = int(args.get('jobs', '4')) if self._get_connection() is not None else 1
+        if args.get('database') == 'all':
+            databases = [d_name for d_name, in self.query("SELECT datname FROM pg_database WHERE datallowconn "
+                                                          "AND NOT datistemplate ORDER BY datname", types=(str,))]
+        else:
+            databases = [name for name in str(args.get('database') or self.config.get('db_name') or 'postgres').split(',')
+                         if name]
+
+        # Largest first, only the largest are kept, otherwise rows are streamed unsorted
+        rows: typing.Iterable[typing.Tuple[str, str, int, str]] = itertools.chain.from_iterable(
+            self._iter_table_sizes(d_name, scenario, schemas, min_size, int(top or 0), jobs) for d_name in databases)
+        if top:
+            rows = heapq.nlargest(int(top), rows, key=lambda row: row[2])
+
+        def text(records: typing.Iterable[typing.Sequence[typing.Any]]) -> None:
+            records = iter(records)
+            first = next(records, None)
+            if first is None:
+                return
+            multiple = len(databases) > 1
             t_total = 0
-            longest = 0
-            for line in stdout.strip().split("\n")[2:]:
-                line = list(filter(None, map(lambda el: el.strip(), line.split('|'))))  # type: ignore
-                if len(line) == 3:
-                    t_name, t_size_pretty, t_size = line[0], line[1], int(line[2])
-                    t_ref[t_name] = t_size_pretty
+
+            def tables() -> typing.Iterator[typing.Tuple[str, ...]]:
+                nonlocal t_total
+                for name, size, t_size, d_name in itertools.chain([first], records):
                     t_total += t_size
-                    t_index.append(t_name)
+                    yield ((d_name,) if multiple else ()) + (name, size)
 
-                    longest = len(t_name) if len(t_name) > longest else longest
+            def footer() -> typing.Iterator[typing.Tuple[str, ...]]:
+                # Total is known, once all tables are written
+                for line in [('', '',), ('Total', ('%.2f' % round(t_total / 1024. / 1024)) + 'M',)]:
+                    yield (('',) if multiple else ()) + line
 
-            t_index.sort()
+            header: typing.Tuple[str, ...] = (('Database',) if multiple else ()) + ('Table', 'Size',)
+            print()
+            TablePrint(itertools.chain([header], tables(), footer()), sample=0x1000).write(sys.stdout)
+            print()
 
-            table = [('Table', 'Size',)]
-            for name in t_index:
-                table.append((name, t_ref[name],))
-            table.append(('', '',))
-            table.append(('Total', ('%.2f' % round(t_total / 1024. / 1024)) + 'M',))
-            print('\n{0}'.format(TablePrint(table)))
-
-    @staticmethod
-    def _get_partition(fdir: str) -> str:
-        """
-        Get partition of the directory.
-        """
-        return os.popen("df -lP %s | tail -1 | cut -d' ' -f 1" % fdir).read().strip()
+        self.output.report("space-tables", ["table", "size_pretty", "size", "database"], rows, text=text)
 
     def do_space_overview(self, **args: str) -> None:  # pylint: disable=W0613
         """
@@ -476,7 +1237,8 @@ class PgSQLGate(BaseGate):
             raise GateException("Database must be running.")
 
         # Get current partition
-        partition = self._get_partition(self.config['pcnf_data_directory'])
+        mount = get_mount(self.config['pcnf_data_directory'])
+        usage = get_usage(self.config['pcnf_data_directory'])
 
         # Build info
         class Info:
@@ -492,41 +1254,29 @@ class PgSQLGate(BaseGate):
             mountpoint: typing.Optional[str] = None
 
         info = Info()
-        for data_line in os.popen("df -T").readlines()[1:]:
-            data_line = data_line.strip()
-            if not data_line.startswith(partition):
-                continue
-            line = list(filter(None, data_line.split(" ")))
-            info.fs_dev = line[0]
-            info.fs_type = line[1]
-            info.size = int(line[2]) * 1024  # Bytes
-            info.used = int(line[3]) * 1024  # Bytes
-            info.available = int(line[4]) * 1024  # Bytes
-            info.used_prc = line[5]
-            info.mountpoint = line[6]
-
-            break
+        if mount is not None:
+            info.fs_dev = mount.source
+            info.fs_type = mount.fstype
+            info.mountpoint = mount.mountpoint
+        info.size = usage['total']
+        info.used = usage['used']
+        info.available = usage['free']
+        info.used_prc = "{}%".format(get_used_percent(usage))
 
         # Get database sizes
-        stdout, stderr = self.syscall("sudo", "-u", "postgres", "/bin/bash",
-                                      input=self.get_scenario_template(target='psql').replace(
-                                          '@scenario', 'select pg_database_size(datname), datname from pg_database;'))
-        self.to_stderr(stderr)
-        overview = [('Database', 'DB Size (Mb)', 'Avail (Mb)', 'Partition Disk Size (Mb)', 'Use %',)]
-        for data_line in stdout.split("\n"):
-            if "|" not in data_line or "pg_database_size" in data_line:  # Different versions of postgresql
-                continue
-            line = list(filter(None, data_line.strip().replace('|', '').split(" ")))
-            if len(line) != 2:
-                continue
-            d_size = int(line[0])
-            d_name = line[1]
-            overview.append((d_name, self._bt_to_mb(d_size),
-                             self._bt_to_mb(info.available),
-                             self._bt_to_mb(info.size),
-                             '%.3f' % round((float(d_size) / float(info.size) * 100), 3)))
+        def text(records: typing.Iterable[typing.Sequence[typing.Any]]) -> None:
+            overview = [('Database', 'DB Size (Mb)', 'Avail (Mb)', 'Partition Disk Size (Mb)', 'Use %',)]
+            for d_name, d_size, available, size, _ in records:
+                overview.append((d_name, self._bt_to_mb(d_size),
+                                 self._bt_to_mb(available),
+                                 self._bt_to_mb(size),
+                                 '%.3f' % round((float(d_size) / float(size) * 100), 3)))
+
+            print('\n{0}\n'.format(TablePrint(overview)))
 
-        print('\n{0}\n'.format(TablePrint(overview)))
+        self.output.report("space-overview", ["database", "size", "available", "partition_size", "mountpoint"],
+                           ((d_name, d_size, info.available, info.size, info.mountpoint) for d_size, d_name in self.query(
+                               "SELECT pg_database_size(datname), datname FROM pg_database", types=(int, str))), text=text)
 
     def do_space_reclaim(self, **args: str) -> None:  # pylint: disable=W0613
         """
@@ -536,11 +1286,9 @@ class PgSQLGate(BaseGate):
         sys.stdout.flush()
 
         if not self._get_db_status():
-            time.sleep(1)
             raise GateException("Database must be online.")
 
         eprint("finished")
-        time.sleep(1)
 
         operations = [
             ('Analyzing database', 'vacuum analyze;'),
@@ -551,8 +1299,7 @@ class PgSQLGate(BaseGate):
             print("%s...\t" % msg, end="")
             sys.stdout.flush()
 
-            _, stderr = self.syscall("sudo", "-u", "postgres", "/bin/bash",
-                                     input=self.get_scenario_template(target='psql').replace('@scenario', operation))
+            _, stderr = self.call_script(operation, target='psql')
             if stderr:
                 eprint("failed")
                 sys.stdout.flush()
@@ -563,11 +1310,16 @@ class PgSQLGate(BaseGate):
             sys.stdout.flush()
 
     @staticmethod
-    def _get_tablespace_size(path: str) -> int:
+    def _get_tablespace_size(path: str, cached: bool = False) -> int:
         """
         Get tablespace size in bytes.
+
+        :param path: directory of the tablespace
+        :param cached: use the size index for the directories with write-once files
         """
-        return int(os.popen('/usr/bin/du -bc %s' % path).readlines()[-1].strip().replace('\t', ' ').split(' ')[0])
+        # Catalog, streamed segments and the archiver log grow in place in the backup directory
+        return get_tree_size(path, threads=min(32, (os.cpu_count() or 1) * 4), cached=cached,
+                             volatile=[BackupCatalog.FILENAME + "*", "*.partial", "*.log"])
 
     def _rst_get_backup_root(self, path: str) -> typing.Optional[str]:
         """
@@ -588,26 +1340,156 @@ class PgSQLGate(BaseGate):
 
         return found
 
-    def _rst_save_current_cluster(self) -> None:
+    @staticmethod
+    def _rst_is_rotational(path: str) -> bool:
+        """
+        Check if the path is located on a rotational disk.
+        Unknown devices are considered rotational.
+        """
+        dev = os.stat(path).st_dev
+        sysfs = "/sys/dev/block/{0}:{1}".format(os.major(dev), os.minor(dev))
+        for queue in [os.path.join(sysfs, "queue/rotational"), os.path.join(sysfs, "../queue/rotational")]:
+            if os.path.exists(queue):
+                with open(queue) as flag:
+                    return flag.read().strip() != "0"
+        return True
+
+    def _rst_overlap_save(self, mode: str, old_data_dir: str) -> bool:
         """
-        Save current tablespace
+        Decide if saving the broken cluster can run along with the unarchiving of the backup.
+
+        :param mode: auto, parallel or serial
+        :param old_data_dir: directory where broken cluster is saved
+        :returns: True if both can run at the same time
         """
-        old_data_dir = os.path.dirname(self.config['pcnf_pg_data']) + '/data.old'
+        if mode not in ["auto", "parallel", "serial"]:
+            raise GateException("Unknown save mode \"{}\". See help for more information.".format(mode))
+        if mode != "auto":
+            return mode == "parallel"
+
+        data_dir = os.path.dirname(self.config['pcnf_pg_data'].rstrip('/'))
+        return (os.stat(old_data_dir).st_dev != os.stat(data_dir).st_dev
+                or not self._rst_is_rotational(data_dir))
+
+    @staticmethod
+    def _rst_get_tar_command(archive: str, path: str, name: str) -> str:
+        """
+        Get command to archive the cluster, compressing with threads where possible.
+
+        :param archive: destination archive
+        :param path: directory to archive
+        :param name: path of the directory, stored in the archive
+        """
+        compress = "-I {}".format(PgBackup.PIGZ) if os.path.exists(PgBackup.PIGZ) else "-z"
+        transform = "--transform 's,^{0},{1},'".format(path, name) if path != name else ""
+
+        return ' '.join(filter(None, ['/bin/tar', compress, '-cPf', archive, transform, path]))
+
+    def _rst_save_current_cluster(self, mode: str = "serial") -> typing.Optional[typing.Callable[[], None]]:
+        """
+        Save current tablespace.
+
+        In parallel mode the broken cluster is moved aside and archived in the background,
+        so the backup can be unarchived at the same time.
+
+        :param mode: auto, parallel or serial
+        :returns: function waiting for the background archiving or None
+        """
+        pg_data = self.config['pcnf_pg_data'].rstrip('/')
+        old_data_dir = os.path.dirname(pg_data) + '/data.old'
         if not os.path.exists(old_data_dir):
             os.mkdir(old_data_dir)
             print("Created \"%s\" directory." % old_data_dir)
 
+        suffix = '-'.join([str(el).zfill(2) for el in iter(time.localtime())][:6])
+        destination_tar = old_data_dir + "/data." + suffix + ".tar.gz"
+
+        if self._rst_overlap_save(mode, old_data_dir):
+            broken_dir = pg_data + ".broken-" + suffix
+            try:
+                os.rename(pg_data, broken_dir)
+            except OSError:
+                broken_dir = None  # Data directory is a mount point and cannot be moved aside
+
+            if broken_dir is not None:
+                print("Moving broken cluster:\t in background")
+                sys.stdout.flush()
+                started = time.time()
+                saver = subprocess.Popen(self._rst_get_tar_command(destination_tar, broken_dir, pg_data) + ' 2>/dev/null',
+                                         shell=True)
+
+                def wait() -> None:
+                    print("Moving broken cluster:\t ", end="")
+                    sys.stdout.flush()
+                    saver.wait()
+                    shutil.rmtree(broken_dir)
+                    print("finished ({})".format(self._rst_get_throughput(destination_tar, started)))
+                    sys.stdout.flush()
+                return wait
+
         print("Moving broken cluster:\t ", end="")
         sys.stdout.flush()
-        roller = Roller()
+        roller = Roller(probe=lambda: os.path.getsize(destination_tar))
         roller.start()
-        suffix = '-'.join([str(el).zfill(2) for el in iter(time.localtime())][:6])
-        destination_tar = old_data_dir + "/data." + suffix + ".tar.gz"
-        tar_command = '/bin/tar -czPf %s %s 2>/dev/null' % (destination_tar, self.config['pcnf_pg_data'])
-        os.system(tar_command)
-        roller.stop("finished")
-        time.sleep(1)
+        started = time.time()
+        os.system(self._rst_get_tar_command(destination_tar, pg_data, pg_data) + ' 2>/dev/null')
+        roller.stop("finished ({})".format(self._rst_get_throughput(destination_tar, started)))
+
+        return None
+
+    def _rst_unarchive(self, archive: str, target: str) -> None:
+        """
+        Unarchive backup directly into the target directory.
+
+        :param archive: base backup archive
+        :param target: directory, which should not exist yet
+        """
+        print("Unarchiving backup:\t ", end="")
         sys.stdout.flush()
+        roller = Roller(total=os.path.getsize(archive))
+        roller.start()
+
+        os.mkdir(target, 0o700)
+        pguid = pwd.getpwnam('postgres')[2]
+        pggid = grp.getgrnam('postgres')[2]
+        os.chown(target, pguid, pggid)
+        started = time.time()
+
+        # Archive is fed to tar here, so the progress is known exactly
+        untar = subprocess.Popen(PgBackup.get_untar_command(archive, target, from_stdin=True) + ' 2>/dev/null',
+                                 shell=True, stdin=subprocess.PIPE)
+        try:
+            with open(archive, "rb") as src:
+                for chunk in iter(lambda: src.read(0x100000), b""):
+                    untar.stdin.write(chunk)  # type: ignore
+                    roller.update(len(chunk))
+        except BrokenPipeError:
+            pass
+        finally:
+            untar.stdin.close()  # type: ignore
+        if untar.wait():
+            roller.stop("failed")
+            raise GateException("Unable to unarchive \"{}\".".format(archive))
+
+        roller.stop("finished ({})".format(self._rst_get_throughput(archive, started)))
+
+        backup_root = self._rst_get_backup_root(target)
+        if backup_root is not None and backup_root != target:
+            # Backup is nested in the archive: pull its root in place
+            temp_dir = tempfile.mkdtemp(dir=os.path.dirname(target))
+            os.rename(target, os.path.join(temp_dir, "data"))
+            os.rename(os.path.join(temp_dir, "data", os.path.relpath(backup_root, target)), target)
+            shutil.rmtree(temp_dir)
+
+    def _rst_get_throughput(self, archive: str, started: float) -> str:
+        """
+        Get size of the archive and throughput of processing it since the start time.
+        """
+        size = os.path.getsize(archive) if os.path.exists(archive) else 0
+        elapsed = max(time.time() - started, 0.001)
+
+        return "{0} in {1:.1f}s, {2}/s".format(self.size_pretty(size, no_whitespace=True), elapsed,
+                                               self.size_pretty(size / elapsed, no_whitespace=True))
 
     def _rst_shutdown_db(self) -> None:
         """
@@ -620,57 +1502,71 @@ class PgSQLGate(BaseGate):
                 eprint("Error: Unable to stop database.")
                 sys.exit(1)
 
-    def _rst_replace_new_backup(self, backup_dst: str) -> None:
+    def _rst_replace_new_backup(self, backup_dst: str, targets: typing.Optional[typing.Dict[str, str]] = None,
+                                staging: typing.Optional[str] = None, prefetch: int = 0) -> None:
         """
         Replace new backup.
+
+        :param targets: recovery target settings
+        :param staging: directory with prefetched WAL segments
+        :param prefetch: number of WAL segments to prefetch during the recovery
         """
-        destination_tar = backup_dst + "/base.tar.gz"
-        if not os.path.exists(destination_tar):
+        targets = targets or {}
+        destination_tar = PgBackup.get_base_archive(backup_dst)
+        if destination_tar is None:
             print("ERROR: There is no backup to be restored")
-            print("File %s not found." % destination_tar)
+            print("File %s not found." % (backup_dst + "/base.tar.*"))
             return
         # Archive into a tgz backup and place it near the cluster
         print("Restoring from backup:\t ", end="")
         sys.stdout.flush()
 
-        # Remove cluster in general
-        print("Remove broken cluster:\t ", end="")
-        sys.stdout.flush()
-        shutil.rmtree(self.config['pcnf_pg_data'])
-        print("finished")
-        sys.stdout.flush()
-
-        # Unarchive cluster
-        print("Unarchiving new backup:\t ", end="")
-        sys.stdout.flush()
-        roller = Roller()
-        roller.start()
-
-        temp_dir = tempfile.mkdtemp(dir=os.path.join(backup_dst, "tmp"))
-        pguid = pwd.getpwnam('postgres')[2]
-        pggid = grp.getgrnam('postgres')[2]
-        os.chown(temp_dir, pguid, pggid)
-        tar_command = '/bin/tar xf %s --directory=%s 2>/dev/null' % (destination_tar, temp_dir)
-        os.system(tar_command)
-
-        roller.stop("finished")
-        time.sleep(1)
-
-        print("Restore cluster:\t ", end="")
-        backup_root = self._rst_get_backup_root(temp_dir)
-        mv_command = '/bin/mv %s %s' % (backup_root, os.path.dirname(self.config['pcnf_pg_data']) + "/data")
-        os.system(mv_command)
-
-        print("finished")
-        sys.stdout.flush()
+        # Remove cluster in general, unless it was moved aside
+        pg_data = self.config['pcnf_pg_data'].rstrip('/')
+        if os.path.exists(pg_data):
+            print("Remove broken cluster:\t ", end="")
+            sys.stdout.flush()
+            shutil.rmtree(pg_data)
+            print("finished")
+            sys.stdout.flush()
 
-        pg_version = os.popen('/usr/bin/postgres --version').read().strip().split(' ')[-1].split('.')
+        chain = PgBackup.get_incremental_chain(backup_dst)
+        if not chain:
+            # Unarchive cluster directly into the data directory
+            self._rst_unarchive(destination_tar, pg_data)
+        else:
+            # Unarchive the whole chain and combine it into the data directory
+            pg_uid, pg_gid = pwd.getpwnam('postgres')[2], grp.getgrnam('postgres')[2]
+            temp_root = os.path.join(backup_dst, "tmp")
+            os.makedirs(temp_root, mode=0o700, exist_ok=True)
+            os.chown(temp_root, pg_uid, pg_gid)
+            temp_dir = tempfile.mkdtemp(dir=temp_root)
+            try:
+                os.chown(temp_dir, pg_uid, pg_gid)
+                backups = []
+                for idx, archive in enumerate([destination_tar] + [str(PgBackup.get_base_archive(incr)) for incr in chain]):
+                    backups.append(os.path.join(temp_dir, str(idx)))
+                    self._rst_unarchive(archive, backups[-1])
 
-        if int(pg_version[0]) < 12:
+                print("Combining %s incremental backups:\t " % len(chain), end="")
+                sys.stdout.flush()
+                roller = Roller()
+                roller.start()
+                ret = os.system('sudo -u postgres %s -o %s %s' % (PgBackup.PG_COMBINEBACKUP, pg_data, ' '.join(backups)))
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            if ret:
+                roller.stop("failed")
+                raise GateException("Unable to combine incremental backups.")
+            roller.stop("finished")
+
+        if self._get_pg_version() < [12]:
             print("Write recovery.conf:\t ", end="")
             recovery_conf = os.path.join(self.config['pcnf_pg_data'], "recovery.conf")
             cfg = open(recovery_conf, 'w')
-            cfg.write("restore_command = 'cp " + backup_dst + "/%f %p'\n")
+            cfg.write("restore_command = " + self._get_restore_command(backup_dst, staging, prefetch) + "\n")
+            for key, value in targets.items():
+                cfg.write("{0} = {1}\n".format(key, value))
             cfg.close()
 
             # Set recovery.conf correct ownership (SMDBA is running as root at this moment)
@@ -680,7 +1576,10 @@ class PgSQLGate(BaseGate):
             print("Write recovery options to postgresql.conf:\t ", end="")
             pg_conf = os.path.join(self.config['pcnf_pg_data'], "postgresql.conf")
             conf = self._get_conf(pg_conf)
-            conf['restore_command'] = "'cp {0} /%f %p'".format(backup_dst)
+            conf['restore_command'] = self._get_restore_command(backup_dst, staging, prefetch)
+            for key in [key for key in conf if key.startswith('recovery_target')]:
+                del conf[key]
+            conf.update(targets)
             self._write_conf(pg_conf, **conf)
             print("finished")
 
@@ -697,9 +1596,165 @@ class PgSQLGate(BaseGate):
         print("finished")
         sys.stdout.flush()
 
+    @staticmethod
+    def _get_restore_command(backup_dst: str, staging: typing.Optional[str] = None, prefetch: int = 0) -> str:
+        """
+        Get restore_command, which also decompresses archived segments.
+
+        :param staging: directory with prefetched segments, which are restored first
+        :param prefetch: number of segments to prefetch in the background after each requested one
+        """
+        opts = ""
+        if staging:
+            opts = "--staging \"" + staging + "\" " + (prefetch and "--prefetch " + str(prefetch) + " " or "")
+
+        return "'/usr/bin/smdba-pgarchive --restore " + opts + "--source \"" + backup_dst + "/%f\" --destination \"%p\"'"
+
+    def _get_recovery_targets(self, **args: str) -> typing.Dict[str, str]:
+        """
+        Get recovery target settings from the restore options.
+
+        :raises GateException: if more than one target is given or the target is invalid.
+        """
+        targets = [opt for opt in self.RECOVERY_TARGETS if opt in args]
+        if not targets:
+            return {}
+        if len(targets) > 1:
+            raise GateException("Only one of --{} can be specified.".format(", --".join(self.RECOVERY_TARGETS)))
+
+        target = targets[0]
+        value = args[target]
+        if target == 'target-lsn' and not re.match(r"^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$", value):
+            raise GateException("Invalid LSN \"{}\", it should look like 0/1A2B3C4D.".format(value))
+        if target == 'target-xid' and not value.isdigit():
+            raise GateException("Invalid transaction ID \"{}\".".format(value))
+        if target == 'target-time' and not value.strip():
+            raise GateException("Recovery target time is empty.")
+
+        # Database should be open after reaching the target, not paused
+        return {
+            self.RECOVERY_TARGETS[target]: "'{}'".format(value.replace("'", "''")),
+            'recovery_target_action': "'promote'",
+        }
+
+    def _rst_get_last_segment(self, catalog: BackupCatalog, targets: typing.Dict[str, str],
+                              segment_size: int) -> typing.Optional[str]:
+        """
+        Get the last WAL segment, needed to reach the recovery target.
+
+        :returns: segment name or None, if the target does not bound the WAL.
+        """
+        if 'recovery_target_lsn' in targets:
+            return PgBackup.get_wal_name(0, targets['recovery_target_lsn'].strip("'"), segment_size)
+
+        if 'recovery_target_time' in targets:
+            value = targets['recovery_target_time'].strip("'").replace("''", "'")
+            target_time = self._parse_target_time(value)
+            if target_time is None:
+                print("WARNING: Recovery target time \"{}\" is not understood, WAL segments are not prefetched.".format(value))
+                return None
+            return catalog.get_archived_after(target_time)
+
+        return None
+
+    @staticmethod
+    def _parse_target_time(value: str) -> typing.Optional[float]:
+        """
+        Parse recovery target time, as PostgreSQL accepts it, e.g. "2024-01-31 12:00:00+01"
+        or "2024-01-31 12:00:00 CET". Time without the zone is local.
+
+        :returns: seconds since the epoch or None, if the time is not understood.
+        """
+        match = re.match(r"^(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?"
+                         r"\s*(?:([+-])(\d{2})(?::?(\d{2}))?|([A-Za-z][A-Za-z0-9_/+-]*))?$", value.strip())
+        if match is None:
+            return None
+        year, month, day, hour, minute, second, fraction, sign, off_hours, off_minutes, zone = match.groups()
+        tzinfo: typing.Optional[datetime.tzinfo] = None
+        if sign:
+            offset = datetime.timedelta(hours=int(off_hours), minutes=int(off_minutes or 0))
+            tzinfo = datetime.timezone(offset if sign == "+" else -offset)
+        elif zone and zone.upper() in ("Z", "UTC", "GMT"):
+            tzinfo = datetime.timezone.utc
+        elif zone:
+            try:
+                tzinfo = zoneinfo.ZoneInfo(zone) if zoneinfo is not None else None
+            except (ValueError, KeyError, OSError):
+                pass
+            if tzinfo is None:
+                return None
+        try:
+            return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second or 0),
+                                     int((fraction or "0").ljust(6, "0")), tzinfo=tzinfo).timestamp()
+        except ValueError:
+            return None
+
+    def _rst_prefetch_wal(self, backup_dst: str, staging: str, targets: typing.Dict[str, str]) -> None:
+        """
+        Prefetch and decompress WAL segments from the start of the backup up to the recovery target
+        on several threads, so recovery does not fetch them one by one.
+        """
+        catalog = BackupCatalog.open(backup_dst)
+        if catalog is None:
+            return
+        try:
+            # Database is down at this point, segment size is known from the archive
+            segment_size = catalog.get_segment_size()
+            backups = catalog.get_base_backups()
+            last = self._rst_get_last_segment(catalog, targets, segment_size)
+            if not backups or backups[-1]["start_lsn"] is None or last is None:
+                return
+            first = PgBackup.get_wal_name(backups[-1]["timeline"], backups[-1]["start_lsn"], segment_size)
+            segments = catalog.get_files_between("wal", first, last)
+        finally:
+            catalog.close()
+
+        print("Prefetching %s WAL segments:\t " % len(segments), end="")
+        sys.stdout.flush()
+        started = time.time()
+        # Segments, failed to prefetch, are fetched again by the restore_command
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+            for name in segments:
+                pool.submit(restore_segment, os.path.join(backup_dst, name), os.path.join(staging, name))
+        data_owner = get_path_owner(staging)
+        for name in os.listdir(staging):
+            os.chown(os.path.join(staging, name), data_owner.uid, data_owner.gid)
+        print("finished (%s segments in %.1fs)" % (len(os.listdir(staging)), time.time() - started))
+        sys.stdout.flush()
+
+    def _rst_wait_recovery(self, poll: float = 1.) -> bool:
+        """
+        Wait until the archive recovery is finished: the server removes recovery.signal
+        or renames recovery.conf at the end of the recovery.
+
+        :returns: True, if the recovery is finished, False if the database is not running.
+        """
+        signals = [os.path.join(self.config['pcnf_pg_data'], name) for name in ["recovery.signal", "recovery.conf"]]
+        if not [path for path in signals if os.path.exists(path)]:
+            return True
+
+        print("Waiting for the recovery:\t ", end="")
+        sys.stdout.flush()
+        roller = Roller()
+        roller.start()
+        while [path for path in signals if os.path.exists(path)]:
+            if not self._get_db_status():
+                roller.stop("failed")
+                return False
+            time.sleep(poll)
+        roller.stop("finished")
+
+        return True
+
     def do_backup_restore(self, *opts: str, **args: str) -> None:  # pylint: disable=W0613
         """
         Restore the SUSE Manager Database from backup
+        @help
+        --save-mode=<value>\tSave broken cluster while unarchiving the backup. Values: auto (default) | parallel | serial
+        --target-time=<time>\tRecover up to the time, e.g. "2024-01-31 12:00:00+01".
+        --target-lsn=<lsn>\tRecover up to the WAL location.
+        --target-xid=<xid>\tRecover up to the transaction ID.
+        --prefetch=<num>\tNumber of WAL segments to prefetch ahead of the recovery (default: 8).\n
         """
         # Go out from the current position, in case user is calling SMDBA inside the "data" directory
         location_begin = os.getcwd()
@@ -712,10 +1767,16 @@ class PgSQLGate(BaseGate):
         if not backup_on:
             eprint("No backup snapshots are available.")
             sys.exit(1)
+        targets = self._get_recovery_targets(**args)
+        if not args.get('prefetch', '8').isdigit():
+            raise GateException("Number of WAL segments to prefetch must be a number.")
+        prefetch = int(args.get('prefetch', '8'))
 
         # Check if we have enough space to fit enough copy of the tablespace
-        curr_ts_size = self._get_tablespace_size(self.config['pcnf_pg_data'])
-        bckp_ts_size = self._get_tablespace_size(backup_dst)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            curr_ts = pool.submit(self._get_tablespace_size, self.config['pcnf_pg_data'])
+            bckp_ts = pool.submit(self._get_tablespace_size, backup_dst, True)
+        curr_ts_size, bckp_ts_size = curr_ts.result(), bckp_ts.result()
         disk_size = self._get_partition_size(self.config['pcnf_pg_data'])
 
         print("Current cluster size:\t", self.size_pretty(curr_ts_size))
@@ -734,21 +1795,102 @@ class PgSQLGate(BaseGate):
         self._rst_shutdown_db()
 
         # Save current tablespace
-        self._rst_save_current_cluster()
+        wait_saved = self._rst_save_current_cluster(mode=args.get('save-mode', 'auto'))
 
         # Replace with new backup
-        self._rst_replace_new_backup(backup_dst)
+        # WAL segments are prefetched into the local staging directory
+        staging = os.path.join(os.path.dirname(self.config['pcnf_pg_data'].rstrip('/')), "wal-staging")
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        os.mkdir(staging, 0o700)
+        data_owner = get_path_owner(os.path.dirname(staging))
+        os.chown(staging, data_owner.uid, data_owner.gid)
+        if targets:
+            self._rst_prefetch_wal(backup_dst, staging, targets)
+        self._rst_replace_new_backup(backup_dst, targets=targets, staging=staging, prefetch=prefetch)
+        if wait_saved is not None:
+            wait_saved()
         self.do_db_start()
 
+        # Server accepts connections before the archive recovery is finished,
+        # otherwise staging stays until the next restore
+        if self._rst_wait_recovery():
+            shutil.rmtree(staging, ignore_errors=True)
+        else:
+            print("INFO: Prefetched WAL segments are kept in \"%s\" until the next restore." % staging)
+
         # Move back where backup has been invoked
         os.chdir(location_begin)
 
+    def do_backup_verify(self, *opts: str, **args: str) -> None:  # pylint: disable=W0613
+        """
+        Verify backup without restoring it
+        @help
+        --threads=<num>\tNumber of threads and processes for the verification (default: all CPU cores).\n
+        """
+        backup_dst, backup_on = self.do_backup_status('--silent')
+        if not backup_on:
+            eprint("No backup snapshots are available.")
+            sys.exit(1)
+        if not args.get('threads', '0').isdigit():
+            raise GateException("Number of threads must be a number.")
+        threads = int(args.get('threads', '0'))
+
+        failed = False
+        base_archive = PgBackup.get_base_archive(backup_dst)
+        archives = [base_archive] if base_archive is not None else []
+        for incremental in PgBackup.get_incremental_chain(backup_dst):
+            archives.append(str(PgBackup.get_base_archive(incremental)))
+
+        for archive in archives:
+            print("Verifying %s:\t " % os.path.relpath(archive, backup_dst), end="")
+            sys.stdout.flush()
+            if not os.path.exists(get_manifest_name(archive)):
+                print("skipped, no backup manifest")
+                continue
+            started = time.time()
+            roller = Roller()
+            roller.start()
+            verified, unchecked, errors = PgBackup.verify_base_backup(archive, get_manifest_name(archive),
+                                                                      threads=threads, progress=roller.update)
+            roller.stop("%s (%s files, %s)" % (errors and "failed" or "finished", verified,
+                                               self._rst_get_throughput(archive, started)))
+            if unchecked:
+                print("INFO: CRC32C checksums of %s files are not verified, python3-crc32c package is required." % unchecked)
+            for error in errors:
+                eprint("  " + error)
+            failed = failed or bool(errors)
+
+        print("Verifying WAL archive:\t ", end="")
+        sys.stdout.flush()
+        started = time.time()
+        roller = Roller(unit="segments")
+        roller.start()
+        segments, errors = PgBackup(backup_dst).verify_wal_chain(
+            segment_size=self._get_db_status() and self._get_wal_segment_size() or 0x1000000, workers=threads,
+            progress=roller.update)
+        roller.stop("%s (%s segments in %.1fs)" % (errors and "failed" or "finished", segments, time.time() - started))
+        for error in errors:
+            eprint("  " + error)
+
+        if failed or errors:
+            raise GateException("Backup verification failed.")
+
     def do_backup_hot(self, *opts: str, **args: str) -> None:  # pylint: disable=W0613
         """
         Enable continuous archiving backup
         @help
         --enable=<value>\tEnable or disable hot backups. Values: on | off | purge
-        --backup-dir=<path>\tDestination directory of the backup.\n
+        --backup-dir=<path>\tDestination directory of the backup.
+        --wal-compression=<value>\tStore WAL segments compressed. Values: none | gzip | zstd
+        --wal-compression-level=<num>\tCompression level of WAL segments.
+        --base-compression=<value>\tCompression of the base backup. Values: gzip (default) | zstd | none
+        --threads=<num>\tNumber of compression threads for the base backup.
+        --backup-type=<value>\tType of the base backup. Values: full (default) | incremental
+        --mode=<value>\tShip WAL segments when they are full or stream them continuously. Values: archive (default) | stream
+        --keep-backups=<num>\tNumber of full backups to keep (default: 2).
+        --keep-days=<num>\tKeep backups to restore any point in time of the last days.
+        --archive-workers=<num>\tNumber of segments, the archiver daemon copies at once (default: 4).\n
         """
 
         # Part for the auto-backups
@@ -776,6 +1918,8 @@ class PgSQLGate(BaseGate):
             args['backup-dir'] = target
             if not args.get('enable'):
                 args['enable'] = 'on'
+            if '--stream' in arch_cmd and 'mode' not in args:
+                args['mode'] = 'stream'
 
         if args.get('enable') == 'on' and 'backup-dir' not in args.keys():
             raise GateException("Backup destination is not defined. Please issue '--backup-dir' option.")
@@ -816,6 +1960,12 @@ class PgSQLGate(BaseGate):
         conf_path = self.config['pcnf_pg_data'] + "/postgresql.conf"
         conf = self._get_conf(conf_path)
         backup_dir: str = args.get('backup-dir', "")
+        streaming = '--stream' in conf.get('archive_command', '')
+        mode = args.get('mode', 'archive')
+        if mode not in ['archive', 'stream']:
+            raise GateException("Unknown WAL shipping mode \"{}\". See help for more information.".format(mode))
+        if mode == 'stream' and args.get('wal-compression', 'none') != 'none':
+            raise GateException("Streamed WAL segments cannot be compressed.")
 
         if enable == 'on':
             # Enable backups
@@ -830,39 +1980,68 @@ class PgSQLGate(BaseGate):
             # first write the archive_command and restart the db
             # if we create the base backup after this, we prevent a race conditions
             # and do not lose archive logs
-            cmd = "'" + "/usr/bin/smdba-pgarchive --source \"%p\" --destination \"" + backup_dir + "/%f\"'"
-            if conf.get('archive_command', '') != cmd:
+            # with the streaming, archive_command only archives, what pg_receivewal does not receive
+            cmd = "'" + "/usr/bin/smdba-pgarchive " + (mode == 'stream' and "--stream " or "") + \
+                  self._get_wal_compression_opts(**args) + \
+                  "--source \"%p\" --destination \"" + backup_dir + "/%f\"'"
+            # WAL summaries are required for the incremental backups
+            summarize = self._get_pg_version() >= [17] and conf.get('summarize_wal') != 'on'
+            if conf.get('archive_command', '') != cmd or summarize:
                 conf['archive_command'] = cmd
+                if summarize:
+                    conf['summarize_wal'] = 'on'
                 self._write_conf(conf_path, **conf)
                 self._apply_db_conf()
 
-            # round robin of base backups
-            if os.path.exists(backup_dir + "/base.tar.gz"):
-                if os.path.exists(backup_dir + "/base-old.tar.gz"):
-                    os.remove(backup_dir + "/base-old.tar.gz")
-                os.rename(backup_dir + "/base.tar.gz", backup_dir + "/base-old.tar.gz")
-
-            if os.path.exists(backup_dir + "/backup_manifest"):
-                if os.path.exists(backup_dir + "/backup_manifest.old"):
-                    os.remove(backup_dir + "/backup_manifest.old")
-                os.rename(backup_dir + "/backup_manifest", backup_dir + "/backup_manifest.old")
+            self._start_archiver(backup_dir, args.get('archive-workers'))
+            if mode == 'stream':
+                self._start_wal_receiver(backup_dir)
+            elif streaming:
+                self._stop_wal_receiver(backup_dir)
 
             b_dir_temp = os.path.join(backup_dir, 'tmp')
+            manifest = self._get_incremental_manifest(backup_dir, **args)
+            if manifest is not None:
+                if self._perform_incremental_backup(backup_dir, manifest, **args):
+                    self._cleanup_backup(backup_dir, **args)
+                    return
+                print("WARNING: Incremental backup failed, taking a full backup.")
+
+            basebackup_cmd, archive_name = self._get_basebackup_command(b_dir_temp, **args)
+
             cwd = os.getcwd()
             os.chdir(self.config.get('pcnf_data_directory', '/var/lib/pgsql'))
-            os.system('sudo -u postgres /usr/bin/pg_basebackup -D {0}/ -Ft -c fast -X fetch -v -P -z'.format(b_dir_temp))
+            ret = os.system(basebackup_cmd)
             os.chdir(cwd)
-
-            if os.path.exists("{0}/base.tar.gz".format(b_dir_temp)):
-                os.rename("{0}/base.tar.gz".format(b_dir_temp), "{0}/base.tar.gz".format(backup_dir))
-            if os.path.exists("{0}/backup_manifest".format(b_dir_temp)):
-                os.rename("{0}/backup_manifest".format(b_dir_temp), "{0}/backup_manifest".format(backup_dir))
+            if ret:
+                # Current base backup stays in place
+                shutil.rmtree(b_dir_temp, ignore_errors=True)
+                raise GateException("Unable to take the base backup.")
+
+            # current base backup with its manifest and incremental backups becomes a previous generation
+            base_archive = PgBackup.get_base_archive(backup_dir)
+            if base_archive is not None:
+                suffix = time.strftime("%Y%m%d%H%M%S", time.localtime(os.path.getmtime(base_archive)))
+                os.rename(base_archive, base_archive.replace("/base.tar", "/base-%s.tar" % suffix))
+                for name in ["backup_manifest", PgBackup.INCREMENTAL_DIR]:
+                    if os.path.exists(os.path.join(backup_dir, name)):
+                        os.rename(os.path.join(backup_dir, name), os.path.join(backup_dir, name + "-" + suffix))
+
+                catalog = BackupCatalog(backup_dir)
+                catalog.rotate_base_backups(suffix)
+                catalog.close()
+
+            self._move_basebackup(b_dir_temp, backup_dir, archive_name, backup_dir)
 
             # Cleanup/rotate backup
-            PgBackup(backup_dir, pg_data=self.config.get('pcnf_data_directory', '/var/lib/pgsql')).cleanup_backup()
+            self._cleanup_backup(backup_dir, **args)
 
         else:
             # Disable backups
+            if streaming:
+                self._stop_wal_receiver(backup_dir)
+            self._stop_archiver()
+
             if enable == 'purge' and os.path.exists(backup_dir):
                 print("INFO: Removing the whole backup tree \"%s\"" % backup_dir)
                 shutil.rmtree(backup_dir)
@@ -875,6 +2054,364 @@ class PgSQLGate(BaseGate):
             else:
                 print("INFO: Backup was not enabled.")
 
+    def _cleanup_backup(self, backup_dir: str, **args: str) -> None:
+        """
+        Remove expired backups and WAL, which is not needed by the retained backups.
+        Retention policy is stored in the backup catalog, so it is applied on every backup.
+        """
+        catalog = BackupCatalog(backup_dir)
+        retention: typing.Dict[str, typing.Optional[int]] = {}
+        try:
+            for key in ['keep-backups', 'keep-days']:
+                if key in args:
+                    try:
+                        value = int(args[key])
+                    except ValueError:
+                        raise GateException("Option --{} must be a number.".format(key))
+                    if value < 1:
+                        raise GateException("Option --{} must be at least 1.".format(key))
+                    catalog.set_setting(key, str(value))
+                value = catalog.get_setting(key)
+                retention[key] = int(value) if value is not None else None
+        finally:
+            catalog.close()
+
+        PgBackup(backup_dir, pg_data=self.config.get('pcnf_data_directory', '/var/lib/pgsql')).cleanup_backup(
+            keep_backups=retention['keep-backups'], keep_days=retention['keep-days'],
+            segment_size=self._get_wal_segment_size())
+
+    def _get_wal_segment_size(self) -> int:
+        """
+        Get WAL segment size of the server in bytes.
+        """
+        try:
+            for size, in self.query("SELECT setting::bigint * CASE unit WHEN '8kB' THEN 8192 WHEN 'MB' THEN 1048576 "
+                                    "ELSE 1 END FROM pg_settings WHERE name = 'wal_segment_size'", types=(int,)):
+                return int(size)
+        except GateException:
+            pass
+
+        return 0x1000000
+
+    @staticmethod
+    def get_lsn_position(lsn: str) -> int:
+        """
+        Get byte position of the LSN in the WAL stream.
+        """
+        log_id, offset = lsn.split("/")
+        return (int(log_id, 16) << 32) + int(offset, 16)
+
+    @staticmethod
+    def get_archive_lag(lsn: str, last_wal: typing.Optional[str], segment_size: int) -> typing.Tuple[int, int]:
+        """
+        Get WAL, written by the server, but not archived yet.
+
+        :param lsn: current WAL write position
+        :param last_wal: name of the last archived WAL segment or None, if nothing is archived
+        :param segment_size: WAL segment size in bytes
+        :returns: number of complete segments, waiting for archiving, and bytes after the last archived segment.
+        """
+        position = PgSQLGate.get_lsn_position(lsn)
+        archived = 0
+        if last_wal is not None:
+            archived = (int(last_wal[8:16], 16) * (0x100000000 // segment_size) + int(last_wal[16:24], 16) + 1) * segment_size
+
+        return max(0, (position - archived) // segment_size), max(0, position - archived)
+
+    def _get_archive_sample(self, backup_dst: str, window: float) -> typing.Dict[str, typing.Any]:
+        """
+        Sample WAL archiving of the running database against the backup catalog.
+
+        :param backup_dst: backup directory
+        :param window: seconds of recent archiving, the archiving rate is measured over
+        """
+        if self._get_pg_version() >= [10]:
+            current, wal_file = "pg_current_wal_lsn()", "pg_walfile_name"
+        else:
+            current, wal_file = "pg_current_xlog_location()", "pg_xlogfile_name"
+        sql = ("SELECT {0}, {1}({0}), archived_count, last_archived_wal, EXTRACT(EPOCH FROM last_archived_time), "
+               "failed_count, last_failed_wal, EXTRACT(EPOCH FROM now()) FROM pg_stat_archiver").format(current, wal_file)
+        for lsn, _, archived_count, last_archived, archived_time, failed_count, last_failed, now in self.query(
+                sql, types=(str, str, int, str, float, int, str, float)):
+            break
+        else:
+            raise GateException("WAL archiver statistics are not available.")
+
+        catalog = BackupCatalog(backup_dst)
+        try:
+            segment_size = catalog.get_segment_size()
+            # Streamed segments are known only to the catalog
+            candidates = [name for name in [last_archived, catalog.get_last_wal()]
+                          if name and getattr(CatalogFile.parse(name), "kind", None) == "wal"]
+            count, size, stored = catalog.get_archived_since(time.time() - window)
+        finally:
+            catalog.close()
+
+        last_wal = max(candidates, key=lambda name: name[8:24]) if candidates else None
+        pending, lag_bytes = self.get_archive_lag(lsn, last_wal, segment_size)
+        free = self.media_usage(backup_dst)['free']
+
+        return {
+            "time": now,
+            "lsn": lsn,
+            "last_archived_wal": last_wal,
+            "pending_segments": pending,
+            "lag_bytes": lag_bytes,
+            "lag_seconds": (max(0., now - archived_time) if archived_time else None) if pending else 0.,
+            "archived_count": archived_count,
+            "failed_count": failed_count,
+            "last_failed_wal": last_failed,
+            "archived_segments": count,
+            "archive_rate": size / window,
+            "stored_rate": stored / window,
+            "wal_rate": None,
+            "space_free": free,
+            "space_exhausted_in": free / (stored / window) if stored else None,
+        }
+
+    @staticmethod
+    def _start_archiver(backup_dir: str, workers: typing.Optional[str] = None) -> None:
+        """
+        Start the archiver daemon in the background, so archive_command hands segments off to it.
+        While the daemon is down, archive_command archives segments by itself.
+
+        :param backup_dir: backup directory, which keeps the daemon log and its number of workers
+        :param workers: number of workers or None to use the stored one
+        """
+        if workers is not None and not str(workers).isdigit():
+            raise GateException("Number of archive workers must be a number.")
+        catalog = BackupCatalog(backup_dir)
+        try:
+            if workers is not None:
+                catalog.set_setting("archive-workers", str(workers))
+            workers = catalog.get_setting("archive-workers") or "4"
+        finally:
+            catalog.close()
+
+        if get_archiver_pid() is not None:
+            return
+
+        subprocess.Popen(["sudo", "-u", "postgres", "/bin/bash", "-c",
+                          "exec /usr/bin/smdba-pgarchive --daemon --workers {0} >> \"{1}/.smdba-pgarchive.log\" 2>&1"
+                          .format(int(workers), backup_dir)],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+        for _ in range(50):
+            if get_archiver_pid() is not None and os.path.exists(PgArchiver.SOCKET):
+                print("INFO: Archiver daemon started.")
+                return
+            time.sleep(0.1)
+        eprint("WARNING: Archiver daemon did not start, see {}/.smdba-pgarchive.log".format(backup_dir))
+
+    @staticmethod
+    def _stop_archiver() -> None:
+        """
+        Stop the archiver daemon. PostgreSQL retries the interrupted requests.
+        """
+        pid = get_archiver_pid()
+        if pid is None:
+            return
+
+        os.kill(pid, signal.SIGTERM)
+        for _ in range(60):
+            if get_archiver_pid() is None:
+                break
+            time.sleep(0.5)
+        print("INFO: Archiver daemon stopped.")
+
+    def _start_wal_receiver(self, backup_dir: str) -> None:
+        """
+        Start supervised pg_receivewal in the background, streaming WAL into the backup directory.
+        Replication slot keeps WAL on the server, until it is received.
+        """
+        if get_receiver_pid(backup_dir) is not None:
+            return
+
+        if os.system("sudo -u postgres {0} --create-slot --if-not-exists -S {1}".format(
+                WalReceiver.RECEIVEWAL, WalReceiver.SLOT)):
+            raise GateException("Unable to create replication slot \"{}\".".format(WalReceiver.SLOT))
+
+        subprocess.Popen(["sudo", "-u", "postgres", "/bin/bash", "-c",
+                          "exec /usr/bin/smdba-pgarchive --receive --destination \"{0}\" >> \"{0}/.smdba-receivewal.log\" 2>&1"
+                          .format(backup_dir)],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+        print("INFO: WAL streaming started.")
+
+    @staticmethod
+    def _stop_wal_receiver(backup_dir: str) -> None:
+        """
+        Stop WAL streaming and drop its replication slot, so WAL is not kept on the server anymore.
+        """
+        pid = get_receiver_pid(backup_dir)
+        if pid is not None:
+            os.kill(pid, signal.SIGTERM)
+            for _ in range(30):
+                if get_receiver_pid(backup_dir) is None:
+                    break
+                time.sleep(0.5)
+
+        os.system("sudo -u postgres {0} --drop-slot -S {1} 2>/dev/null".format(WalReceiver.RECEIVEWAL, WalReceiver.SLOT))
+        print("INFO: WAL streaming stopped.")
+
+    def _get_incremental_manifest(self, backup_dir: str, **args: str) -> typing.Optional[str]:
+        """
+        Get manifest of the previous backup, if incremental backup is requested and possible.
+        """
+        backup_type = args.get('backup-type', 'full')
+        if backup_type not in ['full', 'incremental']:
+            raise GateException("Unknown backup type \"{}\". See help for more information.".format(backup_type))
+        if backup_type == 'full':
+            return None
+
+        manifest = PgBackup.get_chain_manifest(backup_dir)
+        if self._get_pg_version() < [17] or not os.path.exists(PgBackup.PG_COMBINEBACKUP):
+            print("INFO: Incremental backups require PostgreSQL 17 or newer, taking a full backup.")
+            manifest = None
+        elif manifest is None:
+            print("INFO: No base backup found, taking a full backup.")
+
+        return manifest
+
+    def _perform_incremental_backup(self, backup_dir: str, manifest: str, **args: str) -> bool:
+        """
+        Take incremental backup on top of the latest backup of the chain.
+
+        :param manifest: manifest of the latest backup
+        :returns: True on success
+        """
+        b_dir_temp = os.path.join(backup_dir, 'tmp')
+        basebackup_cmd, archive_name = self._get_basebackup_command(b_dir_temp, incremental=manifest, **args)
+
+        cwd = os.getcwd()
+        os.chdir(self.config.get('pcnf_data_directory', '/var/lib/pgsql'))
+        ret = os.system(basebackup_cmd)
+        os.chdir(cwd)
+        if ret:
+            shutil.rmtree(b_dir_temp, ignore_errors=True)
+            return False
+
+        incr_dir = os.path.join(backup_dir, PgBackup.INCREMENTAL_DIR, time.strftime("%Y%m%d%H%M%S"))
+        os.system('sudo -u postgres /bin/mkdir -p -m 0700 %s' % incr_dir)
+        self._move_basebackup(b_dir_temp, incr_dir, archive_name, backup_dir)
+
+        return True
+
+    @staticmethod
+    def _move_basebackup(source: str, destination: str, archive_name: str, backup_dir: str) -> None:
+        """
+        Move taken base backup and its manifest from the temporary directory
+        and record it in the backup catalog.
+        """
+        archive = os.path.join(source, archive_name)
+        if not os.path.exists(archive):
+            return
+
+        # Manifest is inside the archive, if it was written to the STDOUT
+        if not os.path.exists(os.path.join(source, "backup_manifest")):
+            os.system("sudo -u postgres " + PgBackup.get_untar_command(archive, source, "backup_manifest") + " 2>/dev/null")
+
+        os.rename(archive, os.path.join(destination, archive_name))
+        if os.path.exists(os.path.join(source, "backup_manifest")):
+            os.rename(os.path.join(source, "backup_manifest"), os.path.join(destination, "backup_manifest"))
+
+        catalog = BackupCatalog(backup_dir)
+        catalog.add_base_backup(os.path.relpath(os.path.join(destination, archive_name), backup_dir),
+                                "full" if os.path.samefile(destination, backup_dir) else "incremental",
+                                os.path.getsize(os.path.join(destination, archive_name)),
+                                manifest=os.path.join(destination, "backup_manifest"))
+        catalog.close()
+
+    def _get_pg_version(self) -> typing.List[int]:
+        """
+        Get version of the PostgreSQL server.
+        """
+        return get_binary_version('/usr/bin/postgres')
+
+    def _has_tablespaces(self) -> bool:
+        """
+        Check if the cluster has tablespaces besides the default ones.
+        """
+        try:
+            return bool(os.listdir(os.path.join(self.config['pcnf_pg_data'], "pg_tblspc")))
+        except OSError:
+            return False
+
+    def _get_basebackup_command(self, target: str, incremental: typing.Optional[str] = None,
+                                **args: str) -> typing.Tuple[str, str]:
+        """
+        Get the base backup command with its compression.
+
+        Compression runs on several threads: with server versions 15 and newer pg_basebackup
+        compresses with zstd workers by itself, otherwise uncompressed tar is piped to pigz or zstd.
+        Tar to STDOUT holds only the default tablespace, so clusters with extra tablespaces
+        are compressed by pg_basebackup on a single thread.
+
+        :param target: directory for the base backup
+        :param incremental: manifest of the previous backup for the incremental backup
+        :returns: command and file name of the base backup archive
+        """
+        compression = args.get('base-compression', 'gzip')
+        if compression not in PgBackup.BASE_ARCHIVES:
+            raise GateException("Unknown base backup compression \"{}\". See help for more information.".format(compression))
+        try:
+            threads = int(args.get('threads', str(os.cpu_count() or 1)))
+        except ValueError:
+            raise GateException("Number of threads must be a number.")
+
+        basebackup = "/usr/bin/pg_basebackup -Ft -c fast -X fetch -v -P"
+        if self._get_pg_version() >= [13]:
+            # Verifiable without extra packages
+            basebackup += " --manifest-checksums=SHA256"
+        if incremental is not None:
+            basebackup += " --incremental={0}".format(incremental)
+        piped = not self._has_tablespaces()
+        compressor = None
+        if compression == 'gzip' and threads > 1 and piped and os.path.exists(PgBackup.PIGZ):
+            compressor = "{0} -p {1}".format(PgBackup.PIGZ, threads)
+        elif compression == 'gzip':
+            basebackup += " -z"
+        elif compression == 'zstd' and self._get_pg_version() >= [15]:
+            basebackup += " --compress=zstd:workers={0}".format(threads) if threads > 1 else " --compress=zstd"
+        elif compression == 'zstd':
+            if not piped:
+                raise GateException("Compression zstd of the cluster with tablespaces requires PostgreSQL 15 or newer.")
+            if not os.path.exists(PgBackup.ZSTD):
+                raise GateException("Compression zstd requires {} utility.".format(PgBackup.ZSTD))
+            compressor = "{0} -q -T{1}".format(PgBackup.ZSTD, threads)
+
+        archive_name = PgBackup.BASE_ARCHIVES[compression]
+        if compressor is None:
+            cmd = "sudo -u postgres {0} -D {1}/".format(basebackup, target)
+        else:
+            # Tar to STDOUT supports only the default tablespace; the backup manifest is included in it
+            cmd = "sudo -u postgres /bin/bash -o pipefail -c '/bin/mkdir -p -m 0700 {1} && {0} -D - | {2} > {1}/{3}'".format(
+                basebackup, target, compressor, archive_name)
+
+        return cmd, archive_name
+
+    @staticmethod
+    def _get_wal_compression_opts(**args: str) -> str:
+        """
+        Get WAL compression options of the archive command.
+        """
+        compression = args.get('wal-compression', 'none')
+        if compression == 'none':
+            return ""
+        if compression not in CODECS:
+            raise GateException("Unknown WAL compression \"{}\". See help for more information.".format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise GateException("WAL compression zstd requires python3-zstandard package.")
+
+        opts = "--compress {} ".format(compression)
+        if args.get('wal-compression-level'):
+            try:
+                opts += "--level {} ".format(int(args['wal-compression-level']))
+            except ValueError:
+                raise GateException("WAL compression level must be a number.")
+
+        return opts
+
     def _apply_db_conf(self) -> None:
         """
         Reload the configuration.
@@ -900,7 +2437,205 @@ class PgSQLGate(BaseGate):
         if os.path.exists(args.get('backup-dir', "")):
             raise GateException("Destination file \"%s\"already exists." % args.get('backup-dir'))
 
-        shutil.copy2(args.get('source', ""), args.get('backup-dir', ""))
+        try:
+            archive_segment(args.get('source', ""), args.get('backup-dir', ""))
+        except ArchiveException as ex:
+            raise GateException(str(ex))
+
+    def _collect_status_metrics(self) -> typing.List[Metric]:
+        """
+        Collect status of the database.
+        """
+        return [Metric("smdba_database_up", "Whether the database is running.").add(self._get_db_status())]
+
+    def _collect_database_metrics(self) -> typing.List[Metric]:
+        """
+        Collect sizes of the databases.
+        """
+        metric = Metric("smdba_database_size_bytes", "Size of the database.")
+        if self._get_db_status():
+            try:
+                for d_size, d_name in self.query("SELECT pg_database_size(datname), datname FROM pg_database",
+                                                 types=(int, str)):
+                    metric.add(d_size, database=d_name)
+            except Exception:
+                self.close_sessions()  # Database might be restarted meanwhile, reconnect next time
+                raise
+
+        return [metric]
+
+    def _collect_backup_metrics(self) -> typing.List[Metric]:
+        """
+        Collect state of the continuous archiving and base backups.
+        """
+        backup_dst, backup_on = self.do_backup_status('--silent')
+        metrics = [Metric("smdba_backup_enabled", "Whether continuous archiving is enabled.").add(backup_on)]
+        if backup_on:
+            catalog = BackupCatalog(backup_dst)
+            try:
+                last_archived = catalog.get_last_archived()
+                backups = catalog.get_base_backups()
+            finally:
+                catalog.close()
+            metrics.append(Metric("smdba_backup_last_archived_timestamp_seconds",
+                                  "Time of the last archived WAL file.").add(last_archived))
+            metrics.append(Metric("smdba_backup_base_backups", "Number of base backups in the current chain.").add(len(backups)))
+            if backups:
+                metrics.append(Metric("smdba_backup_last_base_backup_timestamp_seconds",
+                                      "Time of the last base backup.").add(max(bkp["created"] for bkp in backups)))
+            metrics.append(Metric("smdba_backup_wal_streaming",
+                                  "Whether WAL is streamed.").add(get_receiver_pid(backup_dst) is not None))
+
+        return metrics
+
+    def _collect_filesystem_metrics(self) -> typing.List[Metric]:
+        """
+        Collect usage of the data and backup partitions.
+        """
+        paths = {"data": self.config['pcnf_pg_data']}
+        backup_dst, backup_on = self.do_backup_status('--silent')
+        if backup_on:
+            paths["backup"] = backup_dst
+
+        size = Metric("smdba_filesystem_size_bytes", "Size of the filesystem.")
+        avail = Metric("smdba_filesystem_avail_bytes", "Space on the filesystem, available to the database.")
+        for role, path in paths.items():
+            usage = self.media_usage(path)
+            size.add(usage['total'], role=role, path=path)
+            avail.add(usage['free'], role=role, path=path)
+
+        return [size, avail]
+
+    def _collect_archiver_metrics(self) -> typing.List[Metric]:
+        """
+        Collect lag and rate of the WAL archiving.
+        """
+        backup_dst, backup_on = self.do_backup_status('--silent')
+        if not backup_on or not self._get_db_status():
+            return []
+
+        try:
+            sample = self._get_archive_sample(backup_dst, 3600.)
+        except Exception:
+            self.close_sessions()
+            raise
+        metrics = [
+            Metric("smdba_archive_lag_bytes", "WAL, not archived yet.").add(sample["lag_bytes"]),
+            Metric("smdba_archive_pending_segments", "Complete WAL segments, waiting for archiving.").add(
+                sample["pending_segments"]),
+            Metric("smdba_archive_failed_total", "Failed attempts to archive WAL.", "counter").add(sample["failed_count"]),
+            Metric("smdba_archive_rate_bytes", "WAL archived per second in the last hour.").add(sample["archive_rate"]),
+        ]
+        if sample["lag_seconds"] is not None:
+            metrics.append(Metric("smdba_archive_lag_seconds", "Time since the last archived WAL segment, "
+                                                               "if segments are waiting.").add(sample["lag_seconds"]))
+        if sample["space_exhausted_in"] is not None:
+            metrics.append(Metric("smdba_archive_space_exhausted_in_seconds",
+                                  "Projected time until the backup partition is full.").add(sample["space_exhausted_in"]))
+
+        return metrics
+
+    def do_metrics(self, *opts: str, **args: str) -> None:  # pylint: disable=W0613
+        """
+        Show database metrics in Prometheus text format
+        @help
+        --serve=<[address:]port>\tServe metrics over HTTP at /metrics until interrupted.
+        """
+        registry = MetricsRegistry([
+            Collector("status", 5, self._collect_status_metrics),
+            Collector("databases", 60, self._collect_database_metrics),
+            Collector("backup", 30, self._collect_backup_metrics),
+            Collector("filesystem", 30, self._collect_filesystem_metrics),
+            Collector("archiver", 15, self._collect_archiver_metrics),
+        ])
+        if not args.get('serve'):
+            sys.stdout.write(registry.render())
+            return
+
+        try:
+            address, port = get_listen_address(str(args['serve']))
+        except ValueError as ex:
+            raise GateException(str(ex))
+        print("Serving metrics at http://{}:{}/metrics".format(address or "0.0.0.0", port))
+        sys.stdout.flush()
+        registry.serve(address, port)
+
+    def do_backup_lag(self, *opts: str, **args: str) -> None:  # pylint: disable=W0613
+        """
+        Show WAL archiving lag and rate
+        @help
+        --watch=<seconds>\tSample repeatedly at the interval until interrupted.
+        --count=<num>\tStop after the number of samples.
+        --window=<seconds>\tMeasure archiving rate over the recent time (default: 3600).
+        """
+        for key, default in [('watch', '0'), ('count', '0'), ('window', '3600')]:
+            if not str(args.get(key, default)).isdigit():
+                raise GateException("Option --{} must be a number.".format(key))
+        interval = int(args.get('watch', '0'))
+        count = int(args.get('count', '0' if interval else '1'))
+        window = float(args.get('window', '3600')) or 3600.
+
+        backup_dst, backup_on = self.do_backup_status('--silent')
+        if not backup_on:
+            raise GateException("Backup is not enabled.")
+        if not self._get_db_status():
+            raise GateException("Database must be running.")
+
+        def duration(seconds: typing.Optional[float]) -> str:
+            if seconds is None:
+                return '--'
+            seconds = int(seconds)
+            return ("%dd " % (seconds // 86400) if seconds >= 86400 else "") + "%d:%02d:%02d" % (
+                seconds // 3600 % 24, seconds // 60 % 60, seconds % 60)
+
+        def text(records: typing.Iterable[typing.Sequence[typing.Any]]) -> None:
+            for record in records:
+                sample = dict(zip(fields, record))
+                rate = self.size_pretty(sample["archive_rate"]) + "/s"
+                if interval:
+                    print(row_format.format(time.strftime("%H:%M:%S", time.localtime(sample["time"])), sample["lsn"],
+                                            sample["pending_segments"], self.size_pretty(sample["lag_bytes"]),
+                                            duration(sample["lag_seconds"]), rate,
+                                            sample["wal_rate"] is not None and self.size_pretty(sample["wal_rate"]) + "/s" or '--',
+                                            sample["failed_count"], duration(sample["space_exhausted_in"])))
+                    sys.stdout.flush()
+                    continue
+                print("Current WAL position:\t", sample["lsn"])
+                print("Last archived WAL:\t", sample["last_archived_wal"] or '--')
+                print("Pending segments:\t", sample["pending_segments"])
+                print("Archive lag:\t\t", self.size_pretty(sample["lag_bytes"]) + ",", duration(sample["lag_seconds"]))
+                print("Archiving rate:\t\t", rate, "({} segments in {})".format(sample["archived_segments"],
+                                                                              duration(window)))
+                print("Failed to archive:\t", sample["failed_count"], sample["last_failed_wal"]
+                      and "(last: {})".format(sample["last_failed_wal"]) or '')
+                print("Space available:\t", self.size_pretty(sample["space_free"]))
+                print("Space exhausted in:\t", duration(sample["space_exhausted_in"]))
+
+        fields = ["time", "lsn", "last_archived_wal", "pending_segments", "lag_bytes", "lag_seconds", "archived_count",
+                  "failed_count", "last_failed_wal", "archived_segments", "archive_rate", "stored_rate", "wal_rate",
+                  "space_free", "space_exhausted_in"]
+        row_format = "{:<8} {:>17} {:>8} {:>11} {:>11} {:>13} {:>13} {:>6} {:>13}"
+        if interval and self.output.FORMAT == "text":
+            print(row_format.format("Time", "LSN", "Pending", "Lag", "Lag time", "Archiving", "WAL writes",
+                                    "Failed", "Full in"))
+
+        previous: typing.Optional[typing.Dict[str, typing.Any]] = None
+        taken = 0
+        try:
+            while True:
+                sample = self._get_archive_sample(backup_dst, window)
+                if previous is not None and sample["time"] > previous["time"]:
+                    sample["wal_rate"] = max(0, self.get_lsn_position(sample["lsn"])
+                                             - self.get_lsn_position(previous["lsn"])) / (sample["time"] - previous["time"])
+                self.output.report("backup-lag", fields, [[sample[field] for field in fields]], text=text)
+                previous = sample
+                taken += 1
+                if count and taken >= count:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            if self.output.FORMAT == "text":
+                print()
 
     def do_backup_status(self, *opts: str, **args: str) -> typing.Tuple[str, bool]:  # pylint: disable=W0613
         """
@@ -920,35 +2655,38 @@ class PgSQLGate(BaseGate):
                 break
 
         backup_last_transaction: float = 0.
-        if backup_dst:
-            for fname in os.listdir(backup_dst):
-                mtime = os.path.getmtime(backup_dst + "/" + fname)
-                if mtime > backup_last_transaction:
-                    backup_last_transaction = mtime
+        if backup_on:
+            catalog = BackupCatalog(backup_dst)
+            backup_last_transaction = catalog.get_last_archived()
+            catalog.close()
 
         space_usage = None
-        if backup_dst:
-            partition = self._get_partition(backup_dst)
-            for line in os.popen("df -T").readlines()[1:]:
-                line = line.strip()
-                if not line.startswith(partition):
-                    continue
-                space_usage = (list(filter(None, line.split(' ')))[5] + '').replace('%', '')
+        if backup_dst and os.path.exists(backup_dst):
+            space_usage = get_used_percent(get_usage(backup_dst))
 
         if '--silent' not in opts:
-            print("Backup status:\t\t", (backup_on and 'ON' or 'OFF'))
-            print("Destination:\t\t", (backup_dst or '--'))
-            print("Last transaction:\t", backup_last_transaction and time.ctime(backup_last_transaction) or '--')
-            print("Space available:\t", space_usage and str((100 - int(space_usage))) + '%' or '--')
+            def text(records: typing.Iterable[typing.Sequence[typing.Any]]) -> None:
+                for _, _, _, _, streaming in records:
+                    print("Backup status:\t\t", (backup_on and 'ON' or 'OFF'))
+                    print("Destination:\t\t", (backup_dst or '--'))
+                    print("Last transaction:\t", backup_last_transaction and time.ctime(backup_last_transaction) or '--')
+                    print("Space available:\t", space_usage is not None and str(100 - space_usage) + '%' or '--')
+                    if streaming is not None:
+                        print("WAL streaming:\t\t", streaming and 'running' or 'stopped')
+
+            self.output.report("backup-status", ["enabled", "destination", "last_archived", "space_available", "streaming"],
+                               [(backup_on, backup_dst or None, backup_last_transaction or None,
+                                 100 - space_usage if space_usage is not None else None,
+                                 bool(get_receiver_pid(backup_dst)) if '--stream' in cmd else None)], text=text)
 
         return backup_dst, backup_on
 
     @staticmethod
     def _get_partition_size(path: str) -> int:
         """
-        Get a size of the partition, where path belongs to.
+        Get space, available on the partition, where path belongs to.
         """
-        return int((list(filter(None, (os.popen("df -TB1 %s" % path).readlines()[-1] + '').split(' ')))[4] + '').strip())
+        return get_usage(path)['free']
 
     def do_system_check(self, *args: str, **params: str) -> bool:
         """
@@ -968,7 +2706,7 @@ class PgSQLGate(BaseGate):
         # Setup postgresql.conf
         #
 
-        pg_version = os.popen('/usr/bin/postgres --version').read().strip().split(' ')[-1].split('.')
+        pg_version = self._get_pg_version()
 
         # Built-in tuner
         conn_lowest = 200
@@ -1000,7 +2738,7 @@ class PgSQLGate(BaseGate):
         # WAL keep segments / keep size must be non-zero
         # wal_keep_segments option is for postgresql < 13
         # wal_keep_segments is subtituted by wal_keep_size in postgresql 13
-        if int(pg_version[0]) <= 12:
+        if pg_version < [13]:
             if conf.get('wal_keep_segments', '0') == '0':
                 conf['wal_keep_segments'] = 64
                 changed = True
@@ -11,16 +11,110 @@ import typing
 
 class Roller(threading.Thread):
     """
-    Roller of some fun sequences while waiting.
+    Roller of some fun sequences while waiting, showing the progress, if it is fed.
+
+    Progress is reported by the running pipeline with "update" or sampled with
+    the "probe" function. Nothing but the final message is written, if the output
+    is not a terminal. Stopping the roller waits until its line is finished.
     """
 
-    def __init__(self) -> None:
-        threading.Thread.__init__(self)
+    UNITS = {"bytes": None, "files": "files", "segments": "segments"}
+
+    def __init__(self, total: typing.Optional[int] = None, unit: str = "bytes",
+                 probe: typing.Optional[typing.Callable[[], int]] = None,
+                 output: typing.Optional[typing.TextIO] = None) -> None:
+        """
+        Roller.
+
+        :param total: expected amount of work, if known
+        :param unit: unit of the work: bytes, files or segments
+        :param probe: function returning the amount of done work, sampled on each redraw
+        :param output: output stream, STDOUT by default
+        """
+        threading.Thread.__init__(self, daemon=True)
+        if unit not in self.UNITS:
+            raise ValueError("Unknown unit \"{}\"".format(unit))
         self.__sequence = ['-', '\\', '|', '/', ]
         self.__freq = .1
         self.__offset = 0
-        self.__running = False
+        self.__output = output or sys.stdout
+        self.__tty = hasattr(self.__output, "isatty") and self.__output.isatty()
+        self.__wakeup = threading.Event()
+        self.__lock = threading.Lock()
+        self.__stopped = False
         self.__message: typing.Optional[str] = None
+        self.__shown = 0
+        self.__drawn = 0.
+        self.__started = time.time()
+        self.__done = 0
+        self.__total = total
+        self.__unit = unit
+        self.__probe = probe
+
+    @staticmethod
+    def _pretty(size: float) -> str:
+        """
+        Make short pretty size from bytes.
+        """
+        for name, order in [("TB", 0x10000000000), ("GB", 0x40000000), ("MB", 0x100000), ("KB", 0x400)]:
+            if size >= order:
+                return "%.1f%s" % (size / order, name)
+        return "%dB" % size
+
+    def _amount(self, amount: float) -> str:
+        """
+        Format the amount of work in its units.
+        """
+        return self._pretty(amount) if self.UNITS[self.__unit] is None else "%d" % amount
+
+    def get_status(self) -> str:
+        """
+        Get current progress: done work, percentage, throughput and ETA.
+
+        :return: progress line or empty string, if nothing is done yet
+        """
+        done, total = self.__done, self.__total
+        if not done:
+            return ""
+
+        elapsed = max(time.time() - self.__started, 0.001)
+        rate = done / elapsed
+        status = [self._amount(done) if total is None else "{}/{}".format(self._amount(done), self._amount(total))]
+        if self.UNITS[self.__unit] is not None:
+            status.append(self.__unit)
+        if total:
+            status.append("%d%%" % min(100, done * 100 // total))
+        status.append("{}/s".format(self._amount(rate)))
+        if total and total > done:
+            eta = int((total - done) / rate)
+            status.append("ETA %d:%02d:%02d" % (eta // 3600, eta // 60 % 60, eta % 60))
+
+        return " ".join(status)
+
+    def update(self, advance: int = 0, done: typing.Optional[int] = None, total: typing.Optional[int] = None) -> None:
+        """
+        Report the progress. Safe to call from any thread, redraws are throttled.
+
+        :param advance: amount of work, done since the last update
+        :param done: total amount of done work
+        :param total: expected amount of work
+        """
+        with self.__lock:
+            self.__done = self.__done + advance if done is None else done
+            if total is not None:
+                self.__total = total
+        if time.time() - self.__drawn >= self.__freq:
+            self.__wakeup.set()
+
+    def _draw(self, text: str) -> None:
+        """
+        Replace the shown text with the new one.
+        """
+        self.__output.write("\b" * self.__shown + text + " " * max(0, self.__shown - len(text))
+                            + "\b" * max(0, self.__shown - len(text)))
+        self.__output.flush()
+        self.__shown = len(text)
+        self.__drawn = time.time()
 
     def run(self) -> None:
         """
@@ -28,39 +122,42 @@ class Roller(threading.Thread):
 
         :return: None
         """
-        self.__running = True
-        while self.__running:
-            if self.__offset > len(self.__sequence) - 1:
-                self.__offset = 0
-
-            sys.stdout.write("\b" + self.__sequence[self.__offset])
-            sys.stdout.flush()
-            time.sleep(self.__freq)
+        while not self.__stopped:
+            if self.__probe is not None:
+                try:
+                    self.update(done=self.__probe())
+                except OSError:
+                    pass
+            if self.__tty:
+                if self.__offset > len(self.__sequence) - 1:
+                    self.__offset = 0
+                status = self.get_status()
+                self._draw(self.__sequence[self.__offset] + (status and " " + status))
+                self.__offset += 1
+            self.__wakeup.wait(self.__freq)
+            self.__wakeup.clear()
 
-            self.__offset += 1
-
-        print("\b" + (self.__message or ""))
-        sys.stdout.flush()
+        if self.__tty:
+            self._draw("")
+        print(self.__message or "", file=self.__output)
+        self.__output.flush()
 
     def stop(self, message: typing.Optional[str] = None) -> None:
         """
-        Stop roller.
+        Stop roller and wait until its line is finished. Stopped roller stays silent.
 
         :param message: Message for the roller.
         :return: None
         """
+        if self.__stopped:
+            return
         self.__message = message if message else "  "
-        self.__running = False
+        self.__stopped = True
         self.__offset = 0
-
-
-# if __name__ == '__main__':
-#     print("Doing thing:\t", end="")
-#     sys.stdout.flush()
-#
-#     roller = Roller()
-#     roller.start()
-#     time.sleep(5)
-#     roller.stop("finished")
-#     time.sleep(1)
-#     print("OK")
+        self.__wakeup.set()
+        if self.is_alive():
+            self.join()
+        else:
+            # Not started, the message is not lost
+            print(self.__message or "", file=self.__output)
+            self.__output.flush()
@@ -3,76 +3,105 @@
 General utils
 """
 
+import io
 import os
+import re
 import sys
 import grp
 import pwd
+import json
 import typing
+import tempfile
+
+# Versions of the binaries, probed by this process
+PROBES: typing.Dict[str, typing.List[int]] = {}
+PROBE_CACHE = "/var/cache/smdba/probes.json"
 
 
 class TablePrint:
     """
     Print table on the CLI.
+
+    Cells are converted to text once. Column widths are taken from the header and
+    the first "sample" rows, so the rest of the rows is written as it comes and is
+    never held in memory. Longer cells of these rows are truncated.
     """
 
-    def __init__(self, table: typing.List[typing.List[str]]) -> None:
+    TRUNCATED = "~"
+
+    def __init__(self, table: typing.Iterable[typing.Sequence[typing.Any]], sample: typing.Optional[int] = None,
+                 limit: typing.Optional[int] = None, offset: int = 0) -> None:
         """
         Table is [(1,2,3,), (4,5,6,),] etc data.
+
+        :param table: header and rows, any iterable
+        :param sample: number of rows to measure column widths, all rows by default
+        :param limit: print at most this number of rows
+        :param offset: skip this number of rows
         """
         self.table = table
+        self.sample = sample
+        self.limit = limit
+        self.offset = offset
         self.widths: typing.List[int] = []
 
-    def _check(self) -> None:
+    def _get_rows(self) -> typing.Iterator[typing.List[str]]:
         """
-        Check if table is consistent grid.
+        Get rows of the page as text, checking the table is consistent grid.
         Header is a leader here.
         """
-        if not self.table:
-            raise Exception("Table is empty!")
-
         header = None
-        for row in self.table:
+        shown = 0
+        for idx, row in enumerate(self.table):
             if header is None:
                 header = len(row)
-                continue
-            if len(row) != header:
+            elif len(row) != header:
                 raise Exception("Table has different row widths.")
+            elif idx <= self.offset:
+                continue
+            else:
+                shown += 1
+            yield [str(cell) for cell in row]
+            if self.limit is not None and shown >= self.limit:
+                break
+
+        if header is None:
+            raise Exception("Table is empty!")
 
-    def _get_widths(self) -> None:
+    def _format(self, row: typing.List[str]) -> str:
         """
-        Find extra-widths by max width of any value.
+        Format the row.
         """
+        cells = []
+        for idx, cell in enumerate(row):
+            if len(cell) > self.widths[idx]:
+                cell = cell[:max(self.widths[idx] - len(self.TRUNCATED), 0)] + self.TRUNCATED
+            cells.append(cell + (" " * (self.widths[idx] - len(cell))))
 
-        self.widths = [0 for _ in self.table[0]]
-        for row in self.table:
-            for idx, cell in enumerate(row):
-                cell_len = len(str(cell))
-                if cell_len > self.widths[idx]:
-                    self.widths[idx] = cell_len
+        return ' | '.join(cells)
 
-    def _format(self) -> str:
+    def write(self, stream: typing.TextIO) -> None:
         """
-        Format the output.
-        """
-        out = []
-        ftable = []
-        for row in self.table:
-            frow = []
-            for idx, cell in enumerate(row):
-                frow.append(str(cell) + (" " * (self.widths[idx] - len(str(cell)))))
-            ftable.append(frow)
-
-        for idx, row in enumerate(ftable):
-            out.append(' | '.join(row))
-            if not idx:
-                out.append('-+-'.join(["-" * len(item) for item in row]))
+        Write table to the stream.
 
-        return '\n'.join(out)
+        :param stream: output stream
+        """
+        rows = self._get_rows()
+        measured = [next(rows)]
+        measured += list(rows) if self.sample is None else [row for _, row in zip(range(self.sample), rows)]
+        self.widths = [max(len(row[idx]) for row in measured) for idx in range(len(measured[0]))]
+
+        stream.write(self._format(measured[0]) + "\n")
+        stream.write('-+-'.join(["-" * width for width in self.widths]))
+        for row in measured[1:]:
+            stream.write("\n" + self._format(row))
+        for row in rows:
+            stream.write("\n" + self._format(row))
 
     def __str__(self) -> str:
-        self._check()
-        self._get_widths()
-        return self._format()
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
 
 
 def create_dirs(path: str, owner: str, mode: int = 0o700) -> bool:
@@ -125,3 +154,50 @@ def eprint(*args: typing.Any, **kwargs: typing.Any) -> None:
     :return: None
     """
     print(*args, file=sys.stderr, **kwargs)
+
+
+def get_binary_version(binary: str) -> typing.List[int]:
+    """
+    Get version of the binary from its "--version" output.
+    Probes are cached for the process and, when running as root, on disk
+    until the binary is modified.
+
+    :param binary: path to the binary
+    :returns: version numbers, empty if the version is unknown
+    """
+    if binary in PROBES:
+        return list(PROBES[binary])
+
+    try:
+        mtime: typing.Optional[float] = os.stat(binary).st_mtime
+    except OSError:
+        mtime = None
+
+    cache: typing.Dict[str, typing.Any] = {}
+    if mtime is not None and os.path.exists(PROBE_CACHE):
+        try:
+            with open(PROBE_CACHE) as cfh:
+                cache = json.load(cfh)
+        except (OSError, ValueError):
+            cache = {}
+
+    entry = cache.get(binary) or {}
+    if mtime is not None and entry.get("mtime") == mtime:
+        version = list(entry.get("version", []))
+    else:
+        output = os.popen(binary + " --version").read().strip()
+        version = [int(v_el) for v_el in re.findall(r"\d+", output.split(" ")[-1])] if output else []
+        if mtime is not None and version and os.geteuid() == 0:
+            cache[binary] = {"mtime": mtime, "version": version}
+            try:
+                os.makedirs(os.path.dirname(PROBE_CACHE), exist_ok=True)
+                handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(PROBE_CACHE))
+                with os.fdopen(handle, "w") as cfh:
+                    json.dump(cache, cfh)
+                os.chmod(temp_path, 0o644)
+                os.rename(temp_path, PROBE_CACHE)
+            except OSError:
+                pass  # Cache is optional
+
+    PROBES[binary] = version
+    return list(version)
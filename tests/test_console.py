@@ -0,0 +1,91 @@
+# coding: utf-8
+"""
+Unit tests for the console.
+"""
+import io
+import os
+import json
+import sys
+import importlib.util
+import importlib.machinery
+from unittest.mock import MagicMock
+import smdba.basegate
+
+_loader = importlib.machinery.SourceFileLoader(
+    "smdba_console", os.path.join(os.path.dirname(smdba.basegate.__file__), "smdba"))
+_spec = importlib.util.spec_from_loader("smdba_console", _loader)
+console_module = importlib.util.module_from_spec(_spec)
+_loader.exec_module(console_module)
+
+
+class TestConsole:
+    """
+    Test suite for console.
+    """
+
+    @staticmethod
+    def _get_console():
+        """
+        Get console with a fake gate.
+        """
+        console = console_module.Console.__new__(console_module.Console)
+        console.console_location = "/usr/bin/smdba"
+        console.gate = MagicMock()
+        console.gate.get_gate_commands = MagicMock(return_value={"do_db_status": {"description": "Status"},
+                                                                    "do_backup_status": {"description": "Backup"}})
+        console.gate.do_backup_status = MagicMock(side_effect=smdba.basegate.GateException("No backup"))
+
+        return console
+
+    def test_execute_batch(self, capsys):
+        """
+        Batch commands share one startup and report their own exit codes.
+
+        :return:
+        """
+        console = self._get_console()
+        code = console.execute_batch(io.StringIO("# Monitoring\ndb-status\n\nbackup-status --silent\ndb-status 'a b'\n"))
+
+        assert code == 1
+        assert console.gate.startup.call_count == 1
+        assert console.gate.finish.call_count == 1
+        console.gate.close_sessions.assert_called_once_with(reopen=False)
+        console.gate.do_db_status.assert_called_with("a b", __console_location="/usr/bin/smdba")
+        out, err = capsys.readouterr()
+        assert "[2/3] backup-status --silent" in err
+        assert "backup-status --silent | 1" in err
+        assert "db-status              | 0" in err
+
+    def test_execute_batch_unknown(self):
+        """
+        Nothing runs, if some command is unknown.
+
+        :return:
+        """
+        console = self._get_console()
+        try:
+            console.execute_batch(io.StringIO("db-status\nno-such-command\n"))
+        except Exception as ex:
+            assert "unknown command" in str(ex)
+        else:
+            raise AssertionError("Unknown command is accepted")
+        assert not console.gate.startup.called
+
+    def test_run_command_json(self, capsys):
+        """
+        Reports are written as JSON records, other printed lines become messages.
+
+        :return:
+        """
+        console = self._get_console()
+
+        def db_status(*args, **params):
+            print("Checking database core...\t", end="")
+            console.gate.output.report("db-status", ["online"], [(True,)], text=print)
+
+        console.gate.do_db_status = db_status
+        console.run_command("db-status", "do_db_status", [], {"format": "ndjson"})
+        out, _ = capsys.readouterr()
+        assert [json.loads(line) for line in out.strip().split("\n")] == [
+            {"report": "db-status", "online": True},
+            {"command": "db-status", "status": "ok", "error": None, "messages": ["Checking database core..."]}]
@@ -0,0 +1,107 @@
+# coding: utf-8
+"""
+Unit tests for the filesystem accounting.
+"""
+import os
+from unittest.mock import MagicMock, patch
+import smdba.filesystem
+
+
+MOUNTINFO = """\
+22 1 8:2 / / rw,relatime shared:1 - ext4 /dev/sda2 rw
+41 22 8:3 / /var/lib/pgsql rw,relatime shared:20 master:1 - xfs /dev/sda3 rw,attr2
+42 22 8:4 / /mnt/my\\040backup rw,relatime - ext4 /dev/sdb1 rw
+43 41 8:5 / /var/lib/pgsql rw,relatime - xfs /dev/sdc1 rw
+"""
+
+
+class TestFilesystem:
+    """
+    Test suite for filesystem accounting.
+    """
+
+    def test_get_mounts(self, tmpdir):
+        """
+        Mounts are parsed with optional fields and escaped mount points.
+
+        :return:
+        """
+        mountinfo = tmpdir.join("mountinfo")
+        mountinfo.write(MOUNTINFO)
+        mounts = smdba.filesystem.get_mounts(str(mountinfo))
+        assert [(mnt.device, mnt.mountpoint, mnt.fstype, mnt.source) for mnt in mounts[:3]] == [
+            ("8:2", "/", "ext4", "/dev/sda2"),
+            ("8:3", "/var/lib/pgsql", "xfs", "/dev/sda3"),
+            ("8:4", "/mnt/my backup", "ext4", "/dev/sdb1"),
+        ]
+
+    def test_get_mount(self, tmpdir):
+        """
+        The deepest and the latest mount is found for the path.
+
+        :return:
+        """
+        mountinfo = tmpdir.join("mountinfo")
+        mountinfo.write(MOUNTINFO)
+        with patch("os.path.realpath", lambda path: path):
+            assert smdba.filesystem.get_mount("/var/lib/pgsql/data", str(mountinfo)).source == "/dev/sdc1"
+            assert smdba.filesystem.get_mount("/mnt/my backup", str(mountinfo)).source == "/dev/sdb1"
+            assert smdba.filesystem.get_mount("/var/lib/pgsqlx", str(mountinfo)).source == "/dev/sda2"
+
+    def test_used_percent(self):
+        """
+        Used space is rounded up to the space, available to non-root users.
+
+        :return:
+        """
+        assert smdba.filesystem.get_used_percent({"total": 100, "used": 41, "free": 58}) == 42
+        assert smdba.filesystem.get_used_percent({"total": 0, "used": 0, "free": 0}) == 0
+
+    def test_get_tree_size(self, tmpdir):
+        """
+        Tree size counts files and directories, hard links once, symbolic links are not followed.
+
+        :return:
+        """
+        tmpdir.join("a").write("x" * 100)
+        tmpdir.mkdir("sub").mkdir("deep").join("b").write("x" * 10)
+        os.link(str(tmpdir.join("a")), str(tmpdir.join("sub", "a-link")))
+        os.symlink("/usr", str(tmpdir.join("usr")))
+
+        dirs = [str(tmpdir), str(tmpdir.join("sub")), str(tmpdir.join("sub", "deep"))]
+        expected = 110 + os.lstat(str(tmpdir.join("usr"))).st_size + sum(os.lstat(path).st_size for path in dirs)
+        assert smdba.filesystem.get_tree_size(str(tmpdir), threads=2) == expected
+
+    def test_get_tree_size_cached(self, tmpdir):
+        """
+        Unchanged directories are taken from the size index.
+
+        :return:
+        """
+        tree = tmpdir.mkdir("tree")
+        tree.join("a").write("x" * 100)
+        cache = str(tmpdir.join("cache", "sizes.json"))
+        with patch("smdba.filesystem.SIZE_CACHE", cache), patch("os.geteuid", MagicMock(return_value=0)):
+            size = smdba.filesystem.get_tree_size(str(tree), cached=True)
+            assert os.path.exists(cache)
+
+            # Not read again: grown in place, the directory is the same
+            tree.join("a").write("x" * 200)
+            assert smdba.filesystem.get_tree_size(str(tree), cached=True) == size
+            assert smdba.filesystem.get_tree_size(str(tree)) == size + 100
+
+    def test_get_tree_size_volatile(self, tmpdir):
+        """
+        Files, growing in place, are not taken from the size index.
+
+        :return:
+        """
+        tree = tmpdir.mkdir("tree")
+        tree.join("a").write("x" * 100)
+        tree.join("000000010000000000000003.partial").write("x" * 10)
+        cache = str(tmpdir.join("cache", "sizes.json"))
+        with patch("smdba.filesystem.SIZE_CACHE", cache), patch("os.geteuid", MagicMock(return_value=0)):
+            size = smdba.filesystem.get_tree_size(str(tree), cached=True, volatile=["*.partial"])
+            tree.join("000000010000000000000003.partial").write("x" * 50)
+            assert smdba.filesystem.get_tree_size(str(tree), cached=True, volatile=["*.partial"]) == size + 40
+            assert smdba.filesystem.get_tree_size(str(tree), cached=True, volatile=["*.partial"]) == size + 40
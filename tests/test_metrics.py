@@ -0,0 +1,64 @@
+# coding: utf-8
+"""
+Unit tests for the metrics.
+"""
+from unittest.mock import MagicMock, patch
+import pytest
+import smdba.metrics
+
+
+class TestMetrics:
+    """
+    Test suite for metrics.
+    """
+
+    def test_render(self):
+        """
+        Metric is rendered in Prometheus text format with escaped labels.
+
+        :return:
+        """
+        metric = smdba.metrics.Metric("smdba_database_size_bytes", "Size of the database.")
+        metric.add(1024, database='my "db"').add(True, database="postgres")
+
+        assert metric.render() == "\n".join([
+            "# HELP smdba_database_size_bytes Size of the database.",
+            "# TYPE smdba_database_size_bytes gauge",
+            'smdba_database_size_bytes{database="my \\"db\\""} 1024.0',
+            'smdba_database_size_bytes{database="postgres"} 1.0'])
+
+    def test_collector_ttl(self):
+        """
+        Metrics are collected again only after the TTL expired, failures are reported.
+
+        :return:
+        """
+        collect = MagicMock(return_value=[smdba.metrics.Metric("smdba_database_up", "Up.").add(1)])
+        failing = MagicMock(side_effect=OSError("No space"))
+        registry = smdba.metrics.MetricsRegistry([smdba.metrics.Collector("status", 5, collect),
+                                                  smdba.metrics.Collector("backup", 30, failing)])
+
+        with patch("smdba.metrics.time.time", MagicMock(return_value=1000.)):
+            text = registry.render()
+            registry.render()
+        assert collect.call_count == 1
+        assert "smdba_database_up 1.0" in text
+        assert 'smdba_collector_success{collector="status"} 1.0' in text
+        assert 'smdba_collector_success{collector="backup"} 0.0' in text
+
+        with patch("smdba.metrics.time.time", MagicMock(return_value=1010.)):
+            registry.render()
+        assert collect.call_count == 2
+        assert failing.call_count == 1
+
+    def test_get_listen_address(self):
+        """
+        Address is optional, port is required.
+
+        :return:
+        """
+        assert smdba.metrics.get_listen_address("9187") == ("", 9187)
+        assert smdba.metrics.get_listen_address("127.0.0.1:9187") == ("127.0.0.1", 9187)
+        assert smdba.metrics.get_listen_address("[::1]:9187") == ("::1", 9187)
+        with pytest.raises(ValueError):
+            smdba.metrics.get_listen_address("localhost")
@@ -0,0 +1,44 @@
+# coding: utf-8
+"""
+Unit tests for the Oracle gate.
+"""
+from unittest.mock import MagicMock
+import smdba.oraclegate
+import smdba.basegate
+
+
+class TestOracleGate:
+    """
+    Test suite for Oracle gate.
+    """
+
+    def test_check_backup_info(self):
+        """
+        Lines without complete piece information are skipped, the status is kept for the next line.
+
+        :return:
+        """
+        outputs = {
+            "rman-backup-check-db": [
+                "crosschecked backup piece: found to be 'AVAILABLE'",
+                "backup piece handle=/backup/piece-1",
+                "RECID=1 STAMP=100",
+                "crosschecked backup piece: found to be 'EXPIRED'",
+                "backup piece handle=/backup/piece-2 RECID=2 STAMP=200",
+            ],
+            "rman-backup-check-al": [
+                "validation succeeded for archived log",
+                "archived log file name=/archive/log-1 RECID=3 STAMP=300",
+                "validation failed for archived log",
+                "",
+                "archived log file name=/archive/log-2 RECID=4 STAMP=400",
+            ],
+        }
+        gate = MagicMock()
+        gate.stream_scenario = lambda name, target: smdba.basegate.ScenarioStream(outputs[name])
+
+        healthy, failed, healthy_logs, failed_logs = smdba.oraclegate.OracleGate.check_backup_info(gate)
+        assert healthy == []
+        assert [(hinfo.handle, hinfo.recid) for hinfo in failed] == [("/backup/piece-2", "2")]
+        assert [(hinfo.handle, hinfo.stamp) for hinfo in healthy_logs] == [("/archive/log-1", "300")]
+        assert [(hinfo.handle, hinfo.stamp) for hinfo in failed_logs] == [("/archive/log-2", "400")]
@@ -0,0 +1,73 @@
+# coding: utf-8
+"""
+Unit tests for the command output.
+"""
+import io
+import json
+import pytest
+import smdba.output
+
+
+class TestOutput:
+    """
+    Test suite for output formats.
+    """
+
+    def test_text(self):
+        """
+        Text output renders records by the command.
+
+        :return:
+        """
+        rendered = []
+        output = smdba.output.get_output("text", io.StringIO())
+        output.report("space-tables", ["table", "size"], iter([("rhnpackage", 10)]), text=lambda rows: rendered.extend(rows))
+        output.finish("space-tables")
+
+        assert rendered == [("rhnpackage", 10)]
+        assert output.stream.getvalue() == ""
+
+    def test_json(self):
+        """
+        JSON output is one document with all reports.
+
+        :return:
+        """
+        output = smdba.output.get_output("json", io.StringIO())
+        output.report("space-tables", ["table", "size"], iter([("rhnpackage", 10), ("rhnchannel", 5)]))
+        assert output.stream.getvalue() == ""
+        output.finish("space-tables", messages=["done"])
+
+        assert json.loads(output.stream.getvalue()) == {
+            "command": "space-tables", "status": "ok", "error": None, "messages": ["done"],
+            "reports": {"space-tables": [{"table": "rhnpackage", "size": 10}, {"table": "rhnchannel", "size": 5}]}}
+
+    def test_ndjson_streams(self):
+        """
+        NDJSON output writes each record as soon as it is produced.
+
+        :return:
+        """
+        stream = io.StringIO()
+        output = smdba.output.get_output("ndjson", stream)
+
+        def records():
+            yield "rhnpackage", 10
+            assert stream.getvalue().count("\n") == 1
+            yield "rhnchannel", 5
+
+        output.report("space-tables", ["table", "size"], records())
+        output.finish("space-tables", error="Database is not running!")
+        lines = [json.loads(line) for line in stream.getvalue().strip().split("\n")]
+
+        assert lines[1] == {"report": "space-tables", "table": "rhnchannel", "size": 5}
+        assert lines[2]["status"] == "error"
+
+    def test_unknown_format(self):
+        """
+        Unknown format is refused.
+
+        :return:
+        """
+        with pytest.raises(ValueError):
+            smdba.output.get_output("xml")
@@ -0,0 +1,409 @@
+# coding: utf-8
+"""
+Unit tests for the WAL archiver.
+"""
+import os
+import hashlib
+import time
+import threading
+from unittest.mock import MagicMock, patch
+import pytest
+import smdba.pgarchive
+
+
+class TestPgArchive:
+    """
+    Test suite for WAL archiver.
+    """
+
+    @staticmethod
+    def _segment(path, size=0x10000):
+        """
+        Create fake WAL segment.
+        """
+        data = os.urandom(size)
+        with open(path, "wb") as seg:
+            seg.write(data)
+        return hashlib.sha1(data).hexdigest()
+
+    def test_archive_segment(self, tmpdir):
+        """
+        Segment is copied with its checksum and metadata.
+
+        :return:
+        """
+        source = str(tmpdir.join("000000010000000000000001"))
+        destination = str(tmpdir.mkdir("archive").join("000000010000000000000001"))
+        checksum = self._segment(source)
+        os.utime(source, (1000000000, 1000000000))
+
+        assert smdba.pgarchive.archive_segment(source, destination, bufsize=0x1000) == checksum
+        assert open(destination, "rb").read() == open(source, "rb").read()
+        assert os.stat(destination).st_mtime == 1000000000
+        assert os.listdir(os.path.dirname(destination)) == ["000000010000000000000001"]
+
+    def test_archive_segment_refuse_overwrite(self, tmpdir):
+        """
+        Existing archived segment is never overwritten.
+
+        :return:
+        """
+        source = str(tmpdir.join("000000010000000000000001"))
+        destination = str(tmpdir.join("archived"))
+        self._segment(source)
+        with open(destination, "w") as dst:
+            dst.write("old")
+
+        with pytest.raises(smdba.pgarchive.ArchiveException) as exc:
+            smdba.pgarchive.archive_segment(source, destination)
+        assert "File already exists" in str(exc.value)
+        assert open(destination).read() == "old"
+
+    def test_archive_segment_no_destination(self, tmpdir):
+        """
+        Destination directory must exist.
+
+        :return:
+        """
+        source = str(tmpdir.join("000000010000000000000001"))
+        self._segment(source)
+        with pytest.raises(smdba.pgarchive.ArchiveException) as exc:
+            smdba.pgarchive.archive_segment(source, str(tmpdir.join("missing", "segment")))
+        assert "Destination directory does not exist" in str(exc.value)
+
+    def test_daemon_request(self, tmpdir):
+        """
+        Client hands off the segment to the daemon.
+
+        :return:
+        """
+        sock = str(tmpdir.join("archiver.sock"))
+        server = smdba.pgarchive.PgArchiver(sock)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            source = str(tmpdir.join("000000010000000000000002"))
+            destination = str(tmpdir.mkdir("archive").join("000000010000000000000002"))
+            checksum = self._segment(source)
+
+            assert smdba.pgarchive.request_archive(source, destination, path=sock) == checksum
+            with pytest.raises(smdba.pgarchive.ArchiveException):
+                smdba.pgarchive.request_archive(source, destination, path=sock)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        assert not os.path.exists(sock)
+
+    def test_no_daemon(self, tmpdir):
+        """
+        Client reports missing daemon, so the segment is copied in place.
+
+        :return:
+        """
+        assert smdba.pgarchive.request_archive("/src", "/dst", path=str(tmpdir.join("none.sock"))) is None
+
+    def test_daemon_fallback(self, tmpdir):
+        """
+        Archive command hands off to the running daemon and archives by itself, when the daemon is down.
+
+        :return:
+        """
+        sock = str(tmpdir.join("archiver.sock"))
+        archive = tmpdir.mkdir("archive")
+        names = ["00000001000000000000000{}".format(idx) for idx in range(1, 4)]
+        for name in names:
+            self._segment(str(tmpdir.join(name)))
+
+        def archive_command(name):
+            return smdba.pgarchive.main(["--socket", sock, "--source", str(tmpdir.join(name)),
+                                         "--destination", str(archive.join(name))])
+
+        server = smdba.pgarchive.PgArchiver(sock)
+        server.archive = MagicMock(wraps=server.archive)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            assert smdba.pgarchive.get_archiver_pid(sock) == os.getpid()
+            assert archive_command(names[0]) == 0
+            assert server.archive.call_count == 1
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        assert smdba.pgarchive.get_archiver_pid(sock) is None
+
+        # Daemon is stopped
+        assert archive_command(names[1]) == 0
+
+        # Daemon died and left its socket
+        dead = smdba.pgarchive.socket.socket(smdba.pgarchive.socket.AF_UNIX, smdba.pgarchive.socket.SOCK_STREAM)
+        dead.bind(sock)
+        dead.close()
+        assert archive_command(names[2]) == 0
+
+        assert server.archive.call_count == 1
+        for name in names:
+            assert smdba.pgarchive.file_checksum(str(archive.join(name))) == \
+                smdba.pgarchive.file_checksum(str(tmpdir.join(name)))
+
+    def test_parallel_read_ahead(self, tmpdir):
+        """
+        Ready segments are archived ahead, each request is acknowledged once durable.
+
+        :return:
+        """
+        wal = tmpdir.mkdir("pg_wal")
+        status = wal.mkdir("archive_status")
+        archive = tmpdir.mkdir("archive")
+        names = ["00000001000000000000000{}".format(idx) for idx in range(1, 5)]
+        checksums = {}
+        for name in names:
+            checksums[name] = self._segment(str(wal.join(name)))
+            status.join(name + ".ready").write("")
+
+        server = smdba.pgarchive.PgArchiver(str(tmpdir.join("archiver.sock")), workers=3)
+        try:
+            for name in names:
+                assert server.archive(str(wal.join(name)), str(archive.join(name))) == checksums[name]
+                assert open(str(archive.join(name)), "rb").read() == open(str(wal.join(name)), "rb").read()
+            assert not server._jobs
+        finally:
+            server.server_close()
+
+    def test_read_ahead_expired(self, tmpdir):
+        """
+        Segments, archived ahead but never requested, are dropped after the window.
+
+        :return:
+        """
+        wal = tmpdir.mkdir("pg_wal")
+        status = wal.mkdir("archive_status")
+        archive = tmpdir.mkdir("archive")
+        names = ["00000001000000000000000{}".format(idx) for idx in range(1, 4)]
+        for name in names:
+            self._segment(str(wal.join(name)))
+            status.join(name + ".ready").write("")
+
+        server = smdba.pgarchive.PgArchiver(str(tmpdir.join("archiver.sock")), workers=2)
+        try:
+            server.archive(str(wal.join(names[0])), str(archive.join(names[0])))
+            for _, job in list(server._jobs.values()):
+                job.result()
+            assert sorted(server._jobs) == [str(archive.join(name)) for name in names[1:]]
+
+            # Timeline switched, the segments are never requested
+            with patch("time.monotonic", MagicMock(return_value=time.monotonic() + 3600)):
+                server.archive(str(wal.join(names[0])), str(tmpdir.mkdir("other").join(names[0])))
+            assert not [name for name in server._jobs if name.startswith(str(archive))]
+        finally:
+            server.server_close()
+
+    def test_daemon_internal_error(self, tmpdir):
+        """
+        Unexpected error of the daemon is replied, so the connection is not dropped.
+
+        :return:
+        """
+        sock = str(tmpdir.join("archiver.sock"))
+        server = smdba.pgarchive.PgArchiver(sock)
+        server.archive = MagicMock(side_effect=[RuntimeError("Boom"), "0" * 40])
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            with pytest.raises(smdba.pgarchive.ArchiveException) as exc:
+                smdba.pgarchive.request_archive("/src", "/dst", path=sock)
+            assert "Boom" in str(exc.value)
+            assert smdba.pgarchive.request_archive("/src", "/dst", path=sock) == "0" * 40
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_accept_identical(self, tmpdir):
+        """
+        Segment, archived ahead before restart of the daemon, is accepted only if identical.
+
+        :return:
+        """
+        source = str(tmpdir.join("000000010000000000000001"))
+        destination = str(tmpdir.join("archived"))
+        checksum = self._segment(source)
+        smdba.pgarchive.archive_segment(source, destination)
+
+        assert smdba.pgarchive.archive_segment(source, destination, accept_identical=True) == checksum
+        self._segment(source)
+        with pytest.raises(smdba.pgarchive.ArchiveException):
+            smdba.pgarchive.archive_segment(source, destination, accept_identical=True)
+
+    @pytest.mark.parametrize("compression", ["gzip", "zstd"])
+    def test_compressed_roundtrip(self, tmpdir, compression):
+        """
+        Compressed segment has a header and is restored to the original.
+
+        :return:
+        """
+        if compression == "zstd" and smdba.pgarchive.zstandard is None:
+            pytest.skip("zstandard is not installed")
+        source = str(tmpdir.join("000000010000000000000001"))
+        archived = str(tmpdir.join("archived"))
+        restored = str(tmpdir.join("RECOVERYXLOG"))
+        with open(source, "wb") as seg:
+            seg.write(b"\0" * 0x10000 + os.urandom(0x100))
+        checksum = hashlib.sha1(open(source, "rb").read()).hexdigest()
+
+        assert smdba.pgarchive.archive_segment(source, archived, compression=compression, level=1) == checksum
+        assert os.path.getsize(archived) < os.path.getsize(source)
+        assert smdba.pgarchive.read_header(archived) == (smdba.pgarchive.CODECS[compression], 0x10100, checksum)
+        assert smdba.pgarchive.file_checksum(archived) == checksum
+
+        assert smdba.pgarchive.restore_segment(archived, restored, bufsize=0x1000) == checksum
+        assert open(restored, "rb").read() == open(source, "rb").read()
+
+    def test_restore_damaged(self, tmpdir):
+        """
+        Damaged compressed segment is not restored.
+
+        :return:
+        """
+        source = str(tmpdir.join("000000010000000000000001"))
+        archived = str(tmpdir.join("archived"))
+        self._segment(source)
+        smdba.pgarchive.archive_segment(source, archived, compression="gzip")
+        with open(archived, "r+b") as arc:
+            arc.seek(smdba.pgarchive.HEADER.size + 0x20)
+            arc.write(b"\xff" * 8)
+
+        with pytest.raises(smdba.pgarchive.ArchiveException):
+            smdba.pgarchive.restore_segment(archived, str(tmpdir.join("RECOVERYXLOG")))
+        assert not os.path.exists(str(tmpdir.join("RECOVERYXLOG")))
+
+    def test_restore_raw(self, tmpdir):
+        """
+        Uncompressed segment is restored as is.
+
+        :return:
+        """
+        source = str(tmpdir.join("000000010000000000000001"))
+        checksum = self._segment(source)
+        assert smdba.pgarchive.restore_segment(source, str(tmpdir.join("RECOVERYXLOG"))) == checksum
+        assert smdba.pgarchive.main(["--restore", "--source", str(tmpdir.join("missing")),
+                                     "--destination", str(tmpdir.join("RECOVERYXLOG2"))]) == 1
+
+    def test_restore_partial(self, tmpdir):
+        """
+        The latest segment is restored from the partially streamed file.
+
+        :return:
+        """
+        source = str(tmpdir.join("000000010000000000000001"))
+        checksum = self._segment(source + ".partial")
+
+        assert smdba.pgarchive.restore_segment(source, str(tmpdir.join("restored"))) == checksum
+
+    def test_stream_skips_received(self, tmpdir):
+        """
+        Segments, completed by the running receiver, are not archived again.
+
+        :return:
+        """
+        archive = tmpdir.mkdir("archive")
+        archive.join(smdba.pgarchive.WalReceiver.PIDFILE).write(str(os.getpid()))
+        for name in ["000000010000000000000001", "000000010000000000000001.00000028.backup"]:
+            self._segment(str(tmpdir.join(name)))
+        tmpdir.join("000000010000000000000001").copy(archive.join("000000010000000000000001"))
+        for name in ["000000010000000000000001", "000000010000000000000001.00000028.backup"]:
+            assert smdba.pgarchive.main(["--stream", "--source", str(tmpdir.join(name)),
+                                         "--destination", str(archive.join(name))]) == 0
+        assert smdba.pgarchive.read_header(str(archive.join("000000010000000000000001"))) is None
+
+        # Receiver has not completed the segment yet: it is archived
+        self._segment(str(tmpdir.join("000000010000000000000002")))
+        archive.join("000000010000000000000002.partial").write("x")
+        assert smdba.pgarchive.main(["--stream", "--source", str(tmpdir.join("000000010000000000000002")),
+                                     "--destination", str(archive.join("000000010000000000000002"))]) == 0
+        assert os.path.exists(str(archive.join("000000010000000000000002")))
+
+        # Receiver is down: everything is archived
+        archive.join(smdba.pgarchive.WalReceiver.PIDFILE).write("0x")
+        self._segment(str(tmpdir.join("000000010000000000000003")))
+        assert smdba.pgarchive.main(["--stream", "--source", str(tmpdir.join("000000010000000000000003")),
+                                     "--destination", str(archive.join("000000010000000000000003"))]) == 0
+        assert os.path.exists(str(archive.join("000000010000000000000003")))
+
+    def test_receiver_of_other_user(self, tmpdir):
+        """
+        Receiver PID, which cannot be signalled, is not running for us.
+
+        :return:
+        """
+        tmpdir.join(smdba.pgarchive.WalReceiver.PIDFILE).write("1")
+        with patch("os.kill", MagicMock(side_effect=PermissionError)):
+            assert smdba.pgarchive.get_receiver_pid(str(tmpdir)) is None
+
+    def test_restore_staged(self, tmpdir):
+        """
+        Prefetched segment is restored from the staging directory, otherwise from the archive.
+
+        :return:
+        """
+        staging = tmpdir.mkdir("staging")
+        archive = tmpdir.mkdir("archive")
+        staged = self._segment(str(staging.join("000000010000000000000001")))
+        archived = self._segment(str(archive.join("000000010000000000000002")))
+
+        for name, checksum in [("000000010000000000000001", staged), ("000000010000000000000002", archived)]:
+            assert smdba.pgarchive.main(["--restore", "--staging", str(staging), "--source", str(archive.join(name)),
+                                         "--destination", str(tmpdir.join("RECOVERYXLOG"))]) == 0
+            assert hashlib.sha1(open(str(tmpdir.join("RECOVERYXLOG")), "rb").read()).hexdigest() == checksum
+        assert not os.listdir(str(staging))
+
+    def test_get_next_segments(self):
+        """
+        Next segments continue in the next log file.
+
+        :return:
+        """
+        assert smdba.pgarchive.get_next_segments("0000000100000001000000FE", 3) == [
+            "0000000100000001000000FF", "000000010000000200000000", "000000010000000200000001"]
+        assert smdba.pgarchive.get_next_segments("000000010000000100000001", 2, segment_size=0x40000000) == [
+            "000000010000000100000002", "000000010000000100000003"]
+        assert smdba.pgarchive.get_next_segments("000000010000000100000003", 2, segment_size=0x40000000) == [
+            "000000010000000200000000", "000000010000000200000001"]
+        assert smdba.pgarchive.get_next_segments("00000002.history", 2) == []
+
+    def test_prefetch_segments(self, tmpdir):
+        """
+        Archived segments are prefetched decompressed, missing ones are skipped.
+
+        :return:
+        """
+        archive = tmpdir.mkdir("archive")
+        staging = tmpdir.mkdir("staging")
+        names = ["000000010000000000000002", "000000010000000000000003", "000000010000000000000004"]
+        checksums = {}
+        for name in names[:2]:
+            checksums[name] = self._segment(str(tmpdir.join(name)))
+            smdba.pgarchive.archive_segment(str(tmpdir.join(name)), str(archive.join(name)), compression="gzip")
+
+        assert smdba.pgarchive.prefetch_segments(str(archive), str(staging), names) == 2
+        for name in names[:2]:
+            assert hashlib.sha1(open(str(staging.join(name)), "rb").read()).hexdigest() == checksums[name]
+        assert smdba.pgarchive.prefetch_segments(str(archive), str(staging), names) == 0
+
+    def test_verify_segment(self, tmpdir):
+        """
+        Archived segment is verified in place against its size and checksum.
+
+        :return:
+        """
+        source = str(tmpdir.join("000000010000000000000001"))
+        checksum = self._segment(source)
+        smdba.pgarchive.archive_segment(source, str(tmpdir.join("archived")), compression="gzip")
+        size = os.path.getsize(source)
+
+        assert smdba.pgarchive.verify_segment(str(tmpdir.join("archived")), sha1=checksum, size=size) == checksum
+        with pytest.raises(smdba.pgarchive.ArchiveException):
+            smdba.pgarchive.verify_segment(str(tmpdir.join("archived")), size=size + 1)
+        with pytest.raises(smdba.pgarchive.ArchiveException):
+            smdba.pgarchive.verify_segment(str(tmpdir.join("archived")), sha1="0" * 40)
@@ -3,9 +3,15 @@
 Unit tests for essential functions in postgresql backup.
 """
 import os
+import time
+import io
+import json
+import hashlib
+import tarfile
 from unittest.mock import MagicMock, mock_open, patch
 import pytest
 import smdba.postgresqlgate
+import smdba.pgcatalog
 
 
 class TestPgBackup:
@@ -140,3 +146,236 @@ class TestPgBackup:
         args, kw = next(iter(os_system.call_args_list))
         assert kw == {}
         assert args[0] == "/usr/bin/pg_archivecleanup /some/target 0000000100000001000000AA.10000000.backup"
+
+    @patch("smdba.postgresqlgate.os.path.exists", MagicMock(side_effect=lambda path: path.endswith("base.tar.zst")))
+    def test_get_base_archive(self):
+        """
+        Test base backup archive detection of any compression.
+
+        :return:
+        """
+        assert smdba.postgresqlgate.PgBackup.get_base_archive("/backup") == "/backup/base.tar.zst"
+        assert smdba.postgresqlgate.PgBackup.get_base_archive("/backup", prefix="base-old") is None
+
+    @patch("smdba.postgresqlgate.os.path.exists", MagicMock(return_value=True))
+    def test_get_untar_command(self):
+        """
+        Test extraction command for the base backup archives.
+
+        :return:
+        """
+        cls = smdba.postgresqlgate.PgBackup
+        assert cls.get_untar_command("/b/base.tar.gz", "/t") == "/bin/tar -I /usr/bin/pigz -xf /b/base.tar.gz --directory=/t"
+        assert cls.get_untar_command("/b/base.tar.zst", "/t") == \
+            "/bin/tar -I '/usr/bin/zstd -d -T0' -xf /b/base.tar.zst --directory=/t"
+        assert cls.get_untar_command("/b/base.tar", "/t") == "/bin/tar -xf /b/base.tar --directory=/t"
+
+    @patch("smdba.postgresqlgate.os.path.exists", MagicMock(return_value=True))
+    def test_rst_get_tar_command(self):
+        """
+        Test archiving of the broken cluster, moved aside.
+
+        :return:
+        """
+        assert smdba.postgresqlgate.PgSQLGate._rst_get_tar_command(
+            "/d/data.old/x.tar.gz", "/d/data.broken-x", "/d/data") == \
+            "/bin/tar -I /usr/bin/pigz -cPf /d/data.old/x.tar.gz --transform 's,^/d/data.broken-x,/d/data,' /d/data.broken-x"
+        assert smdba.postgresqlgate.PgSQLGate._rst_get_tar_command("/a.tar.gz", "/d/data", "/d/data") == \
+            "/bin/tar -I /usr/bin/pigz -cPf /a.tar.gz /d/data"
+
+    def test_get_incremental_chain(self, tmpdir):
+        """
+        Test incremental backups are found in order on top of the base backup.
+
+        :return:
+        """
+        cls = smdba.postgresqlgate.PgBackup
+        assert cls.get_incremental_chain(str(tmpdir)) == []
+        assert cls.get_chain_manifest(str(tmpdir)) is None
+
+        for path in ["", "incremental/20240102000000", "incremental/20240101000000"]:
+            tmpdir.join(path, "base.tar.gz").ensure()
+            tmpdir.join(path, "backup_manifest").ensure()
+        tmpdir.join("incremental", "20240103000000", "base.tar.gz").ensure()  # unfinished backup
+
+        assert cls.get_incremental_chain(str(tmpdir)) == [str(tmpdir.join("incremental", "20240101000000")),
+                                                          str(tmpdir.join("incremental", "20240102000000"))]
+        assert cls.get_chain_manifest(str(tmpdir)) == str(tmpdir.join("incremental", "20240102000000", "backup_manifest"))
+
+    def test_get_wal_name(self):
+        """
+        Test WAL segment name of the LSN.
+
+        :return:
+        """
+        cls = smdba.postgresqlgate.PgBackup
+        assert cls.get_wal_name(1, "0/2000028") == "000000010000000000000002"
+        assert cls.get_wal_name(2, "1A/FF000100") == "000000020000001A000000FF"
+        assert cls.get_wal_name(1, "1/8000000", segment_size=0x4000000) == "000000010000000100000002"
+
+    def test_get_retained_backups(self):
+        """
+        Test retention by number of backups and by days.
+
+        :return:
+        """
+        cls = smdba.postgresqlgate.PgBackup
+        day = 86400
+        now = time.time()
+        backups = [{"name": str(age), "created": now - age * day} for age in [30, 20, 10, 5, 1]]
+        names = lambda retained: [backup["name"] for backup in retained]
+
+        assert names(cls._get_retained_backups(backups, 2, None)) == ["5", "1"]
+        assert names(cls._get_retained_backups(backups, None, 7)) == ["10", "5", "1"]
+        assert names(cls._get_retained_backups(backups, 4, 7)) == ["20", "10", "5", "1"]
+        assert names(cls._get_retained_backups(backups[:1], None, 7)) == ["30"]
+
+    def test_cleanup_backup_retention(self, tmpdir):
+        """
+        Test expired backups and WAL before the oldest retained backup are removed.
+
+        :return:
+        """
+        now = time.time()
+        for name in ["000000010000000000000001", "000000010000000000000002", "000000010000000000000003",
+                     "000000010000000000000002.00000028.backup", "base-20240101000000.tar.gz",
+                     "backup_manifest-20240101000000", "base-20240102000000.tar.gz", "base.tar.gz"]:
+            tmpdir.join(name).write("x")
+        tmpdir.mkdir("incremental-20240101000000").join("base.tar.gz").write("x")
+        catalog = smdba.pgcatalog.BackupCatalog(str(tmpdir))
+        for idx, name in enumerate(["base-20240101000000.tar.gz", "base-20240102000000.tar.gz", "base.tar.gz"]):
+            catalog.add_base_backup(name, "full", 1)
+            catalog._conn.execute("UPDATE base_backups SET created = ?, timeline = 1, start_lsn = ? WHERE name = ?",
+                                  (now - 3 + idx, "0/%X" % ((idx + 1) * 0x1000000 + 0x28), name))
+        catalog.close()
+
+        with patch("smdba.postgresqlgate.os.path.exists", MagicMock(return_value=True)):
+            pgbk = smdba.postgresqlgate.PgBackup(str(tmpdir))
+        pgbk.cleanup_backup(keep_backups=2)
+
+        assert sorted(os.listdir(str(tmpdir))) == [
+            ".smdba-catalog.db", "000000010000000000000002", "000000010000000000000002.00000028.backup",
+            "000000010000000000000003", "base-20240102000000.tar.gz", "base.tar.gz"]
+        catalog = smdba.pgcatalog.BackupCatalog(str(tmpdir))
+        assert catalog.get_files("wal") == ["000000010000000000000002", "000000010000000000000003"]
+        assert [bkp["name"] for bkp in catalog.get_base_backups(generations=True)] == [
+            "base-20240102000000.tar.gz", "base.tar.gz"]
+        catalog.close()
+
+    def test_verify_wal_chain(self, tmpdir):
+        """
+        Test gaps and damaged segments are reported.
+
+        :return:
+        """
+        for name in ["000000010000000000000001", "000000010000000000000002", "000000010000000000000005"]:
+            tmpdir.join(name).write("x" * 16)
+        tmpdir.join("000000010000000000000003.partial").write("x")
+        with patch("smdba.postgresqlgate.os.path.exists", MagicMock(return_value=True)):
+            pgbk = smdba.postgresqlgate.PgBackup(str(tmpdir))
+
+        count, errors = pgbk.verify_wal_chain(segment_size=16, workers=2)
+        assert count == 3
+        assert errors == ["Gap in WAL archive: 2 segments missing after 000000010000000000000002"]
+
+        tmpdir.join("000000010000000000000002").write("x" * 8)
+        assert len(pgbk.verify_wal_chain(segment_size=16, workers=2)[1]) == 2
+
+    def test_verify_base_backup(self, tmpdir):
+        """
+        Test base backup archive is verified against its manifest.
+
+        :return:
+        """
+        data = {"PG_VERSION": b"16\n", "base/1/1259": b"\x00" * 0x2000}
+        archive = str(tmpdir.join("base.tar"))
+        with tarfile.open(archive, "w") as tar:
+            for name, content in data.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        files = [{"Path": name, "Size": len(content), "Checksum-Algorithm": "SHA256",
+                  "Checksum": hashlib.sha256(content).hexdigest()} for name, content in data.items()]
+
+        def write_manifest(files):
+            body = '{"PostgreSQL-Backup-Manifest-Version": 1,\n"Files": ' + json.dumps(files) + ',\n'
+            tmpdir.join("backup_manifest").write(
+                body + '"Manifest-Checksum": "' + hashlib.sha256(body.encode()).hexdigest() + '"}\n')
+
+        write_manifest(files)
+        verify = smdba.postgresqlgate.PgBackup.verify_base_backup
+        assert verify(archive, str(tmpdir.join("backup_manifest")), threads=2) == (2, 0, [])
+
+        # Larger files are hashed by chunks
+        with patch("smdba.postgresqlgate.PgBackup.VERIFY_CHUNK", 0x300), \
+                patch("smdba.postgresqlgate.PgBackup.VERIFY_QUEUE", 2):
+            assert verify(archive, str(tmpdir.join("backup_manifest")), threads=1) == (2, 0, [])
+
+        files[1]["Checksum"] = "0" * 64
+        files.append({"Path": "global/pg_control", "Size": 8192})
+        write_manifest(files)
+        assert verify(archive, str(tmpdir.join("backup_manifest")), threads=2)[2] == [
+            "Checksum mismatch: base/1/1259", "Missing file: global/pg_control"]
+
+    def test_rst_wait_recovery(self, tmpdir):
+        """
+        Restore waits until the recovery is finished, not only until the database is started.
+
+        :return:
+        """
+        gate = MagicMock()
+        gate.config = {"pcnf_pg_data": str(tmpdir)}
+        signal = tmpdir.join("recovery.signal")
+        signal.write("")
+
+        def db_status():
+            if gate._get_db_status.call_count > 2:
+                signal.remove()
+            return True
+
+        gate._get_db_status = MagicMock(side_effect=db_status)
+        assert smdba.postgresqlgate.PgSQLGate._rst_wait_recovery(gate, poll=0.01)
+        assert gate._get_db_status.call_count == 3
+
+        # Recovery failed, the database is down
+        signal.write("")
+        gate._get_db_status = MagicMock(return_value=False)
+        assert not smdba.postgresqlgate.PgSQLGate._rst_wait_recovery(gate, poll=0.01)
+
+    def test_parse_target_time(self):
+        """
+        Recovery target time is parsed as PostgreSQL accepts it.
+
+        :return:
+        """
+        parse = smdba.postgresqlgate.PgSQLGate._parse_target_time
+        utc = 1704103200.
+        assert parse("2024-01-01 10:00:00+00") == utc
+        assert parse("2024-01-01 11:00:00+01") == utc
+        assert parse("2024-01-01 05:30:00-0430") == utc
+        assert parse("2024-01-01T10:00:00.5Z") == utc + 0.5
+        assert parse("2024-01-01 10:00 UTC") == utc
+        if smdba.postgresqlgate.zoneinfo is not None:
+            assert parse("2024-01-01 11:00:00 CET") == utc
+        assert parse("2024-01-01 10:00:00 Nowhere/Land") is None
+        assert parse("yesterday") is None
+        assert parse("2024-13-01 10:00:00") is None
+
+    def test_get_recovery_targets(self):
+        """
+        Test recovery target options.
+
+        :return:
+        """
+        gate = MagicMock()
+        gate.RECOVERY_TARGETS = smdba.postgresqlgate.PgSQLGate.RECOVERY_TARGETS
+        get_targets = lambda **args: smdba.postgresqlgate.PgSQLGate._get_recovery_targets(gate, **args)
+
+        assert get_targets() == {}
+        assert get_targets(**{"target-lsn": "0/1A2B3C4D"}) == {
+            "recovery_target_lsn": "'0/1A2B3C4D'", "recovery_target_action": "'promote'"}
+        assert get_targets(**{"target-time": "2024-01-31 12:00:00+01"})["recovery_target_time"] == \
+            "'2024-01-31 12:00:00+01'"
+        for args in [{"target-lsn": "1A2B"}, {"target-xid": "x1"}, {"target-xid": "1", "target-lsn": "0/1"}]:
+            with pytest.raises(smdba.postgresqlgate.GateException):
+                get_targets(**args)
@@ -0,0 +1,125 @@
+# coding: utf-8
+"""
+Unit tests for the backup catalog.
+"""
+import json
+import time
+import smdba.pgcatalog
+
+
+class TestBackupCatalog:
+    """
+    Test suite for backup catalog.
+    """
+
+    def test_parse(self):
+        """
+        Archived files are recognised by their names.
+
+        :return:
+        """
+        parse = smdba.pgcatalog.CatalogFile.parse
+        wal = parse("0000000200000001000000AB")
+        assert (wal.kind, wal.timeline, wal.position) == ("wal", 2, "00000001000000AB")
+        assert parse("0000000200000001000000AB.partial").kind == "partial"
+        assert parse("0000000100000001000000AA.00000028.backup").kind == "backup"
+        assert parse("00000002.history").kind == "history"
+        assert parse("base.tar.gz") is None
+
+    def test_rebuild(self, tmpdir):
+        """
+        Existing archive is indexed once, when the catalog is created.
+
+        :return:
+        """
+        for name in ["000000010000000000000001", "000000010000000000000002", "base.tar.gz",
+                     "000000010000000000000002.00000028.backup"]:
+            tmpdir.join(name).write("x")
+        assert smdba.pgcatalog.BackupCatalog.open(str(tmpdir)) is None
+
+        catalog = smdba.pgcatalog.BackupCatalog(str(tmpdir))
+        assert catalog.get_files("wal") == ["000000010000000000000001", "000000010000000000000002"]
+        assert catalog.get_files("backup") == ["000000010000000000000002.00000028.backup"]
+        catalog.close()
+
+        # Not rescanned anymore
+        tmpdir.join("000000010000000000000003").write("x")
+        catalog = smdba.pgcatalog.BackupCatalog.open(str(tmpdir))
+        assert len(catalog.get_files("wal")) == 2
+        catalog.close()
+
+    def test_files_before(self, tmpdir):
+        """
+        Files preceding the restart file are found regardless of the timeline.
+
+        :return:
+        """
+        catalog = smdba.pgcatalog.BackupCatalog(str(tmpdir))
+        for name in ["000000010000000000000001", "000000020000000000000002", "000000020000000000000003"]:
+            catalog.add_file(name, size=16, stored=16, sha1="0" * 40)
+        catalog.add_file("not-a-wal")
+
+        assert catalog.get_files("wal", before="000000020000000000000003.00000028.backup") == [
+            "000000010000000000000001", "000000020000000000000002"]
+        assert catalog.get_file("000000010000000000000001")["sha1"] == "0" * 40
+        assert catalog.get_file("not-a-wal") is None
+
+        catalog.remove_files(["000000010000000000000001"])
+        assert catalog.get_files("wal") == ["000000020000000000000002", "000000020000000000000003"]
+        assert catalog.get_last_archived() > 0
+        catalog.close()
+
+    def test_archived_since(self, tmpdir):
+        """
+        Recently archived segments are summed up, the last segment is found by its position.
+
+        :return:
+        """
+        catalog = smdba.pgcatalog.BackupCatalog(str(tmpdir))
+        catalog.add_file("000000010000000000000009", size=16, stored=4)
+        catalog.add_file("000000020000000000000003", size=16, stored=None)
+        catalog.add_file("000000020000000000000002", size=16, stored=8)
+        catalog.add_file("00000002.history")
+
+        assert catalog.get_archived_since(0) == (3, 48, 28)
+        assert catalog.get_archived_since(time.time() + 60) == (0, 0, 0)
+        assert catalog.get_last_wal() == "000000020000000000000003"
+        catalog.close()
+
+    def test_base_backups(self, tmpdir):
+        """
+        Base backups are recorded with their WAL range and rotated.
+
+        :return:
+        """
+        tmpdir.join("backup_manifest").write(json.dumps({"WAL-Ranges": [
+            {"Timeline": 1, "Start-LSN": "0/2000028", "End-LSN": "0/2000100"}]}))
+        catalog = smdba.pgcatalog.BackupCatalog(str(tmpdir))
+        catalog.add_base_backup("base.tar.gz", "full", 100, manifest=str(tmpdir.join("backup_manifest")))
+        catalog.add_base_backup("incremental/20240101000000/base.tar.gz", "incremental", 10)
+
+        backups = catalog.get_base_backups()
+        assert [(bkp["name"], bkp["start_lsn"]) for bkp in backups] == [
+            ("base.tar.gz", "0/2000028"), ("incremental/20240101000000/base.tar.gz", None)]
+
+        catalog.rotate_base_backups("20240101000000")
+        assert catalog.get_base_backups() == []
+        catalog.add_base_backup("base.tar.zst", "full", 100)
+        assert [bkp["name"] for bkp in catalog.get_base_backups(generations=True)] == [
+            "base-20240101000000.tar.gz", "base.tar.zst"]
+
+        catalog.remove_generation("base-20240101000000.tar.gz")
+        assert [bkp["name"] for bkp in catalog.get_base_backups(generations=True)] == ["base.tar.zst"]
+        assert catalog.get_base_backups() == catalog.get_base_backups(generations=True)
+        catalog.close()
+
+    def test_generation_names(self):
+        """
+        Manifest and incremental backups are found for the archive of any generation.
+
+        :return:
+        """
+        assert smdba.pgcatalog.get_manifest_name("/b/base.tar.gz") == "/b/backup_manifest"
+        assert smdba.pgcatalog.get_manifest_name("/b/base-old.tar.gz") == "/b/backup_manifest.old"
+        assert smdba.pgcatalog.get_manifest_name("/b/base-20240101000000.tar") == "/b/backup_manifest-20240101000000"
+        assert smdba.pgcatalog.get_incremental_name("base-20240101000000.tar.zst") == "incremental-20240101000000"
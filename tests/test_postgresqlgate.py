@@ -2,9 +2,13 @@
 """
 Unit tests for the base gate.
 """
+import io
+import threading
 from unittest.mock import MagicMock, mock_open, patch
+import pytest
 import smdba.postgresqlgate
 import smdba.basegate
+import smdba.output
 
 
 class TestPgGt:
@@ -178,3 +182,200 @@ RMAN-01007: at line 1 column 18 file: standard input
         :return:
         """
         assert smdba.postgresqlgate.PgSQLGate._bt_to_mb(0x300000) == 3
+
+    def test_decode_copy_line(self):
+        """
+        Decode COPY text format row.
+
+        :return:
+        """
+        row = smdba.postgresqlgate.PgSQLGate._decode_copy_line("public.rhnserver\t\\N\t12\\t3\\\\4\\n")
+        assert row == ["public.rhnserver", None, "12\t3\\4\n"]
+
+    def test_quote(self):
+        """
+        Quote literals for the psql calls.
+
+        :return:
+        """
+        quote = smdba.postgresqlgate.PgSQLGate._quote
+        assert quote(None) == "NULL"
+        assert quote(42) == "42"
+        assert quote("O'Neil\\") == "E'O''Neil\\\\'"
+
+    def test_query_psql_fallback(self):
+        """
+        Query falls back to psql COPY output, if no driver is available.
+
+        :return:
+        """
+        pgt = MagicMock()
+        pgt._get_connection = MagicMock(return_value=None)
+        pgt._quote = smdba.postgresqlgate.PgSQLGate._quote
+        pgt._decode_copy_line = smdba.postgresqlgate.PgSQLGate._decode_copy_line
+        pgt._convert_row = smdba.postgresqlgate.PgSQLGate._convert_row
+        pgt.PSQL_ERROR = smdba.postgresqlgate.PgSQLGate.PSQL_ERROR
+
+        def call_script(scenario, target):
+            tag = scenario.split("\n")[4].split(" ", 1)[1]
+            return "SET\n{0}\ndb1\t100\ndb2\t\\N\n{0}".format(tag), ""
+
+        pgt.call_script = MagicMock(side_effect=call_script)
+        rows = list(smdba.postgresqlgate.PgSQLGate.query(pgt, "SELECT datname, size FROM x WHERE y = %s;",
+                                                          params=["a"], types=(str, int)))
+        assert rows == [("db1", 100), ("db2", None)]
+        assert "\nCOPY (SELECT datname, size FROM x WHERE y = E'a') TO STDOUT;\n" in pgt.call_script.call_args[0][0]
+        assert pgt.call_script.call_args[0][0].startswith("\\set ON_ERROR_STOP on\n")
+
+    def test_query_psql_errors(self):
+        """
+        Errors of psql, prefixed with the script location, fail the query and notices are not rows.
+
+        :return:
+        """
+        pgt = MagicMock()
+        pgt._get_connection = MagicMock(return_value=None)
+        pgt.PSQL_ERROR = smdba.postgresqlgate.PgSQLGate.PSQL_ERROR
+        pgt.call_script = MagicMock(return_value=(
+            "NOTICE:  relation is skipped\npsql:<stdin>:5: ERROR:  relation \"x\" does not exist", ""))
+        with pytest.raises(smdba.basegate.GateException) as exc:
+            list(smdba.postgresqlgate.PgSQLGate.query(pgt, "SELECT 1 FROM x"))
+        assert str(exc.value) == "Query failed: relation \"x\" does not exist"
+
+        # Client stopped on the error
+        pgt.call_script = MagicMock(side_effect=smdba.basegate.GateException(
+            "Non zero exit code (3) returned while calling psql\nSTDOUT: psql:<stdin>:5: FATAL:  terminating connection"))
+        with pytest.raises(smdba.basegate.GateException) as exc:
+            list(smdba.postgresqlgate.PgSQLGate.query(pgt, "SELECT 1"))
+        assert str(exc.value) == "Query failed: terminating connection"
+
+    def test_pg_config_lazy(self):
+        """
+        Running configuration is loaded once, on the first access to a missing setting.
+
+        :return:
+        """
+        loader = MagicMock()
+        config = smdba.postgresqlgate.PgConfig({"pcnf_pg_data": "/data", "db_name": "susemanager"}, "pcnf_", loader)
+        loader.side_effect = lambda: config.update({"pcnf_data_directory": "/data"})
+
+        assert config["pcnf_pg_data"] == "/data"
+        assert config.get("db_user") is None
+        assert not loader.called
+
+        assert config.get("pcnf_data_directory") == "/data"
+        assert "pcnf_port" not in config
+        assert loader.call_count == 1
+
+        # Database is not running yet
+        loader = MagicMock(side_effect=[None, Exception("Underlying error"), None])
+        config = smdba.postgresqlgate.PgConfig({"pcnf_pg_data": "/data"}, "pcnf_", loader)
+        assert config.get("pcnf_port") is None
+        with pytest.raises(Exception):
+            config.get("pcnf_port")
+        loader.side_effect = lambda: config.update({"pcnf_port": "5432"})
+        assert config.get("pcnf_port") == "5432"
+        assert config.get("pcnf_wal_level") is None
+        assert loader.call_count == 3
+
+    def test_archive_lag(self):
+        """
+        Archive lag counts complete segments and bytes after the last archived segment.
+
+        :return:
+        """
+        lag = smdba.postgresqlgate.PgSQLGate.get_archive_lag
+        assert lag("0/3000060", "000000010000000000000002", 0x1000000) == (0, 0x60)
+        assert lag("1/2000000", "0000000100000000000000FE", 0x1000000) == (3, 0x3000000)
+        assert lag("0/3000060", None, 0x1000000) == (3, 0x3000060)
+        assert lag("0/0400000", "000000010000000000000001", 0x400000) == (0, 0)
+
+    def test_parse_size(self):
+        """
+        Sizes are parsed in bytes or with suffixes.
+
+        :return:
+        """
+        parse = smdba.postgresqlgate.PgSQLGate._parse_size
+        assert parse("100") == 100
+        assert parse("10M") == 10 * 0x100000
+        assert parse("2gb") == 2 * 0x40000000
+        with pytest.raises(smdba.basegate.GateException):
+            parse("ten")
+
+    def test_space_tables_fan_out(self):
+        """
+        Table sizes are queried per database and schema, split by relations and merged largest first.
+        Connections are opened before the queries fan out to the threads.
+
+        :return:
+        """
+        def query_database(connection, sql, params=None, types=None):
+            database = connection.database
+            if "FROM pg_namespace" in sql and "pg_class" not in sql:
+                return [(11, "public"), (12, "rhn")]
+            if " = 0) R" not in sql:
+                return []
+            schema = "public" if "relnamespace = 11" in sql else "rhn"
+            return [("{}.t{}".format(schema, idx), "x", size) for idx, size in
+                    enumerate({"public": [4096, 2048] if database == "db1" else [8192], "rhn": [3072, 1024]}[schema])]
+
+        def connect_database(database):
+            if threading.current_thread() is not threading.main_thread():
+                pgt._connect_database.called_in_thread = True
+            return MagicMock(database=database)
+
+        pgt = MagicMock()
+        pgt.config = {"db_name": "db1"}
+        pgt._parse_size = smdba.postgresqlgate.PgSQLGate._parse_size
+        pgt._render_scenario = smdba.postgresqlgate.PgSQLGate._render_scenario
+        pgt._iter_table_sizes = lambda *args: smdba.postgresqlgate.PgSQLGate._iter_table_sizes(pgt, *args)
+        pgt._connect_database = MagicMock(side_effect=connect_database)
+        pgt._connect_database.called_in_thread = False
+        pgt._query_database = MagicMock(side_effect=query_database)
+        pgt.output = smdba.output.JsonOutput(io.StringIO())
+
+        smdba.postgresqlgate.PgSQLGate.do_space_tables(pgt, top="2", jobs="8", **{"min-size": "1K", "database": "db1,db2"})
+        assert [(rec["database"], rec["table"], rec["size"]) for rec in pgt.output.reports["space-tables"]] == [
+            ("db2", "public.t0", 8192), ("db1", "public.t0", 4096)]
+        assert pgt._query_database.call_count == 2 * (1 + 2 * 4)
+        assert pgt._connect_database.call_count == 2 * 8
+        assert not pgt._connect_database.called_in_thread
+        assert "LIMIT NULLIF(2, 0)" in pgt._query_database.call_args[0][1]
+        assert "size >= 1024" in pgt._query_database.call_args[0][1]
+
+        pgt.output = smdba.output.JsonOutput(io.StringIO())
+        smdba.postgresqlgate.PgSQLGate.do_space_tables(pgt, schema="rhn", jobs="1", estimate=True)
+        assert [rec["table"] for rec in pgt.output.reports["space-tables"]] == ["rhn.t0", "rhn.t1"]
+        assert "relpages" in pgt._query_database.call_args[0][1]
+
+        # Without the limit, rows are streamed to the output as they are measured
+        pgt.output = MagicMock()
+        smdba.postgresqlgate.PgSQLGate.do_space_tables(pgt, schema="rhn", jobs="1")
+        name, fields, records = pgt.output.report.call_args[0]
+        assert not isinstance(records, list)
+        with patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            pgt.output.report.call_args[1]["text"](records)
+        assert [line.replace("|", "").split() for line in stdout.getvalue().strip().split("\n")][2:] == [
+            ["rhn.t0", "x"], ["rhn.t1", "x"], [], ["Total", "0.00M"]]
+
+    def test_basebackup_tablespaces(self):
+        """
+        Base backup is piped to the compressor only without extra tablespaces.
+
+        :return:
+        """
+        pgt = MagicMock()
+        pgt._get_pg_version = MagicMock(return_value=[14])
+        pgt._has_tablespaces = MagicMock(return_value=False)
+        command = smdba.postgresqlgate.PgSQLGate._get_basebackup_command
+        with patch("os.path.exists", MagicMock(return_value=True)):
+            cmd, name = command(pgt, "/backup/tmp", threads="4")
+            assert "-D - | /usr/bin/pigz -p 4 > /backup/tmp/base.tar.gz" in cmd
+
+            pgt._has_tablespaces.return_value = True
+            cmd, name = command(pgt, "/backup/tmp", threads="4")
+            assert "pigz" not in cmd and " -z -D /backup/tmp/" in cmd
+            assert name == "base.tar.gz"
+            with pytest.raises(smdba.basegate.GateException):
+                command(pgt, "/backup/tmp", threads="4", **{"base-compression": "zstd"})
@@ -0,0 +1,89 @@
+# coding: utf-8
+"""
+Unit tests for the progress roller.
+"""
+import io
+from unittest.mock import patch
+import smdba.roller
+
+
+class FakeTerminal(io.StringIO):
+    """
+    Output, pretending to be a terminal.
+    """
+
+    def isatty(self) -> bool:
+        return True
+
+
+class TestRoller:
+    """
+    Test suite for roller.
+    """
+
+    def test_quiet_without_terminal(self):
+        """
+        Only the final message is written, if output is not a terminal.
+
+        :return:
+        """
+        output = io.StringIO()
+        roller = smdba.roller.Roller(total=100, output=output)
+        roller.start()
+        roller.update(50)
+        roller.stop("finished")
+        assert not roller.is_alive()
+        assert output.getvalue() == "finished\n"
+
+        roller.stop("again")
+        assert output.getvalue() == "finished\n"
+
+    def test_stop_not_started(self):
+        """
+        Roller, which is not running, still writes the final message once.
+
+        :return:
+        """
+        output = io.StringIO()
+        roller = smdba.roller.Roller(output=output)
+        roller.stop("failed")
+        roller.stop("again")
+        assert output.getvalue() == "failed\n"
+
+    def test_terminal_line_is_erased(self):
+        """
+        Spinner and progress are erased from the terminal before the final message.
+
+        :return:
+        """
+        output = FakeTerminal()
+        roller = smdba.roller.Roller(unit="segments", output=output)
+        roller.start()
+        roller.update(3, total=10)
+        roller.stop("done")
+
+        written = output.getvalue()
+        assert written.endswith("done\n")
+        line = ""
+        for char in written[:-len("done\n")]:
+            line = line[:-1] if char == "\b" else line + char
+        assert not line.strip()
+
+    def test_get_status(self):
+        """
+        Progress shows done work, percentage, throughput and ETA.
+
+        :return:
+        """
+        with patch("smdba.roller.time.time", return_value=100.):
+            roller = smdba.roller.Roller(total=0x4000000, output=io.StringIO())
+        assert roller.get_status() == ""
+        roller.update(0x1000000)
+        with patch("smdba.roller.time.time", return_value=102.):
+            assert roller.get_status() == "16.0MB/64.0MB 25% 8.0MB/s ETA 0:00:06"
+
+        with patch("smdba.roller.time.time", return_value=100.):
+            roller = smdba.roller.Roller(unit="files", output=io.StringIO())
+        roller.update(done=20)
+        with patch("smdba.roller.time.time", return_value=110.):
+            assert roller.get_status() == "20 files 2/s"
@@ -0,0 +1,74 @@
+# coding: utf-8
+"""
+Unit tests for the scenario registry.
+"""
+from unittest.mock import patch
+import pytest
+import smdba.basegate
+
+
+class TestScenarioRegistry:
+    """
+    Test suite for scenario registry.
+    """
+
+    def test_render_quoted(self):
+        """
+        Values within string literals are quoted, other values must be plain.
+
+        :return:
+        """
+        scn = smdba.basegate.ScenarioTemplate("test", "SET DBID=@dbid;\nSELECT 'x=@name', '@name' FROM @table;")
+        assert scn.placeholders == {"dbid", "name", "table"}
+        assert scn.render(dbid=42, name="O'Brien", table="dba_segments") == \
+            "SET DBID=42;\nSELECT 'x=O''Brien', 'O''Brien' FROM dba_segments;"
+
+        with pytest.raises(smdba.basegate.GateException):
+            scn.render(dbid="1; DROP TABLE x", name="", table="t")
+        with pytest.raises(smdba.basegate.GateException):
+            scn.render(dbid=1, name="x")
+
+    def test_render_strict(self):
+        """
+        Values cannot start a comment or end the statement, placeholders in comments are not bound.
+
+        :return:
+        """
+        scn = smdba.basegate.ScenarioTemplate("test", "-- Don't @skip\nSELECT x - @num, '@name' /* it's @skip */ FROM t;")
+        assert scn.placeholders == {"num", "name"}
+        assert scn.render(num=-1, name="a--b") == "-- Don't @skip\nSELECT x - (-1), 'a--b' /* it's @skip */ FROM t;"
+        assert smdba.basegate.ScenarioTemplate("test", "SIZE @size").render(size="4G") == "SIZE 4G"
+
+        for value in ["-1", "1--", "a b", "1e5;", "x.y"]:
+            with pytest.raises(smdba.basegate.GateException):
+                scn.render(num=value, name="")
+        with pytest.raises(smdba.basegate.GateException):
+            scn.render(num=1, name="x\nEOF")
+
+    def test_registry_cache(self, tmpdir):
+        """
+        Scenarios are read once and rendered scenarios are cached.
+
+        :return:
+        """
+        tmpdir.join("stats.scn").write("exec gather('@owner');")
+        registry = smdba.basegate.ScenarioRegistry(str(tmpdir))
+
+        assert registry.render("stats", owner="SPACEWALK") == "exec gather('SPACEWALK');"
+        tmpdir.join("stats.scn").write("changed")
+        with patch.object(smdba.basegate.ScenarioTemplate, "render") as render:
+            assert registry.render("stats", owner="SPACEWALK") == "exec gather('SPACEWALK');"
+            assert not render.called
+        assert registry.get("stats").text == "exec gather('@owner');"
+
+        with pytest.raises(IOError):
+            registry.get("missing")
+
+    def test_package_scenarios(self):
+        """
+        Package scenarios are available through the gate.
+
+        :return:
+        """
+        assert smdba.basegate.BaseGate.get_scn("pg-reload-conf").read().strip() == "SELECT pg_reload_conf();"
+        assert "'SPACEWALK'" in smdba.basegate.BaseGate._render_scenario("tablesizes", user="SPACEWALK")
@@ -0,0 +1,165 @@
+# coding: utf-8
+"""
+Unit tests for the persistent scenario sessions.
+"""
+from unittest.mock import MagicMock
+import pytest
+import smdba.basegate
+
+# Emulates psql: echoes "\echo" meta-commands and every other line as is.
+FAKE_PSQL = ["/bin/bash", "-c",
+             r'while IFS= read -r line; do case "$line" in "\echo "*) echo "${line#\\echo }";; '
+             r'"\q") exit 0;; "die") exit 3;; "stall") sleep 10;; *) echo "out: $line";; esac; done']
+
+
+class TestScenarioSession:
+    """
+    Test suite for scenario session.
+    """
+
+    def test_execute_framing(self):
+        """
+        Output between frames belongs to each scenario separately.
+
+        :return:
+        """
+        session = smdba.basegate.ScenarioSession("psql", FAKE_PSQL, prologue="login")
+        try:
+            assert session.execute("select 1;") == "out: select 1;"
+            assert session.execute("select 2;\nselect 3;") == "out: select 2;\nout: select 3;"
+            assert session.is_alive()
+        finally:
+            session.close()
+        assert not session.is_alive()
+
+    def test_execute_terminated(self):
+        """
+        Terminated client reports started scenario and its exit code.
+
+        :return:
+        """
+        session = smdba.basegate.ScenarioSession("psql", FAKE_PSQL)
+        with pytest.raises(smdba.basegate.SessionException) as exc:
+            session.execute("select 1;\ndie")
+        assert exc.value.started
+        assert exc.value.returncode == 3
+        assert exc.value.output == "out: select 1;"
+
+    def test_execute_unterminated(self):
+        """
+        Unterminated statement is ended before the closing frame.
+
+        :return:
+        """
+        session = smdba.basegate.ScenarioSession("psql", FAKE_PSQL)
+        try:
+            assert session.execute("show all") == "out: show all\nout: ;"
+            assert session.execute("\\x") == "out: \\x"
+        finally:
+            session.close()
+
+        terminate = smdba.basegate.ScenarioSession._terminate
+        sqlplus = MagicMock(target="sqlplus", PLSQL_BLOCK=smdba.basegate.ScenarioSession.PLSQL_BLOCK,
+                            SQLPLUS_COMMAND=smdba.basegate.ScenarioSession.SQLPLUS_COMMAND)
+        assert terminate(sqlplus, "set pages 0\nselect 1 from dual") == "set pages 0\nselect 1 from dual\n;"
+        assert terminate(sqlplus, "select 1 from dual;\nset pages 0") == "select 1 from dual;\nset pages 0"
+        assert terminate(sqlplus, "BEGIN\n  NULL;\nEND;") == "BEGIN\n  NULL;\nEND;\n/"
+        assert terminate(sqlplus, "BEGIN\n  NULL;\nEND;\n/\nselect 1 from dual;").endswith("dual;")
+
+        rman = MagicMock(target="rman")
+        for name in ["rman-hot-backup", "rman-hot-backup-roll"]:
+            scenario = smdba.basegate.BaseGate._render_scenario(name)
+            assert terminate(rman, scenario) == scenario
+        assert terminate(rman, "LIST BACKUP") == "LIST BACKUP\n;"
+
+    def test_execute_stalled(self):
+        """
+        Stalled client is killed after the timeout.
+
+        :return:
+        """
+        session = smdba.basegate.ScenarioSession("psql", FAKE_PSQL)
+        with pytest.raises(smdba.basegate.SessionException) as exc:
+            session.execute("stall", timeout=0.5)
+        assert exc.value.started
+        assert exc.value.returncode
+        assert not session.is_alive()
+
+    def test_call_script_fallback(self):
+        """
+        Gate falls back to one-shot call, if session is not available.
+
+        :return:
+        """
+        gate = MagicMock()
+        gate._sessions = {}
+        gate._is_exclusive = smdba.basegate.BaseGate._is_exclusive
+        gate._is_exiting = smdba.basegate.BaseGate._is_exiting
+        gate._get_client_user = smdba.basegate.BaseGate._get_client_user
+        gate._get_session = MagicMock(return_value=None)
+        gate.get_scenario_template = MagicMock(return_value="cat - << EOF | psql\n@scenario\nEOF")
+        gate.syscall = MagicMock(return_value=("out", ""))
+
+        assert smdba.basegate.BaseGate.call_script(gate, "select '$a';", target="psql") == ("out", "")
+        args, kwargs = gate.syscall.call_args
+        assert args == ("sudo", "-u", "postgres", "/bin/bash")
+        assert kwargs["input"] == "cat - << EOF | psql\nselect '\\$a';\nEOF"
+
+    def test_exclusive_scenario(self):
+        """
+        Scenarios, restarting the instance, cannot share the session.
+
+        :return:
+        """
+        assert smdba.basegate.BaseGate._is_exclusive("ALTER SYSTEM SET x=1;\nSHUTDOWN IMMEDIATE;")
+        assert smdba.basegate.BaseGate._is_exclusive("startup mount;")
+        assert not smdba.basegate.BaseGate._is_exclusive("select startup_time from v$instance;")
+
+    def test_exiting_scenario(self):
+        """
+        Scenarios, exiting the client, run in a one-shot client.
+
+        :return:
+        """
+        assert smdba.basegate.BaseGate._is_exiting("exec dbms_stats.gather_schema_stats('X');\nEXIT;")
+        assert not smdba.basegate.BaseGate._is_exiting("select exit_code from jobs;")
+
+        gate = MagicMock()
+        gate._is_exclusive = smdba.basegate.BaseGate._is_exclusive
+        gate._is_exiting = smdba.basegate.BaseGate._is_exiting
+        gate._get_client_user = smdba.basegate.BaseGate._get_client_user
+        gate.get_scenario_template = MagicMock(return_value="@scenario")
+        gate.syscall = MagicMock(return_value=("out", ""))
+        assert smdba.basegate.BaseGate.call_script(gate, "select 1 from dual;\nEXIT;") == ("out", "")
+        assert not gate._get_session.called
+
+    def test_syscall_stream(self):
+        """
+        Streaming syscall yields lines and classifies errors on the fly.
+
+        :return:
+        """
+        gate = MagicMock()
+        gate.to_bytes = smdba.basegate.BaseGate.to_bytes
+        gate.to_str = smdba.basegate.BaseGate.to_str
+        output = smdba.basegate.ScenarioStream(smdba.basegate.BaseGate.syscall_stream(
+            gate, "/bin/sh", "-c", "cat; echo 'ORA-01034: ORACLE not available'", input="line 1\nline 2\n"))
+
+        assert list(output) == ["line 1", "line 2", "ORA-01034: ORACLE not available"]
+        assert output.stderr == "ORA-01034: ORACLE not available"
+
+    def test_syscall_stream_exit_code(self):
+        """
+        Streaming syscall reports non-zero exit code after the output is consumed.
+
+        :return:
+        """
+        gate = MagicMock()
+        gate.to_bytes = smdba.basegate.BaseGate.to_bytes
+        gate.to_str = smdba.basegate.BaseGate.to_str
+        lines = []
+        with pytest.raises(smdba.basegate.GateException) as exc:
+            for line in smdba.basegate.BaseGate.syscall_stream(gate, "/bin/sh", "-c", "echo partial; exit 2"):
+                lines.append(line)
+        assert lines == ["partial"]
+        assert "Non zero exit code (2)" in str(exc.value)
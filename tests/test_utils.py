@@ -0,0 +1,76 @@
+# coding: utf-8
+"""
+Unit tests for the general utils.
+"""
+import io
+import json
+from unittest.mock import MagicMock, patch
+import pytest
+import smdba.utils
+
+
+class TestUtils:
+    """
+    Test suite for utils.
+    """
+
+    def test_get_binary_version(self, tmpdir):
+        """
+        Version is probed once and cached on disk until the binary is modified.
+
+        :return:
+        """
+        binary = tmpdir.join("postgres")
+        binary.write("#!/bin/sh\necho 'postgres (PostgreSQL) 16.2'\n")
+        binary.chmod(0o755)
+        cache = str(tmpdir.join("cache", "probes.json"))
+
+        with patch("smdba.utils.PROBES", {}), patch("smdba.utils.PROBE_CACHE", cache), \
+                patch("smdba.utils.os.geteuid", MagicMock(return_value=0)):
+            assert smdba.utils.get_binary_version(str(binary)) == [16, 2]
+            assert json.load(open(cache))[str(binary)]["version"] == [16, 2]
+
+        popen = MagicMock()
+        with patch("smdba.utils.PROBES", {}), patch("smdba.utils.PROBE_CACHE", cache), \
+                patch("smdba.utils.os.popen", popen):
+            assert smdba.utils.get_binary_version(str(binary)) == [16, 2]
+            assert smdba.utils.get_binary_version(str(binary)) == [16, 2]
+        assert not popen.called
+
+        binary.setmtime(binary.mtime() - 10)
+        with patch("smdba.utils.PROBES", {}), patch("smdba.utils.PROBE_CACHE", cache):
+            assert smdba.utils.get_binary_version(str(binary)) == [16, 2]
+            assert smdba.utils.get_binary_version(str(tmpdir.join("missing"))) == []
+
+    def test_table_print(self):
+        """
+        Table is formatted with the widths of the widest cells.
+
+        :return:
+        """
+        table = smdba.utils.TablePrint([("Table", "Size"), ("rhnpackage", "1M"), ("rhnchannel", 22)])
+        assert str(table) == "Table      | Size\n-----------+-----\nrhnpackage | 1M  \nrhnchannel | 22  "
+
+        with pytest.raises(Exception):
+            str(smdba.utils.TablePrint([("Table", "Size"), ("rhnpackage",)]))
+        with pytest.raises(Exception):
+            str(smdba.utils.TablePrint([]))
+
+    def test_table_print_stream(self):
+        """
+        Rows after the sample are written as they come, truncated to the sampled widths.
+
+        :return:
+        """
+        def rows():
+            yield "Table", "Size"
+            yield "rhnpackage", "1M"
+            yield "rhnchannelfamily", "2M"
+            raise AssertionError("Limited table is read further")
+
+        out = io.StringIO()
+        smdba.utils.TablePrint(rows(), sample=1, limit=2).write(out)
+        assert out.getvalue() == "Table      | Size\n-----------+-----\nrhnpackage | 1M  \nrhnchanne~ | 2M  "
+
+        table = smdba.utils.TablePrint([("A", "B")] + [(idx, idx) for idx in range(10)], offset=3, limit=2)
+        assert str(table).split("\n")[2:] == ["3 | 3", "4 | 4"]